@@ -1,6 +1,7 @@
 import os
 import config
 import re
+import json
 import time
 from datetime import datetime
 import google.generativeai as genai
@@ -8,7 +9,7 @@ import yfinance as yf
 import traceback
 from typing import Optional, List
 import requests
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, make_response
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, make_response, Response, stream_with_context
 from flask_cors import CORS
 from flask_session import Session
 import firebase_admin
@@ -187,6 +188,31 @@ def get_stock_price_endpoint(ticker):
     except Exception as e: print(f"[Error] API Error /stock/price/{ticker}: {traceback.format_exc()}"); return jsonify({"error": str(e)}), 500
 
 # Watchlist Endpoints
+def format_watchlist_rows(tickers, quotes):
+    """Builds the watchlist table rows from bulk quotes (shared with the ASGI server)."""
+    details = []
+    for t in tickers:
+        quote = quotes.get(t)
+        
+        if quote is None:  
+            print(f"      [Warning] Missing watchlist data {t}.")
+            details.append({"ticker": t, "price": "N/A", "change": "N/A", "dayRange": "N/A"})
+            continue
+        try:
+            dl, dh = quote['day_low'], quote['day_high']
+            
+            item = {
+                "ticker": t, 
+                "price": quote['price'], 
+                "change": quote['change_percentage'],
+                "dayRange": f"₹{dl:.{config.PRICE_DECIMAL_PLACES}f} - ₹{dh:.{config.PRICE_DECIMAL_PLACES}f}" if dl and dh else "N/A"
+            }
+            details.append(item)
+        except Exception as e:  
+            print(f"      [Error] Error processing watchlist {t}: {e}")
+            details.append({"ticker": t, "price": "Error", "change": "Error", "dayRange": "Error"})
+    return details
+
 @app.route('/api/watchlist/<user_id>', methods=['GET'])
 @auth_required
 def get_watchlist_endpoint(user_id):
@@ -196,46 +222,7 @@ def get_watchlist_endpoint(user_id):
         
         if not tickers: return jsonify([])
         
-        details = []
-        prices = get_bulk_live_prices(tickers)
-        
-        infos = {}
-        max_w = min(10, len(tickers) if len(tickers) > 0 else 1)  
-        with ThreadPoolExecutor(max_workers=max_w) as executor:
-            future_to_ticker = {executor.submit(get_ticker_info, t): t for t in tickers}
-            for future in concurrent.futures.as_completed(future_to_ticker):
-                ticker = future_to_ticker[future]
-                try:
-                    infos[ticker] = future.result()
-                except Exception as e:
-                    print(f"      [Warning] Parallel watchlist fetch error for {ticker}: {e}")
-                    infos[ticker] = None
-
-        for t in tickers:
-            cp = prices.get(t)
-            info = infos.get(t)
-            
-            if cp is None or info is None:  
-                print(f"      [Warning] Missing watchlist data {t}.")
-                details.append({"ticker": t, "price": "N/A", "change": "N/A", "dayRange": "N/A"})
-                continue
-            try:
-                pc = info.get('previousClose', cp)
-                change = ((cp - pc) / pc) * 100 if pc and pc != 0 else 0
-                dl, dh = info.get('dayLow', cp), info.get('dayHigh', cp)
-                
-                item = {
-                    "ticker": t, 
-                    "price": round(cp, config.PRICE_DECIMAL_PLACES), 
-                    "change": round(change, 2),
-                    "dayRange": f"₹{dl:.{config.PRICE_DECIMAL_PLACES}f} - ₹{dh:.{config.PRICE_DECIMAL_PLACES}f}" if dl and dh else "N/A"
-                }
-                details.append(item)
-            except Exception as e:  
-                print(f"      [Error] Error processing watchlist {t}: {e}")
-                details.append({"ticker": t, "price": "Error", "change": "Error", "dayRange": "Error"})
-                
-        return jsonify(details)
+        return jsonify(format_watchlist_rows(tickers, get_bulk_quotes(tickers)))
     except Exception as e:  
         print(f"\n[Error] CRITICAL WATCHLIST GET ERROR {user_id}: {traceback.format_exc()}\n")
         return jsonify({"error": str(e)}), 500
@@ -300,6 +287,11 @@ def get_frontend_config():
         }
     })
     
+@app.route('/api/cache/stats', methods=['GET'])
+@auth_required
+def get_cache_stats_endpoint():
+    return jsonify(get_cache_stats())
+
 @app.route('/api/zerodha/callback', methods=['GET'])
 def zerodha_callback():
     if not db: return "Error: Database not available.", 503
@@ -445,335 +437,514 @@ def rename_chat_endpoint(user_id, chat_id):
         return jsonify({"error": str(e)}), 500
 
 # --- Main Chat Handler (using Gemini) ---
-@app.route('/api/chat', methods=['POST'])
-def chat_handler():
-    if not db: return jsonify({"error": "Database not configured"}), 503
-    
-    try:
-        data = request.get_json()
-        user_id, user_message, chat_id = data.get('userId'), data.get('message'), data.get('chatId')
-
-        # --- AUTHENTICATION ---
-        if not config.DEBUG_MODE:
-            auth_header = request.headers.get('Authorization')
-            if not auth_header: return jsonify({"error": "No Auth Header"}), 401
-            id_token = auth_header.split('Bearer ')[-1]
-            if config.DB_MODE == 'LOCAL':
-                if id_token != user_id: pass 
-            else:
-                try:
-                    auth.verify_id_token(id_token) 
-                except: return jsonify({"error": "Auth Failed"}), 401
-        
-        if not user_message.strip(): return jsonify({"error": "Empty message"}), 400
-
-        # --- TOKEN LIMIT CHECK ---
-        token_status = db.check_token_access(user_id)
-        if not token_status['allowed']:
-            return jsonify({
-                "error": "TOKEN_LIMIT_EXCEEDED", 
-                "message": "Free token limit exceeded.",
-                "days_remaining": token_status['days_remaining']
-            }), 403
-
-        # --- DB SAVE (User Message) ---
+def _verify_chat_auth(user_id, auth_header):
+    """Returns an (error_payload, status) tuple if the chat request is not authenticated, else None."""
+    if config.DEBUG_MODE: return None
+    if not auth_header: return {"error": "No Auth Header"}, 401
+    id_token = auth_header.split('Bearer ')[-1]
+    if config.DB_MODE == 'LOCAL':
+        if id_token != user_id: pass 
+    else:
         try:
-            if not chat_id:
-                title = user_message[:config.CHAT_TITLE_LENGTH] + "..."
-                chat_id = db.create_chat(user_id, title, user_message, first_msg_role='user')
-            else:
-                db.add_message(user_id, chat_id, 'user', user_message)
-        except: return jsonify({"error": "Database error"}), 500
-
-        # ============================================
-        # AGENT TOOLS
-        # ============================================
-        
-        # Tool wrappers for the Agent (mapping agent calls to tool functions)
-        def execute_trade_for_agent(ticker: str, quantity: int, action: str) -> dict:
-            return execute_trade(user_id, ticker, quantity, action)
-        
-        def get_portfolio_for_agent() -> dict:
-            try: return get_portfolio(user_id)
-            except Exception as e: return {"error": str(e)}
-            
-        def manage_watchlist_for_agent(ticker: str, action: str) -> dict:
-            if action.upper() == 'ADD': return add_to_watchlist(user_id, [ticker])
-            elif action.upper() == 'REMOVE': return remove_from_watchlist(user_id, ticker)
-            return {"error": "Invalid action"}
-            
-        def get_watchlist_for_agent_wrapper() -> dict:
-            return get_watchlist_for_agent(user_id)
-
-        def sync_zerodha_portfolio_for_agent() -> dict:
-            if not db: return {"error": "DB unavailable"}
-            try:
-                user_doc = db.get_user(user_id)
-                if not user_doc or not user_doc.get('zerodha_access_token'):
-                    return {"error": "Zerodha not connected", "connect_url": f"/api/zerodha/connect/{user_id}"}
-                return sync_zerodha_portfolio(user_id, user_doc.get('zerodha_access_token'))
-            except Exception as e: return {"error": str(e)}
-
-        
-        def get_index_constituents_for_agent(index_name: str) -> dict:
-            return get_index_constituents(index_name)
-            
-        def fetch_news_for_agent(query: str) -> dict:
-            result = internet_search_news(query)
-            if "error" not in result and result.get('articles'): return result
-            return get_stock_news(query)
-            
-        def get_stock_chart_details_for_agent(ticker: str, period: str = "1y") -> dict:
-            return get_stock_chart_details(ticker, period)
-            
-        def internet_search_for_agent(query: str) -> dict:
-            try: return internet_search(query)
-            except Exception as e: return {"error": str(e)}
-
-        def simulate_investment_for_agent(ticker: str, amount: float, years: int, mode: str = 'lumpsum') -> dict:
-            return simulate_investment(ticker, amount, years, mode)
-
-        def project_portfolio_performance_for_agent(direction: str, duration_months: int = 12) -> dict:
-            return project_portfolio_performance(user_id, direction, duration_months)
-
-        chat_history = [{'role': 'user', 'parts': [{'text': config.SYSTEM_INSTRUCTION}]}]
+            auth.verify_id_token(id_token) 
+        except: return {"error": "Auth Failed"}, 401
+    return None
+
+def _start_chat_turn(data, auth_header):
+    """
+    Request handling shared by the chat endpoints (Flask and ASGI): auth, token
+    limit, chat history, and the (deferred) save of the user's message.
+
+    Returns:
+        tuple: (turn, None) where turn has user_id, message, chat_id and history,
+               or (None, (error_payload, status)) if the request is rejected.
+    """
+    data = data or {}
+    user_id, user_message, chat_id = data.get('userId'), data.get('message'), data.get('chatId')
+
+    # --- AUTHENTICATION ---
+    auth_error = _verify_chat_auth(user_id, auth_header)
+    if auth_error: return None, auth_error
+    
+    if not user_message or not user_message.strip(): return None, ({"error": "Empty message"}, 400)
+
+    # --- TOKEN LIMIT CHECK ---
+    token_status = db.check_token_access(user_id)
+    if not token_status['allowed']:
+        return None, ({
+            "error": "TOKEN_LIMIT_EXCEEDED", 
+            "message": "Free token limit exceeded.",
+            "days_remaining": token_status['days_remaining']
+        }, 403)
+
+    # --- HISTORY (read before queueing this turn's writes) ---
+    chat_history = [{'role': 'user', 'parts': [{'text': config.SYSTEM_INSTRUCTION}]}]
+    if chat_id:
         try:
             raw_msgs = db.get_chat_messages(user_id, chat_id)
-            recent = raw_msgs[-16:-1] if raw_msgs else []
+            recent = raw_msgs[-15:] if raw_msgs else []
             for m in recent:
                 chat_history.append({'role': 'user' if m['role'] == 'user' else 'model', 'parts': [{'text': m['text']}]})
         except: pass
 
-        
-        # --- CALL AI ---
-        model = genai.GenerativeModel(
-            model_name=config.GEMINI_MODEL_NAME,
-            tools=[
-                screen_static_index, screen_custom_stock_list, get_index_constituents_for_agent,
-                get_current_price, execute_trade_for_agent, get_portfolio_for_agent,
-                get_fundamental_data, manage_watchlist_for_agent, fetch_news_for_agent,
-                internet_search_for_agent, find_intraday_trade_setups, get_index_data_for_agent,
-                sync_zerodha_portfolio_for_agent, get_watchlist_for_agent_wrapper,simulate_investment_for_agent,project_portfolio_performance_for_agent,get_stock_chart_details_for_agent,
-                deep_screen_and_analyze
-            ]
-        )
-        
-        chat_session = model.start_chat(history=chat_history, enable_automatic_function_calling=True)
-        
-        # Track history before sending message to identify new turns
-        pre_chat_len = len(chat_session.history)
-        
-        response = chat_session.send_message(user_message)
-        
-        # --- EXTRACT METADATA ---
-        input_tokens = output_tokens = total_tokens = 0
-        if hasattr(response, 'usage_metadata'):
-            input_tokens = response.usage_metadata.prompt_token_count
-            output_tokens = response.usage_metadata.candidates_token_count
-            total_tokens = response.usage_metadata.total_token_count
-
-        tools_used = [] # We will populate this from the chain as well
-
-        agent_reply = ""
-        if response.candidates and response.candidates[0].content.parts:
-            agent_reply = "".join(p.text for p in response.candidates[0].content.parts if p.text)
-        
-        if not agent_reply: agent_reply = "I processed your request."
-
-        # --- EXTRACT & SEPARATE THOUGHTS ---
-        thought_content = ""
-        final_reply_for_user = agent_reply
-
-        # Robust extraction of <thought> tags (handling multiple blocks if necessary)
-        # We want to collect all thoughts for the console, but remove them all from the user reply.
-        thoughts_collected = []
-        while "<thought>" in final_reply_for_user and "</thought>" in final_reply_for_user:
-            start = final_reply_for_user.find("<thought>")
-            end = final_reply_for_user.find("</thought>")
-            if start != -1 and end != -1:
-                chunk = final_reply_for_user[start+len("<thought>"):end].strip()
-                thoughts_collected.append(chunk)
-                # Remove from the user reply
-                final_reply_for_user = final_reply_for_user[:start] + final_reply_for_user[end+len("</thought>"):]
-            else:
-                break 
-        
-        final_reply_for_user = final_reply_for_user.strip()
+    # --- DB SAVE (User Message, committed by the write-behind flusher) ---
+    try:
+        if not chat_id:
+            title = user_message[:config.CHAT_TITLE_LENGTH] + "..."
+            chat_id = db.create_chat(user_id, title, user_message, first_msg_role='user', defer=True)
+        else:
+            db.add_message(user_id, chat_id, 'user', user_message, defer=True)
+    except: return None, ({"error": "Database error"}, 500)
 
-        # ======================================================
-        # IMPROVED TERMINAL OUTPUT LOGGING (STEP-BY-STEP)
-        # ======================================================
-        import textwrap
-        
-        WIDTH = 80
-        BORDER = "═" * WIDTH
-        DIVIDER = "─" * WIDTH
-        
-        def print_wrapped(text, width, indent="║    │ "):
-            # Split into paragraphs to preserve existing line breaks
-            paragraphs = text.split('\n')
-            for i, p in enumerate(paragraphs):
-                if not p.strip(): 
-                    # Print distinct empty lines for gaps between paragraphs
-                    print(indent.replace("│", " ")) 
-                    continue
-                
-                # Wrap each paragraph individually
-                lines = textwrap.wrap(p, width=width)
-                for line in lines:
-                    print(f"{indent}{line}")
-                
-        print("\n" + "╔" + BORDER + "╗")
-        print(f"║ 🤖 GEMINI AGENT INTERACTION REPORT ({config.DB_MODE.center(8)}) {'║'.rjust(WIDTH - 39)}")
-        print("╠" + BORDER + "╣")
-        
-        # 1. USER INPUT
-        print("║ 👤 USER INPUT:")
-        print(f"║ {DIVIDER}")
-        
-        print_wrapped(user_message, WIDTH-9, indent="║    ")
-        print("║")
+    return {"user_id": user_id, "message": user_message, "chat_id": chat_id, "history": chat_history}, None
 
+def _build_agent_tools(user_id):
+    """Returns the tool functions exposed to the agent, bound to `user_id` where needed."""
 
-        # 2. EXECUTION CHAIN (Loop)
-        print("╠" + BORDER + "╣")
-        print("║ ⛓️ EXECUTION CHAIN (Thought -> Tool -> Result):")
-        print(f"║ {DIVIDER}")
-        
-        # Iterate through new history items
-        new_history = chat_session.history[pre_chat_len:]
+    # Tool wrappers for the Agent (mapping agent calls to tool functions)
+    def execute_trade_for_agent(ticker: str, quantity: int, action: str) -> dict:
+        return execute_trade(user_id, ticker, quantity, action)
+    
+    def get_portfolio_for_agent() -> dict:
+        try: return get_portfolio(user_id)
+        except Exception as e: return {"error": str(e)}
         
-        step_count = 1
+    def manage_watchlist_for_agent(ticker: str, action: str) -> dict:
+        if action.upper() == 'ADD': return add_to_watchlist(user_id, [ticker])
+        elif action.upper() == 'REMOVE': return remove_from_watchlist(user_id, ticker)
+        return {"error": "Invalid action"}
         
-        for msg in new_history:
-            role = msg.role
-            parts = msg.parts
+    def get_watchlist_for_agent_wrapper() -> dict:
+        return get_watchlist_for_agent(user_id)
+
+    def sync_zerodha_portfolio_for_agent() -> dict:
+        if not db: return {"error": "DB unavailable"}
+        try:
+            user_doc = db.get_user(user_id)
+            if not user_doc or not user_doc.get('zerodha_access_token'):
+                return {"error": "Zerodha not connected", "connect_url": f"/api/zerodha/connect/{user_id}"}
+            return sync_zerodha_portfolio(user_id, user_doc.get('zerodha_access_token'))
+        except Exception as e: return {"error": str(e)}
+
+    
+    def get_index_constituents_for_agent(index_name: str) -> dict:
+        return get_index_constituents(index_name)
+        
+    def fetch_news_for_agent(query: str) -> dict:
+        result = internet_search_news(query)
+        if "error" not in result and result.get('articles'): return result
+        return get_stock_news(query)
+        
+    def get_stock_chart_details_for_agent(ticker: str, period: str = "1y") -> dict:
+        return get_stock_chart_details(ticker, period)
+        
+    def internet_search_for_agent(query: str) -> dict:
+        try: return internet_search(query)
+        except Exception as e: return {"error": str(e)}
+
+    def simulate_investment_for_agent(ticker: str, amount: float, years: int, mode: str = 'lumpsum') -> dict:
+        return simulate_investment(ticker, amount, years, mode)
+
+    def project_portfolio_performance_for_agent(direction: str, duration_months: int = 12) -> dict:
+        return project_portfolio_performance(user_id, direction, duration_months)
+
+    return [
+        screen_static_index, screen_custom_stock_list, get_index_constituents_for_agent,
+        get_current_price, execute_trade_for_agent, get_portfolio_for_agent,
+        get_fundamental_data, manage_watchlist_for_agent, fetch_news_for_agent,
+        internet_search_for_agent, find_intraday_trade_setups, get_index_data_for_agent,
+        sync_zerodha_portfolio_for_agent, get_watchlist_for_agent_wrapper,simulate_investment_for_agent,project_portfolio_performance_for_agent,get_stock_chart_details_for_agent,
+        deep_screen_and_analyze
+    ]
+
+class _ThoughtStreamFilter:
+    """
+    Separates <thought>...</thought> blocks from the reply: feed it text
+    chunks and it returns ('text', ...) and ('thought', ...) events. Anything that could be
+    the start of a tag split across chunks is held back until the next chunk.
+    """
+    OPEN, CLOSE = "<thought>", "</thought>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_thought = False
+
+    @staticmethod
+    def _partial_tag(text, tag):
+        # Length of the longest suffix of `text` that is a proper prefix of `tag`
+        for k in range(min(len(tag) - 1, len(text)), 0, -1):
+            if text.endswith(tag[:k]): return k
+        return 0
+
+    def feed(self, text):
+        events = []
+        self.buffer += text
+        while True:
+            if self.in_thought:
+                end = self.buffer.find(self.CLOSE)
+                if end == -1: break
+                events.append(('thought', self.buffer[:end].strip()))
+                self.buffer = self.buffer[end + len(self.CLOSE):]
+                self.in_thought = False
+            else:
+                start = self.buffer.find(self.OPEN)
+                if start == -1:
+                    keep = self._partial_tag(self.buffer, self.OPEN)
+                    visible = self.buffer[:len(self.buffer) - keep]
+                    if visible: events.append(('text', visible))
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                if start: events.append(('text', self.buffer[:start]))
+                self.buffer = self.buffer[start + len(self.OPEN):]
+                self.in_thought = True
+        return events
+
+    def finish(self):
+        # An unclosed <thought> stays in the reply
+        rest = (self.OPEN if self.in_thought else "") + self.buffer
+        self.buffer, self.in_thought = "", False
+        return [('text', rest)] if rest else []
+
+def _print_agent_report(user_message, new_history, final_reply_for_user, input_tokens, output_tokens, total_tokens):
+    """
+    Prints the step-by-step console report for one agent turn.
+
+    Returns:
+        list: Names of the tools called during the turn (deduplicated).
+    """
+    import textwrap
+    
+    tools_used = []
+    WIDTH = 80
+    BORDER = "═" * WIDTH
+    DIVIDER = "─" * WIDTH
+    
+    def print_wrapped(text, width, indent="║    │ "):
+        # Split into paragraphs to preserve existing line breaks
+        paragraphs = text.split('\n')
+        for i, p in enumerate(paragraphs):
+            if not p.strip(): 
+                # Print distinct empty lines for gaps between paragraphs
+                print(indent.replace("│", " ")) 
+                continue
             
-            for p in parts:
-                # -- MODEL THOUGHTS & TEXT --
-                if role == 'model' and p.text:
-                    text_content = p.text.strip()
-                    # Check for thoughts in this chunk
-                    if "<thought>" in text_content:
-                        t_start = text_content.find("<thought>") + len("<thought>")
-                        t_end = text_content.find("</thought>")
-                        if t_end != -1:
-                            thought_text = text_content[t_start:t_end].strip()
-                            # Print thought with distinct styling
-                            print(f"║    ┌─ [Step {step_count}] 🧠 THOUGHT ──────────────────────────────")
-                            print_wrapped(thought_text, WIDTH-12, indent="║    │ ")
-                            print(f"║    └─────────────────────────────────────────────────────")
-                            print("║                        ⬇️")
-                            step_count += 1
-                            
-                # -- FUNCTION CALL --
-                if role == 'model' and hasattr(p, 'function_call') and p.function_call:
-                    fname = p.function_call.name
-                    fargs = p.function_call.args
-                    tools_used.append(fname)
-                    
-                    print(f"║    ┌─ [Step {step_count}] 🛠️  TOOL CALL: {fname} ──────────────")
-                    try:
-                        # Format args nicely
-                        import json
-                        # Convert MapComposite to dict if needed, or just use dict()
-                        args_dict = dict(fargs)
-                        # Use json dumps for prettier printing if possible, else str
-                        args_str = json.dumps(args_dict, indent=2)
-                        
-                        # Custom print for args to handle indent
-                        arg_lines = args_str.split('\n')
-                        for l in arg_lines:
-                             # simplistic wrap if line is too long, though json indent helps
-                             if len(l) > WIDTH-12: l = l[:WIDTH-15] + "..."
-                             print(f"║    │ {l}")
-                    except: 
-                        print(f"║    │ Args: {str(dict(fargs))}")
+            # Wrap each paragraph individually
+            lines = textwrap.wrap(p, width=width)
+            for line in lines:
+                print(f"{indent}{line}")
+            
+    print("\n" + "╔" + BORDER + "╗")
+    print(f"║ 🤖 GEMINI AGENT INTERACTION REPORT ({config.DB_MODE.center(8)}) {'║'.rjust(WIDTH - 39)}")
+    print("╠" + BORDER + "╣")
+    
+    # 1. USER INPUT
+    print("║ 👤 USER INPUT:")
+    print(f"║ {DIVIDER}")
+    
+    print_wrapped(user_message, WIDTH-9, indent="║    ")
+    print("║")
+
+
+    # 2. EXECUTION CHAIN (Loop)
+    print("╠" + BORDER + "╣")
+    print("║ ⛓️ EXECUTION CHAIN (Thought -> Tool -> Result):")
+    print(f"║ {DIVIDER}")
+    
+    step_count = 1
+    
+    for msg in new_history:
+        role = msg.role
+        parts = msg.parts
+        
+        for p in parts:
+            # -- MODEL THOUGHTS & TEXT --
+            if role == 'model' and p.text:
+                text_content = p.text.strip()
+                # Check for thoughts in this chunk
+                if "<thought>" in text_content:
+                    t_start = text_content.find("<thought>") + len("<thought>")
+                    t_end = text_content.find("</thought>")
+                    if t_end != -1:
+                        thought_text = text_content[t_start:t_end].strip()
+                        # Print thought with distinct styling
+                        print(f"║    ┌─ [Step {step_count}] 🧠 THOUGHT ──────────────────────────────")
+                        print_wrapped(thought_text, WIDTH-12, indent="║    │ ")
+                        print(f"║    └─────────────────────────────────────────────────────")
+                        print("║                        ⬇️")
+                        step_count += 1
                         
-                    print(f"║    └─────────────────────────────────────────────────────")
-                    print("║                        ⬇️")
-                    step_count += 1
-
-                # -- FUNCTION RESPONSE --
-                if role == 'function' and hasattr(p, 'function_response') and p.function_response:
-                    fname = p.function_response.name
-                    # The actual response content is inside 'response' dict usually
-                    resp_content = "Result received."
-                    try:
-                        if hasattr(p.function_response, 'response'):
-                             resp_content = str(p.function_response.response)
-                    except: pass
-                    
-                    print(f"║    ┌─ [Step {step_count}] ⚙️  TOOL RESULT ({fname}) ────────────")
+            # -- FUNCTION CALL --
+            if role == 'model' and hasattr(p, 'function_call') and p.function_call:
+                fname = p.function_call.name
+                fargs = p.function_call.args
+                tools_used.append(fname)
+                
+                print(f"║    ┌─ [Step {step_count}] 🛠️  TOOL CALL: {fname} ──────────────")
+                try:
+                    # Convert MapComposite to dict if needed, or just use dict()
+                    args_dict = dict(fargs)
+                    # Use json dumps for prettier printing if possible, else str
+                    args_str = json.dumps(args_dict, indent=2)
                     
-                    # Truncate for result to avoid flooding console
-                    if len(resp_content) > 800:
-                        resp_content = resp_content[:800] + "\n... [Output Truncated]"
+                    # Custom print for args to handle indent
+                    arg_lines = args_str.split('\n')
+                    for l in arg_lines:
+                         # simplistic wrap if line is too long, though json indent helps
+                         if len(l) > WIDTH-12: l = l[:WIDTH-15] + "..."
+                         print(f"║    │ {l}")
+                except: 
+                    print(f"║    │ Args: {str(dict(fargs))}")
                     
-                    print_wrapped(resp_content, WIDTH-12, indent="║    │ ")
-                    print(f"║    └─────────────────────────────────────────────────────")
-                    print("║                        ⬇️")
-                    step_count += 1
+                print(f"║    └─────────────────────────────────────────────────────")
+                print("║                        ⬇️")
+                step_count += 1
+
+            # -- FUNCTION RESPONSE --
+            # (role is 'function' with automatic function calling, 'user' when responses are sent manually)
+            if hasattr(p, 'function_response') and p.function_response:
+                fname = p.function_response.name
+                # The actual response content is inside 'response' dict usually
+                resp_content = "Result received."
+                try:
+                    if hasattr(p.function_response, 'response'):
+                         resp_content = str(p.function_response.response)
+                except: pass
+                
+                print(f"║    ┌─ [Step {step_count}] ⚙️  TOOL RESULT ({fname}) ────────────")
+                
+                # Truncate for result to avoid flooding console
+                if len(resp_content) > 800:
+                    resp_content = resp_content[:800] + "\n... [Output Truncated]"
+                
+                print_wrapped(resp_content, WIDTH-12, indent="║    │ ")
+                print(f"║    └─────────────────────────────────────────────────────")
+                print("║                        ⬇️")
+                step_count += 1
 
-        print("║")
-        
-        # 3. FINAL RESPONSE (Snippet)
-        print("╠" + BORDER + "╣")
-        print("║ 💬 FINAL RESPONSE TO USER (Clean):")
-        print(f"║ {DIVIDER}")
-        clean_reply_snippet = final_reply_for_user.replace('\n', ' ')
-        
-        # Cap visual output to just 3 lines to keep it clean as per user request
-        r_lines = textwrap.wrap(clean_reply_snippet, width=WIDTH-9)
-        for i, l in enumerate(r_lines):
-            if i >= 3:
-                print(f"║    ... [Rest of response hidden]")
-                break
-            print(f"║    {l}")
-            
-        print("║")
-        
-        tools_used = list(set(tools_used))
-
-        # 4. STATS
-        print("╠" + BORDER + "╣")
-        print(f"║ 📊 STATS: Tools: {len(tools_used)} | In: {input_tokens} | Out: {output_tokens} | Total: {total_tokens}")
-        print("╚" + BORDER + "╝" + "\n")
-        # ======================================================
-
-        # Construct Metadata
-        metadata = {
-            "tokenUsage": {
-                "inputTokens": input_tokens,
-                "outputTokens": output_tokens,
-                "totalTokens": total_tokens
-            },
-            "toolsUsed": tools_used
-        }
+    print("║")
+    
+    # 3. FINAL RESPONSE (Snippet)
+    print("╠" + BORDER + "╣")
+    print("║ 💬 FINAL RESPONSE TO USER (Clean):")
+    print(f"║ {DIVIDER}")
+    clean_reply_snippet = final_reply_for_user.replace('\n', ' ')
+    
+    # Cap visual output to just 3 lines to keep it clean as per user request
+    r_lines = textwrap.wrap(clean_reply_snippet, width=WIDTH-9)
+    for i, l in enumerate(r_lines):
+        if i >= 3:
+            print(f"║    ... [Rest of response hidden]")
+            break
+        print(f"║    {l}")
+        
+    print("║")
+    
+    tools_used = list(set(tools_used))
+
+    # 4. STATS
+    print("╠" + BORDER + "╣")
+    print(f"║ 📊 STATS: Tools: {len(tools_used)} | In: {input_tokens} | Out: {output_tokens} | Total: {total_tokens}")
+    print("╚" + BORDER + "╝" + "\n")
+    return tools_used
+
+def _finish_chat_turn(turn, final_reply_for_user, tools_used, input_tokens, output_tokens, total_tokens):
+    """Queues the reply and token usage for persistence and returns the client payload."""
+    token_usage = {
+        "inputTokens": input_tokens,
+        "outputTokens": output_tokens,
+        "totalTokens": total_tokens
+    }
+    metadata = {"tokenUsage": token_usage, "toolsUsed": tools_used}
+
+    db.add_message(turn['user_id'], turn['chat_id'], 'model', final_reply_for_user, metadata, defer=True)
+    db.update_user_tokens(turn['user_id'], input_tokens, output_tokens, defer=True)
+
+    return {
+        "reply": final_reply_for_user,
+        "chatId": turn['chat_id'],
+        "toolsUsed": tools_used,
+        "tokenUsage": token_usage
+    }
+
+def _print_critical_error(e):
+    print("\n" + "!"*60)
+    print(f"CRITICAL ERROR:")
+    print(f"   {str(e)}")
+    print(f"   {traceback.format_exc()}")       
+    print("-" * 60)          
+    print("!"*60 + "\n")
 
-        db.add_message(user_id, chat_id, 'model', final_reply_for_user, metadata)
-        db.update_user_tokens(user_id, input_tokens, output_tokens)
-
-        return jsonify({
-            "reply": final_reply_for_user,
-            "chatId": chat_id,
-            "toolsUsed": tools_used,
-            "tokenUsage": {
-                "inputTokens": input_tokens, 
-                "outputTokens": output_tokens, 
-                "totalTokens": total_tokens
-            }
-        })
+@app.route('/api/chat', methods=['POST'])
+def chat_handler():
+    if not db: return jsonify({"error": "Database not configured"}), 503
+    
+    try:
+        turn, error = _start_chat_turn(request.get_json(), request.headers.get('Authorization'))
+        if error: return jsonify(error[0]), error[1]
+        
+        # Same loop as the stream, so token usage is summed over every model round
+        agent = _AgentStream(turn, _build_agent_tools(turn['user_id']))
+        for event, data in _agent_events(agent):
+            if event == 'done': return jsonify(data)
+        return jsonify({"error": "Server Error"}), 500
     
     except Exception as e:
-        print("\n" + "!"*60)
-        print(f"CRITICAL ERROR:")
-        print(f"   {str(e)}")
-        print(f"   {traceback.format_exc()}")       
-        print("-" * 60)          
-        print("!"*60 + "\n")
+        _print_critical_error(e)
         return jsonify({"error": "Server Error"}), 500
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _run_agent_tool(functions, fc):
+    """Runs one function call from the model; errors are returned to the model instead of raised."""
+    fn = functions.get(fc.name)
+    if fn is None: return {"error": f"Unknown tool: {fc.name}"}
+    try:
+        result = fn(**fc.args)
+    except Exception as e:
+        print(f"[Error] Tool {fc.name} failed: {e}")
+        result = {"error": str(e)}
+    return _normalize_tool_result(result)
+
+def _normalize_tool_result(result):
+    if not isinstance(result, dict):
+        result = {"result": result}
+    # Round-trip through JSON so numpy/pandas scalars become plain protobuf-friendly values
+    return json.loads(json.dumps(result, default=str))
+
+class _AgentStream:
+    """
+    State of one streamed agent turn, shared by the Flask and ASGI streaming
+    loops (which only differ in how they call the model and run tools).
+    Methods return (event, data) pairs for the client.
+    """
+
+    def __init__(self, turn, agent_tools):
+        self.turn = turn
+        self.tools = agent_tools
+        self.functions = {fn.__name__: fn for fn in agent_tools}
+        self.thoughts = _ThoughtStreamFilter()
+        self.reply_parts = []
+        self.called_tools = []
+        self.input_tokens = self.output_tokens = self.total_tokens = 0
+
+    def _text_events(self, events):
+        out = []
+        for kind, text in events:
+            if kind == 'thought':
+                out.append(('thought', {"text": text}))
+                continue
+            if not self.reply_parts: text = text.lstrip()
+            if text:
+                self.reply_parts.append(text)
+                out.append(('text', {"delta": text}))
+        return out
+
+    def on_chunk(self, chunk, calls):
+        """Handles one streamed chunk; function calls are appended to `calls`."""
+        events = []
+        parts = chunk.candidates[0].content.parts if chunk.candidates else []
+        for part in parts:
+            if "function_call" in part:
+                calls.append(part.function_call)
+            elif part.text:
+                events += self._text_events(self.thoughts.feed(part.text))
+        return events
+
+    def on_round_end(self, usage):
+        if usage:
+            # Each round re-sends the conversation, so every round's prompt is billed
+            self.input_tokens += usage.prompt_token_count
+            self.output_tokens += usage.candidates_token_count
+            self.total_tokens += usage.total_token_count
+
+    def tool_call(self, fc):
+        self.called_tools.append(fc.name)
+        return ('tool_call', {"name": fc.name, "args": dict(fc.args)})
+
+    def tool_result(self, fc, result):
+        """Returns the client event and the function_response part to send back to the model."""
+        part = genai.protos.Part(function_response=genai.protos.FunctionResponse(name=fc.name, response=result))
+        return ('tool_result', {"name": fc.name, "result": json.dumps(result, default=str)[:2000]}), part
+
+    def flush_text(self):
+        return self._text_events(self.thoughts.finish())
+
+    def complete(self, new_history):
+        """Prints the console report, queues persistence and returns the final payload."""
+        final_reply_for_user = "".join(self.reply_parts).strip() or "I processed your request."
+        tools_used = _print_agent_report(self.turn['message'], new_history, final_reply_for_user,
+                                         self.input_tokens, self.output_tokens, self.total_tokens)
+        tools_used = list(set(tools_used) | set(self.called_tools))
+        return _finish_chat_turn(self.turn, final_reply_for_user, tools_used,
+                                 self.input_tokens, self.output_tokens, self.total_tokens)
+
+def _agent_events(agent):
+    """
+    Runs one agent turn, yielding (event, data) pairs (see /api/chat/stream).
+
+    The function-calling loop is run manually (the SDK can't combine
+    automatic function calling with streaming); /api/chat uses it too so
+    both endpoints bill the same tokens: every round's usage, summed.
+    """
+    model = genai.GenerativeModel(model_name=config.GEMINI_MODEL_NAME, tools=agent.tools)
+    chat_session = model.start_chat(history=agent.turn['history'])
+    pre_chat_len = len(chat_session.history)
+
+    content = agent.turn['message']
+    for _ in range(config.CHAT_MAX_TOOL_ROUNDS):
+        response = chat_session.send_message(content, stream=True)
+        calls = []
+        for chunk in response:
+            for event in agent.on_chunk(chunk, calls): yield event
+        agent.on_round_end(response.usage_metadata)
+        if not calls: break
+
+        content = []
+        for fc in calls:
+            yield agent.tool_call(fc)
+            event, part = agent.tool_result(fc, _run_agent_tool(agent.functions, fc))
+            yield event
+            content.append(part)
+    else:
+        print(f"[Warning] Chat stream stopped after {config.CHAT_MAX_TOOL_ROUNDS} tool rounds.")
+
+    for event in agent.flush_text(): yield event
+    yield ('done', agent.complete(chat_session.history[pre_chat_len:]))
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_handler():
+    """
+    Streaming variant of /api/chat using Server-Sent Events.
+
+    Runs the function-calling loop manually (the SDK can't combine automatic
+    function calling with streaming) and emits, in order:
+        start {chatId}, thought {text}, tool_call {name, args},
+        tool_result {name, result}, text {delta}, then done with the same
+        payload /api/chat returns (or error {error}).
+    The reply is persisted and tokens are counted when the stream ends.
+    """
+    if not db: return jsonify({"error": "Database not configured"}), 503
+
+    try:
+        turn, error = _start_chat_turn(request.get_json(), request.headers.get('Authorization'))
+        if error: return jsonify(error[0]), error[1]
+        agent = _AgentStream(turn, _build_agent_tools(turn['user_id']))
+    except Exception as e:
+        _print_critical_error(e)
+        return jsonify({"error": "Server Error"}), 500
+
+    def generate():
+        yield _sse('start', {"chatId": turn['chat_id']})
+        try:
+            for event in _agent_events(agent): yield _sse(*event)
+        except Exception as e:
+            _print_critical_error(e)
+            yield _sse('error', {"error": "Server Error"})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 
 # ============================================
 # Main Execution Block
@@ -0,0 +1,268 @@
+import os
+import json
+import contextlib
+import traceback
+import config
+import google.generativeai as genai
+from firebase_admin import auth
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route, Mount
+from a2wsgi import WSGIMiddleware
+
+import async_clients
+import API_Server as flask_server
+from tools import db, internet_search_news, get_cache_stats
+
+# ============================================
+# ASGI entry point
+# ============================================
+# The I/O-bound /api/* routes below are served natively on the event loop;
+# every other route (trades, Zerodha, pages, ...) falls through to the Flask
+# app, which stays usable on its own via gunicorn (SERVER_MODE=wsgi).
+
+class _JSON(JSONResponse):
+    def render(self, content):
+        # Tool results may hold numpy scalars / timestamps, like Flask's jsonify would stringify
+        return json.dumps(content, default=str, ensure_ascii=False).encode("utf-8")
+
+
+def auth_required(f):
+    """Async counterpart of API_Server.auth_required."""
+    async def decorated_function(request):
+        if config.DEBUG_MODE: return await f(request)
+
+        auth_header = request.headers.get('Authorization')
+        if not auth_header: return _JSON({"error": "No Authorization header"}, 401)
+
+        try:
+            id_token = auth_header.split('Bearer ')[-1]
+            if config.DB_MODE != 'LOCAL':
+                await async_clients.run_io(auth.verify_id_token, id_token)
+        except Exception as e:
+            return _JSON({"error": f"Authentication failed: {str(e)}"}, 401)
+
+        return await f(request)
+
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+
+# --- MARKET DATA ---
+async def get_stock_price_endpoint(request):
+    ticker = request.path_params['ticker']
+    try:
+        price_data = await async_clients.get_current_price(ticker)
+        if price_data.get("error"):
+            return _JSON(price_data, 404)
+        return _JSON(price_data)
+    except ValueError as ve: return _JSON({"error": str(ve)}, 404)
+    except Exception as e: print(f"[Error] API Error /stock/price/{ticker}: {traceback.format_exc()}"); return _JSON({"error": str(e)}, 500)
+
+
+async def get_stock_fundamentals_endpoint(request):
+    ticker = request.path_params['ticker']
+    try:
+        funda_data = await async_clients.get_fundamental_data(ticker)
+        if funda_data.get("error"):
+            return _JSON(funda_data, 404)
+        return _JSON(funda_data)
+    except ValueError as ve: return _JSON({"error": str(ve)}, 404)
+    except Exception as e: print(f"[Error] API Error /stock/fundamentals/{ticker}: {traceback.format_exc()}"); return _JSON({"error": str(e)}, 500)
+
+
+@auth_required
+async def get_stock_analysis(request):
+    ticker = request.path_params['ticker']
+    timeframe = request.query_params.get('timeframe', '1D').lower()
+    indicators_str = request.query_params.get('indicators', 'rsi,ema,volume')
+    indicators = [ind.strip().lower() for ind in indicators_str.split(',') if ind.strip()]
+    try:
+        result = await async_clients.get_stock_analysis_data(ticker, timeframe, indicators)
+        if result.get("error"):
+            return _JSON(result, 404)
+        return _JSON(result)
+    except Exception as e:
+        print(f"Error in get_stock_analysis: {e}")
+        return _JSON({'error': str(e)}, 500)
+
+
+# --- PORTFOLIO & WATCHLIST ---
+@auth_required
+async def get_portfolio_endpoint(request):
+    user_id = request.path_params['user_id']
+    if not db: return _JSON({"error": "DB unavailable"}, 503)
+    try: return _JSON(await async_clients.get_portfolio(user_id))
+    except Exception as e: print(f"[Error] API Error /portfolio/{user_id}: {traceback.format_exc()}"); return _JSON({"error": str(e)}, 500)
+
+
+@auth_required
+async def get_watchlist_endpoint(request):
+    user_id = request.path_params['user_id']
+    if not db: return _JSON({"error": "DB unavailable"}, 503)
+    try:
+        tickers = await async_clients.run_io(db.get_watchlist, user_id)
+        if not tickers: return _JSON([])
+
+        return _JSON(flask_server.format_watchlist_rows(tickers, await async_clients.get_bulk_quotes(tickers)))
+    except Exception as e:
+        print(f"\n[Error] CRITICAL WATCHLIST GET ERROR {user_id}: {traceback.format_exc()}\n")
+        return _JSON({"error": str(e)}, 500)
+
+
+# --- CHATS ---
+@auth_required
+async def get_chat_list_endpoint(request):
+    user_id = request.path_params['user_id']
+    if not db: return _JSON({"error": "DB unavailable"}, 503)
+    try: return _JSON(await async_clients.run_io(db.get_chats, user_id))
+    except Exception as e: print(f"[Error] API Error /chats/{user_id}: {traceback.format_exc()}"); return _JSON({"error": str(e)}, 500)
+
+
+@auth_required
+async def get_chat_messages_endpoint(request):
+    user_id, chat_id = request.path_params['user_id'], request.path_params['chat_id']
+    if not db: return _JSON({"error": "DB unavailable"}, 503)
+    try: return _JSON(await async_clients.run_io(db.get_chat_messages, user_id, chat_id))
+    except Exception as e: print(f"[Error] API Error /chat/{user_id}/{chat_id}: {traceback.format_exc()}"); return _JSON({"error": str(e)}, 500)
+
+
+@auth_required
+async def get_cache_stats_endpoint(request):
+    # Collecting stats queries every cache backend (Redis included), so keep it off the event loop
+    stats = await async_clients.run_io(get_cache_stats)
+    return _JSON({**stats, "async": async_clients.stats()})
+
+
+# --- AGENT (Gemini over grpc.aio; blocking tools run on the I/O pool) ---
+async def _fetch_news_async(query: str) -> dict:
+    result = await async_clients.run_io(internet_search_news, query)
+    if "error" not in result and result.get('articles'): return result
+    return await async_clients.get_stock_news(query)
+
+# Tools with a native async implementation; everything else is offloaded as-is
+_ASYNC_TOOLS = {
+    'fetch_news_for_agent': _fetch_news_async,
+    'get_current_price': async_clients.get_current_price,
+    'get_fundamental_data': async_clients.get_fundamental_data,
+}
+
+
+async def _run_agent_tool(agent, fc):
+    fn = _ASYNC_TOOLS.get(fc.name)
+    if fn is None:
+        return await async_clients.run_io(flask_server._run_agent_tool, agent.functions, fc)
+    try:
+        result = await fn(**fc.args)
+    except Exception as e:
+        print(f"[Error] Tool {fc.name} failed: {e}")
+        result = {"error": str(e)}
+    return flask_server._normalize_tool_result(result)
+
+
+async def _agent_events(agent):
+    """Runs one agent turn on the event loop, yielding (event, data) pairs (see /api/chat/stream)."""
+    model = genai.GenerativeModel(model_name=config.GEMINI_MODEL_NAME, tools=agent.tools)
+    chat_session = model.start_chat(history=agent.turn['history'])
+    pre_chat_len = len(chat_session.history)
+
+    content = agent.turn['message']
+    for _ in range(config.CHAT_MAX_TOOL_ROUNDS):
+        response = await chat_session.send_message_async(content, stream=True)
+        calls = []
+        async for chunk in response:
+            for event in agent.on_chunk(chunk, calls): yield event
+        agent.on_round_end(response.usage_metadata)
+        if not calls: break
+
+        content = []
+        for fc in calls:
+            yield agent.tool_call(fc)
+            event, part = agent.tool_result(fc, await _run_agent_tool(agent, fc))
+            yield event
+            content.append(part)
+    else:
+        print(f"[Warning] Chat stream stopped after {config.CHAT_MAX_TOOL_ROUNDS} tool rounds.")
+
+    for event in agent.flush_text(): yield event
+    yield ('done', agent.complete(chat_session.history[pre_chat_len:]))
+
+
+async def _start_agent(request):
+    """Returns (agent, None) or (None, error_response)."""
+    if not db: return None, _JSON({"error": "Database not configured"}, 503)
+    try:
+        data = await request.json()
+    except Exception:
+        data = None
+    turn, error = await async_clients.run_io(flask_server._start_chat_turn, data, request.headers.get('Authorization'))
+    if error: return None, _JSON(error[0], error[1])
+    return flask_server._AgentStream(turn, flask_server._build_agent_tools(turn['user_id'])), None
+
+
+async def chat_handler(request):
+    try:
+        agent, error = await _start_agent(request)
+        if error: return error
+        async for event, data in _agent_events(agent):
+            if event == 'done': return _JSON(data)
+        return _JSON({"error": "Server Error"}, 500)
+    except Exception as e:
+        flask_server._print_critical_error(e)
+        return _JSON({"error": "Server Error"}, 500)
+
+
+async def chat_stream_handler(request):
+    try:
+        agent, error = await _start_agent(request)
+        if error: return error
+    except Exception as e:
+        flask_server._print_critical_error(e)
+        return _JSON({"error": "Server Error"}, 500)
+
+    async def generate():
+        yield flask_server._sse('start', {"chatId": agent.turn['chat_id']})
+        try:
+            async for event, data in _agent_events(agent):
+                yield flask_server._sse(event, data)
+        except Exception as e:
+            flask_server._print_critical_error(e)
+            yield flask_server._sse('error', {"error": "Server Error"})
+
+    return StreamingResponse(generate(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await async_clients.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/stock/price/{ticker}', get_stock_price_endpoint, methods=['GET']),
+        Route('/api/stock/fundamentals/{ticker}', get_stock_fundamentals_endpoint, methods=['GET']),
+        Route('/api/stock/analysis/{user_id}/{ticker}', get_stock_analysis, methods=['GET']),
+        Route('/api/portfolio/{user_id}', get_portfolio_endpoint, methods=['GET']),
+        Route('/api/watchlist/{user_id}', get_watchlist_endpoint, methods=['GET']),
+        Route('/api/chats/{user_id}', get_chat_list_endpoint, methods=['GET']),
+        Route('/api/chat/{user_id}/{chat_id}', get_chat_messages_endpoint, methods=['GET']),
+        Route('/api/cache/stats', get_cache_stats_endpoint, methods=['GET']),
+        Route('/api/chat', chat_handler, methods=['POST']),
+        Route('/api/chat/stream', chat_stream_handler, methods=['POST']),
+        # Everything else (and other methods on the paths above) is served by Flask
+        Mount('/', app=WSGIMiddleware(flask_server.app, workers=config.ASGI_WSGI_THREADS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get('PORT', 8080))
+    print(f"ASGI server starting on http://127.0.0.1:{port}")
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,110 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import config
+import cache_helper
+import tools
+import market_hours
+import news_client
+
+# Async front ends for the I/O-bound tools, used by the ASGI server.
+# yfinance, DDGS and Firestore have no asyncio API, so those calls run on a
+# bounded thread pool behind an async single-flight: a thousand requests for
+# the same ticker cost one thread, not a thousand. NewsAPI is called natively
+# over a pooled httpx client. Results go through the same cache as the sync
+# tools, so both serving paths share hits.
+
+_io_pool = ThreadPoolExecutor(max_workers=config.ASYNC_IO_THREADS, thread_name_prefix="async-io")
+_inflight = cache_helper.AsyncSingleFlight()
+_http = None
+
+
+async def run_io(fn, *args, **kwargs):
+    """Runs a blocking call on the I/O pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool, functools.partial(fn, *args, **kwargs))
+
+
+async def call(fn, *args):
+    """Runs a blocking tool on the I/O pool, sharing one call between identical concurrent requests."""
+    key = (fn.__name__,) + tuple(tuple(a) if isinstance(a, list) else a for a in args)
+    return await _inflight.do(key, run_io, fn, *args)
+
+
+def http_client():
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(
+            timeout=httpx.Timeout(5.0),
+            limits=httpx.Limits(max_connections=config.ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=20)
+        )
+    return _http
+
+
+async def close():
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+    _io_pool.shutdown(wait=False)
+
+
+# --- MARKET DATA ---
+async def get_current_price(ticker):
+    return await call(tools.get_current_price, ticker)
+
+
+async def get_bulk_live_prices(tickers):
+    return await call(tools.get_bulk_live_prices, list(tickers))
+
+
+async def get_bulk_quotes(tickers):
+    return await call(tools.get_bulk_quotes, list(tickers))
+
+
+async def get_fundamental_data(ticker):
+    return await call(tools.get_fundamental_data, ticker)
+
+
+async def get_stock_analysis_data(ticker, timeframe, indicators):
+    return await call(tools.get_stock_analysis_data, ticker, timeframe, list(indicators))
+
+
+async def get_portfolio(user_id):
+    return await call(tools.get_portfolio, user_id)
+
+
+# --- NEWS ---
+async def get_stock_news(query, company_name=None):
+    """Async version of tools.get_stock_news (same cache key and result shape)."""
+    search_term = company_name if company_name else query
+    if not search_term: return {"error": "No query/company name."}
+
+    cache_key = tools.news_cache_key(search_term)
+    cached_result = tools.get_cache(cache_key)
+    if cached_result: return cached_result
+
+    return await _inflight.do(cache_key, _fetch_stock_news, search_term, cache_key)
+
+
+async def _fetch_stock_news(search_term, cache_key):
+    # Same key rotation state as the sync tools, over the pooled httpx client
+    articles = await news_client.client.search_async(http_client(), search_term)
+    result = {"articles": news_client.format_articles(articles), "source": "NewsAPI"} if articles else None
+
+    if result is None:
+        print(f"      [News Tool] NewsAPI failed/empty for '{search_term}'. Falling back to DuckDuckGo...")
+        fallback_res = await run_io(tools.internet_search_news, f"{search_term} stock news india")
+        if "articles" in fallback_res:
+            result = fallback_res
+            result["source"] = "DuckDuckGo"
+        else:
+            result = {"message": f"No news found for '{search_term}' via NewsAPI or DDGS."}
+
+    tools.set_cache(cache_key, result, ttl_seconds=market_hours.ttl_for('news'))
+    return result
+
+
+def stats():
+    return {"single_flight": _inflight.stats(), "io_threads": config.ASYNC_IO_THREADS}
@@ -0,0 +1,630 @@
+import os
+import sys
+import asyncio
+import time
+import pickle
+import sqlite3
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+
+def estimate_size(value, _depth=0):
+    """
+    Rough, cheap estimate of the memory held by a cached value (in bytes).
+    Walks dicts/lists a few levels deep and asks pandas objects for their own usage.
+    """
+    try:
+        if hasattr(value, 'memory_usage'):
+            usage = value.memory_usage(deep=True)
+            return int(usage.sum()) if hasattr(usage, 'sum') else int(usage)
+
+        size = sys.getsizeof(value)
+        if _depth >= 4:
+            return size
+        if isinstance(value, dict):
+            for k, v in value.items():
+                size += estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+        elif isinstance(value, (list, tuple, set)):
+            for v in value:
+                size += estimate_size(v, _depth + 1)
+        return size
+    except Exception:
+        return 1024
+
+
+class _Shard:
+    """One lock-protected LRU segment of the cache."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (value, expiry_time, size)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe in-memory cache with LRU eviction and per-key TTL.
+
+    Keys are spread over `stripes` independent shards, each with its own lock,
+    entry limit and byte budget, so concurrent request threads rarely contend.
+    Hit/miss/eviction counters are available via `stats()`.
+    """
+
+    def __init__(self, max_entries=5000, max_bytes=256 * 1024 * 1024, stripes=16):
+        self._stripes = max(1, int(stripes))
+        per_entries = max(1, int(max_entries) // self._stripes)
+        per_bytes = max(1, int(max_bytes) // self._stripes)
+        self._shards = [_Shard(per_entries, per_bytes) for _ in range(self._stripes)]
+
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def _shard_for(self, key):
+        return self._shards[zlib.crc32(str(key).encode('utf-8')) % self._stripes]
+
+    def _count(self, hits=0, misses=0, evictions=0, expirations=0):
+        with self._stats_lock:
+            self._hits += hits
+            self._misses += misses
+            self._evictions += evictions
+            self._expirations += expirations
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if the key is missing or expired.
+        """
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        """
+        Returns (value, expiry_time), or (None, None) if the key is missing or expired.
+        """
+        shard = self._shard_for(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                hit = False
+                expired = False
+            elif time.time() < entry[1]:
+                shard.entries.move_to_end(key)
+                hit = True
+                expired = False
+            else:
+                del shard.entries[key]
+                shard.bytes_used -= entry[2]
+                hit = False
+                expired = True
+
+        if hit:
+            self._count(hits=1)
+            return entry[0], entry[1]
+        self._count(misses=1, expirations=1 if expired else 0)
+        return None, None
+
+    def set(self, key, value, ttl_seconds):
+        """
+        Stores a value for `ttl_seconds`, evicting least recently used entries
+        from the key's shard until it fits the entry and byte budgets.
+        """
+        size = estimate_size(value)
+        shard = self._shard_for(key)
+        evicted = 0
+        with shard.lock:
+            if size > shard.max_bytes:
+                # Bigger than a whole shard; caching it would flush everything else.
+                old = shard.entries.pop(key, None)
+                if old is not None:
+                    shard.bytes_used -= old[2]
+                return
+
+            old = shard.entries.pop(key, None)
+            if old is not None:
+                shard.bytes_used -= old[2]
+
+            shard.entries[key] = (value, time.time() + ttl_seconds, size)
+            shard.bytes_used += size
+
+            while len(shard.entries) > shard.max_entries or shard.bytes_used > shard.max_bytes:
+                _, (_, _, old_size) = shard.entries.popitem(last=False)
+                shard.bytes_used -= old_size
+                evicted += 1
+
+        if evicted:
+            self._count(evictions=evicted)
+
+    def delete(self, key):
+        shard = self._shard_for(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, None)
+            if entry is not None:
+                shard.bytes_used -= entry[2]
+        return entry is not None
+
+    def clear(self):
+        for shard in self._shards:
+            with shard.lock:
+                shard.entries.clear()
+                shard.bytes_used = 0
+
+    def stats(self):
+        """
+        Returns a snapshot of the cache counters and current occupancy.
+        """
+        entries = 0
+        bytes_used = 0
+        for shard in self._shards:
+            with shard.lock:
+                entries += len(shard.entries)
+                bytes_used += shard.bytes_used
+
+        with self._stats_lock:
+            lookups = self._hits + self._misses
+            return {
+                "backend": "memory",
+                "entries": entries,
+                "bytes": bytes_used,
+                "max_entries": sum(s.max_entries for s in self._shards),
+                "max_bytes": sum(s.max_bytes for s in self._shards),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "stripes": self._stripes
+            }
+
+
+# --- SERIALIZATION (shared backends) ---
+# Pickle protocol 5 with out-of-band buffers: the NumPy blocks behind a
+# DataFrame are written as raw frames instead of being copied into the
+# pickle stream. Frame layout:
+#   b"CP5" | u32 buffer count | u64 len + pickle bytes | (u64 len + buffer bytes)*
+# Only this process family writes these entries, so unpickling is trusted.
+_MAGIC = b"CP5"
+
+
+def dumps(value):
+    buffers = []
+    payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    frames = [_MAGIC, struct.pack("<I", len(buffers)), struct.pack("<Q", len(payload)), payload]
+    for buf in buffers:
+        raw = buf.raw()
+        frames.append(struct.pack("<Q", raw.nbytes))
+        frames.append(raw)
+    return b"".join(frames)
+
+
+def loads(data):
+    view = memoryview(data)
+    if bytes(view[:3]) != _MAGIC:
+        raise ValueError("Not a cache frame")
+    (count,) = struct.unpack_from("<I", view, 3)
+    (size,) = struct.unpack_from("<Q", view, 7)
+    offset = 15
+    payload = view[offset:offset + size]
+    offset += size
+    buffers = []
+    for _ in range(count):
+        (n,) = struct.unpack_from("<Q", view, offset)
+        offset += 8
+        # bytearray so arrays rebuilt from the buffer are writeable
+        buffers.append(bytearray(view[offset:offset + n]))
+        offset += n
+    return pickle.loads(payload, buffers=buffers)
+
+
+class _Counters:
+    """Hit/miss/eviction counters with the same stats keys as LRUCache, plus write counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.writes = self.write_errors = 0
+
+    def count(self, hits=0, misses=0, evictions=0, expirations=0, writes=0, write_errors=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+            self.expirations += expirations
+            self.writes += writes
+            self.write_errors += write_errors
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "writes": self.writes,
+                "write_errors": self.write_errors
+            }
+
+
+class SharedMemoryCache:
+    """
+    Cache shared by every worker process on one host.
+
+    Entries live in an SQLite database on tmpfs (/dev/shm by default), so
+    reads and writes are memory-speed while SQLite's locking keeps the
+    workers consistent. Values are serialized with `dumps`. Once the byte
+    budget is exceeded, the oldest stored entries are evicted first.
+    With `durable=True` the same store works as an on-disk cache that
+    survives restarts.
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY, value BLOB NOT NULL, expiry REAL NOT NULL,
+        size INTEGER NOT NULL, stored_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_entries_stored ON entries (stored_at);
+    """
+
+    def __init__(self, path, max_entries=5000, max_bytes=256 * 1024 * 1024, sweep_every=100, durable=False):
+        self.path = path
+        self.durable = durable
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_every = sweep_every
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._counters = _Counters()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn().executescript(self._SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # tmpfs: nothing to make durable; on disk, keep the file consistent across crashes
+            conn.execute("PRAGMA synchronous=NORMAL" if self.durable else "PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        row = self._conn().execute("SELECT value, expiry FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self._counters.count(misses=1)
+            return None, None
+        if time.time() >= row[1]:
+            self._conn().execute("DELETE FROM entries WHERE key = ? AND expiry = ?", (key, row[1]))
+            self._counters.count(misses=1, expirations=1)
+            return None, None
+        try:
+            value = loads(row[0])
+        except Exception as e:
+            print(f"      [Warning] Dropping unreadable cache entry {key}: {e}")
+            self.delete(key)
+            self._counters.count(misses=1)
+            return None, None
+        self._counters.count(hits=1)
+        return value, row[1]
+
+    def set(self, key, value, ttl_seconds):
+        try:
+            data = dumps(value)
+            if len(data) > self.max_bytes:
+                self.delete(key)
+                return
+            now = time.time()
+            self._conn().execute(
+                "INSERT OR REPLACE INTO entries (key, value, expiry, size, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (key, data, now + ttl_seconds, len(data), now))
+
+            with self._writes_lock:
+                self._writes += 1
+                sweep = self._writes % self.sweep_every == 0
+            self._counters.count(writes=1)
+            if sweep:
+                self._sweep()
+        except Exception as e:
+            self._counters.count(write_errors=1)
+            print(f"      [Warning] Shared cache write failed for {key}: {e}")
+
+    def _sweep(self):
+        """Drops expired entries, then the oldest ones until both budgets fit."""
+        conn = self._conn()
+        expired = conn.execute("DELETE FROM entries WHERE expiry <= ?", (time.time(),)).rowcount
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        evicted = 0
+        while count > self.max_entries or total > self.max_bytes:
+            batch = max(1, count // 10)
+            evicted += conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY stored_at LIMIT ?)", (batch,)).rowcount
+            count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self._counters.count(evictions=evicted, expirations=expired)
+
+    def delete(self, key):
+        return self._conn().execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self):
+        self._conn().execute("DELETE FROM entries")
+
+    def stats(self):
+        count, total = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        stats = {"backend": "disk" if self.durable else "shm", "entries": count, "bytes": total,
+                 "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+        stats.update(self._counters.snapshot())
+        return stats
+
+
+class RedisCache:
+    """
+    Cache on a Redis-protocol server, shared by every worker on every host.
+
+    Expiry is left to the server (SET PX); values are serialized with `dumps`.
+    Pass `client` to use an existing connection, e.g. a local stand-in for
+    tests; otherwise one is created from `url` (redis-py is imported lazily
+    so the other backends don't need it installed).
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="cache:", client=None, max_bytes=256 * 1024 * 1024):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+        self.client = client
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self._counters = _Counters()
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def get(self, key):
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        try:
+            pipe = self.client.pipeline()
+            pipe.get(self._key(key))
+            pipe.pttl(self._key(key))
+            data, pttl = pipe.execute()
+        except Exception as e:
+            print(f"      [Warning] Redis cache read failed for {key}: {e}")
+            self._counters.count(misses=1)
+            return None, None
+        if data is None:
+            self._counters.count(misses=1)
+            return None, None
+        try:
+            value = loads(data)
+        except Exception as e:
+            print(f"      [Warning] Dropping unreadable cache entry {key}: {e}")
+            self.delete(key)
+            self._counters.count(misses=1)
+            return None, None
+        self._counters.count(hits=1)
+        expiry = time.time() + pttl / 1000.0 if pttl and pttl > 0 else float('inf')
+        return value, expiry
+
+    def set(self, key, value, ttl_seconds):
+        try:
+            data = dumps(value)
+            if len(data) > self.max_bytes:
+                return
+            self.client.set(self._key(key), data, px=max(1, int(ttl_seconds * 1000)))
+            self._counters.count(writes=1)
+        except Exception as e:
+            self._counters.count(write_errors=1)
+            print(f"      [Warning] Redis cache write failed for {key}: {e}")
+
+    def delete(self, key):
+        try:
+            return bool(self.client.delete(self._key(key)))
+        except Exception:
+            return False
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*", count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+
+    def stats(self):
+        # Counters only: scanning the keyspace for an entry count is O(N) on the server
+        stats = {"backend": "redis", "max_bytes": self.max_bytes}
+        try:
+            stats["bytes"] = self.client.info("memory").get("used_memory")
+        except Exception:
+            stats["bytes"] = None  # Not every Redis-protocol server implements INFO
+        stats.update(self._counters.snapshot())
+        return stats
+
+
+class TieredCache:
+    """
+    A fast cache (L1) backed by a persistent one (L2).
+
+    Writes go through to both tiers; an L1 miss is read through from L2 and
+    promoted with its remaining TTL, so warm entries survive restarts and
+    deploys. L2 failures are logged and never fail the caller.
+    """
+
+    def __init__(self, l1, l2):
+        self.l1 = l1
+        self.l2 = l2
+        self._counters = _Counters()
+
+    def get(self, key):
+        return self.get_entry(key)[0]
+
+    def get_entry(self, key):
+        value, expiry = self.l1.get_entry(key)
+        if value is not None:
+            return value, expiry
+        try:
+            value, expiry = self.l2.get_entry(key)
+        except Exception as e:
+            print(f"      [Warning] Persistent cache read failed for {key}: {e}")
+            return None, None
+        if value is None:
+            return None, None
+        self.l1.set(key, value, expiry - time.time())
+        self._counters.count(hits=1)
+        return value, expiry
+
+    def set(self, key, value, ttl_seconds):
+        self.l1.set(key, value, ttl_seconds)
+        try:
+            self.l2.set(key, value, ttl_seconds)
+        except Exception as e:
+            print(f"      [Warning] Persistent cache write failed for {key}: {e}")
+
+    def delete(self, key):
+        deleted = self.l1.delete(key)
+        try:
+            deleted = self.l2.delete(key) or deleted
+        except Exception as e:
+            print(f"      [Warning] Persistent cache delete failed for {key}: {e}")
+        return deleted
+
+    def clear(self):
+        self.l1.clear()
+        try:
+            self.l2.clear()
+        except Exception as e:
+            print(f"      [Warning] Persistent cache clear failed: {e}")
+
+    def stats(self):
+        stats = self.l1.stats()
+        try:
+            stats["persistent"] = self.l2.stats()
+        except Exception as e:
+            stats["persistent"] = {"error": str(e)}
+        stats["persistent_promotions"] = self._counters.snapshot()["hits"]
+        return stats
+
+
+def create_cache(backend, max_entries=5000, max_bytes=256 * 1024 * 1024, stripes=16,
+                 shm_path=None, redis_url=None, key_prefix="cache:",
+                 persistent_path=None, persistent_max_bytes=512 * 1024 * 1024):
+    """
+    Builds the cache for `backend`: 'memory' (per process), 'shm' (shared by
+    workers on one host) or 'redis' (shared across hosts). With
+    `persistent_path`, memory/shm caches get an on-disk L2 behind them
+    (Redis already outlives the process).
+    """
+    backend = (backend or 'memory').lower()
+    if backend == 'redis':
+        return RedisCache(redis_url, prefix=key_prefix, max_bytes=max_bytes)
+    if backend == 'shm':
+        cache = SharedMemoryCache(shm_path, max_entries=max_entries, max_bytes=max_bytes)
+    else:
+        if backend != 'memory':
+            print(f"[Warning] Unknown CACHE_BACKEND '{backend}', using in-process memory cache.")
+        cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, stripes=stripes)
+
+    if not persistent_path:
+        return cache
+    try:
+        l2 = SharedMemoryCache(persistent_path, max_entries=max_entries * 4, max_bytes=persistent_max_bytes, durable=True)
+    except Exception as e:
+        print(f"[Warning] Persistent cache unavailable at {persistent_path}: {e}")
+        return cache
+    return TieredCache(cache, l2)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one upstream call.
+
+    The first caller for a key runs `fn`; callers arriving while it is still
+    in flight block until it finishes and receive the same result (or the
+    same exception). Nothing is remembered once the call completes - caching
+    the result is left to the caller.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats_lock = threading.Lock()
+        self._leaders = 0
+        self._shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            with self._stats_lock:
+                self._shared += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        with self._stats_lock:
+            self._leaders += 1
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        with self._stats_lock:
+            return {"upstream_calls": self._leaders, "coalesced_calls": self._shared, "in_flight": in_flight}
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight for coroutines on one event loop.
+
+    Waiters await the leader's task instead of blocking a thread, so any
+    number of concurrent requests for the same key cost one upstream call.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+        self._leaders = 0
+        self._shared = 0
+
+    async def do(self, key, coro_fn, *args, **kwargs):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+            self._leaders += 1
+        else:
+            self._shared += 1
+        # shield: a cancelled waiter must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {"upstream_calls": self._leaders, "coalesced_calls": self._shared, "in_flight": len(self._tasks)}
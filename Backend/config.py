@@ -19,7 +19,11 @@ GENIE_API_KEY ="YOUR_GEMINI_API_KEY_HERE"
 # ============================================
 # Determine the absolute path to the Backend/database directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-LOCAL_DB_FILE = os.path.join(BASE_DIR, 'database', 'local_database.json')
+LOCAL_SQLITE_FILE = os.path.join(BASE_DIR, 'database', 'local_database.db') # LOCAL mode store (SQLite, WAL)
+LOCAL_DB_FILE = os.path.join(BASE_DIR, 'database', 'local_database.json') # Legacy TinyDB file, migrated once on startup
+OHLCV_STORE_DIR = os.path.join(BASE_DIR, 'database', 'ohlcv') # Per-ticker bar history (.npy)
+CONSTITUENTS_FILE = os.path.join(BASE_DIR, 'database', 'index_constituents.json') # Resolved index constituents (versioned snapshot)
+INSTRUMENTS_FILE = os.path.join(BASE_DIR, 'database', 'instruments.db') # Kite instrument master for NSE/BSE equities (SQLite)
 
 FIREBASE_CONFIG = {
     "apiKey": "YOUR_FIREBASE_API_KEY",
@@ -43,6 +47,9 @@ API_BASE_URL = Local_API_URL if DEBUG_MODE == True else Production_API_URL
 ZERODHA_API_KEY = "YOUR_KITE_CONNECT_API_KEY"
 ZERODHA_API_SECRET = "YOUR_KITE_CONNECT_SECRET"
 ZERODHA_REDIRECT_URL = f"{Production_API_URL}/api/zerodha/callback"  if DEBUG_MODE == False else f"{Local_API_URL}/api/zerodha/callback"
+INSTRUMENTS_BACKGROUND_REFRESH = True # Keep the local instrument master (token/symbol/ISIN -> Yahoo ticker) current; needs a real ZERODHA_API_KEY
+INSTRUMENTS_MAX_AGE_SECONDS = 86400 # Kite republishes instruments daily; older copies are re-downloaded
+INSTRUMENTS_REFRESH_CHECK_SECONDS = 3600 # How often the background refresh checks the master's age
 
 
 # ============================================
@@ -52,7 +59,10 @@ ZERODHA_REDIRECT_URL = f"{Production_API_URL}/api/zerodha/callback"  if DEBUG_MO
 NEWSAPI_KEYS = [
 "YOUR_NEWSAPI_KEY_HERE"
 ]
-NEWS_API_MODE = 'sequential'
+NEWS_API_MODE = 'sequential' # 'sequential' (first healthy key) or 'round_robin' (spread calls across keys)
+NEWS_KEY_COOLDOWN_SECONDS = 3600 # A rate-limited key sits out this long (unless NewsAPI says otherwise)
+NEWS_HTTP_POOL_SIZE = 20 # Pooled keep-alive connections to NewsAPI
+NEWS_BATCH_MAX_QUERY_CHARS = 480 # NewsAPI caps q at 500 chars; batched company queries are split below this
 
 # ============================================
 # PORTFOLIO & PAPER TRADING
@@ -70,6 +80,7 @@ GEMINI_MODEL_NAME = 'gemini-2.5-flash-lite'
 MAX_CHAT_HISTORY = 20
 CHAT_TITLE_LENGTH = 35
 CHAT_TITLE_MAX_LENGTH = 100
+CHAT_MAX_TOOL_ROUNDS = 10 # Max model -> tool round trips per chat turn (streamed or not)
 
 # ============================================
 # PRICING (Gemini 2.5 Flash-Lite)
@@ -126,6 +137,60 @@ CACHE_STORE = True # Enable or disable caching
 CACHE_TTL_SECONDS = 300 
 CACHE_PRICE_DATA_SECONDS = 300
 CACHE_NEWS_DATA_SECONDS = 1800
+CACHE_TTL_BY_CLASS = { # In-session TTL (seconds) per data class, see market_hours.ttl_for
+    'price': CACHE_PRICE_DATA_SECONDS,
+    'info': CACHE_PRICE_DATA_SECONDS,
+    'indicator': CACHE_NEWS_DATA_SECONDS,
+    'news': CACHE_NEWS_DATA_SECONDS,
+    'fundamentals': 86400, # Sector, ratios, analyst targets: refetched daily
+}
+CACHE_MARKET_BOUND_CLASSES = ('price', 'info', 'indicator') # Outside sessions these live until the next open
+CACHE_CLOSE_SETTLE_SECONDS = 1800 # After the close, keep in-session TTLs this long while closing prices settle
+OHLCV_SYNC_SECONDS = 300 # Min gap between tail fetches for a stored bar series
+SCREENER_NEWS_WORKERS = 8 # Parallel news lookups while validating screener candidates
+SCREENER_NEWS_DEADLINE_SECONDS = 12 # Candidates still waiting on news after this are scored without it
+SCREEN_SNAPSHOTS = True # Build the scored screener table of every static index after each close
+SCREEN_HISTORY_BUCKETS = (100, 180, 365) # History windows (days) screener tables are built for; duration_days rounds up to one
+SCREEN_SNAPSHOT_CHECK_SECONDS = 900 # How often the snapshot job looks for a newly closed session
+CONSTITUENTS_BACKGROUND_REFRESH = True # Re-resolve index constituents from the NSE API in the background
+CONSTITUENTS_MAX_AGE_SECONDS = 7 * 86400 # Constituents older than this are re-resolved (index changes are rare)
+CONSTITUENTS_REFRESH_CHECK_SECONDS = 6 * 3600 # How often the background refresh looks for stale constituents
+INDICATOR_STATE_MAX_ENTRIES = 2000 # Running indicator states kept for technical ratings (least recently used dropped first)
+TICKER_FUZZY_THRESHOLD = 0.5 # Min trigram similarity for normalize_ticker to correct a misspelt symbol/name
+DEEP_ANALYSIS_MAX_WORKERS = 12 # Global cap on concurrent lookups across all deep analyses
+DEEP_ANALYSIS_BUDGET_SECONDS = 30 # Overall time budget for the deep-dive stage
+CACHE_MAX_ENTRIES = 5000 # Hard cap on cached keys (LRU eviction beyond this)
+CACHE_MAX_BYTES = 256 * 1024 * 1024 # Approximate memory budget for cached values
+CACHE_LOCK_STRIPES = 16 # Independent lock shards to reduce thread contention
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory') # 'memory' (per process), 'shm' (workers on one host), 'redis' (shared)
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(BASE_DIR, 'cache')) # On-disk cache files
+CACHE_SHM_PATH = os.environ.get('CACHE_SHM_PATH', '/dev/shm/claroz_cache.db' if os.path.isdir('/dev/shm') else os.path.join(CACHE_DIR, 'shared_cache.db'))
+CACHE_PERSISTENT = True # Write-through on-disk L2 behind the memory/shm cache, so warm entries survive restarts
+CACHE_PERSISTENT_FILE = os.path.join(CACHE_DIR, 'persistent_cache.db')
+CACHE_PERSISTENT_MAX_BYTES = 512 * 1024 * 1024 # Disk budget for the L2 (oldest entries evicted first)
+CACHE_FUNDAMENTALS_FILE = os.path.join(CACHE_DIR, 'fundamentals.db') # Slow tier: company info/fundamentals, kept across restarts
+CACHE_FUNDAMENTALS_MAX_ENTRIES = 20000 # Cap on tickers kept in the fundamentals tier
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_KEY_PREFIX = 'claroz:' # Namespace for keys on a shared Redis
+CACHE_STALE_GRACE_SECONDS = 600 # Quotes/info past their TTL are served this much longer while refreshed in the background
+BACKGROUND_REFRESH = True # Pre-warm quotes of hot tickers during market hours
+REFRESH_INTERVAL_SECONDS = 240 # Refresher cycle; keep below the 'price' TTL so hot quotes never expire
+REFRESH_LEAD_SECONDS = 60 # Extra margin when deciding which slower entries (ratings) to refresh this cycle
+REFRESH_BATCH_SIZE = 100 # Tickers per bulk quote download
+REFRESH_WORKERS = 4 # Threads for background revalidation
+HOT_TICKER_IDLE_SECONDS = 1800 # A ticker stays hot this long after a user last touched it
+HOT_TICKER_MAX = 200 # Cap on tracked hot tickers (least recently touched dropped first)
+DB_WRITE_BEHIND = True # Queue chat messages / token usage and commit them in background batches
+DB_FLUSH_INTERVAL_SECONDS = 0.25 # How long queued writes may wait before the flusher commits them
+DB_FLUSH_MAX_OPS = 400 # Flush early once this many writes are queued (Firestore batches cap at 500)
+DB_FLUSH_MAX_ATTEMPTS = 8 # Failed flushes back off exponentially; after this many, writes are retried one by one and ones failing while others succeed are dropped
+DB_FLUSH_MAX_BACKOFF_SECONDS = 60 # Cap on the wait between failed flush attempts
+DB_USER_CACHE = True # Serve user docs, holdings and watchlists from a per-user cache; DBManager writes invalidate it
+DB_USER_CACHE_TTL_SECONDS = 30 # Bounds staleness from writes made by other server instances
+DB_USER_CACHE_MAX_USERS = 2000 # Users whose state is kept (least recently used dropped first)
+ASYNC_IO_THREADS = 64 # ASGI mode: thread pool for blocking calls (yfinance, DDGS, Firestore, tools)
+ASYNC_HTTP_MAX_CONNECTIONS = 100 # ASGI mode: pooled connections for async HTTP clients (NewsAPI)
+ASGI_WSGI_THREADS = 40 # ASGI mode: threads serving routes that fall through to the Flask app
 
 # ============================================
 # AI SYSTEM INSTRUCTIONS
@@ -198,6 +263,16 @@ Total: ₹[Val] | New Cash: ₹[Cash]"
 # ============================================
 # STOCK MARKET DATA
 # ============================================
+NSE_SESSION_OPEN = "09:15" # Regular session, IST
+NSE_SESSION_CLOSE = "15:30"
+NSE_HOLIDAYS = [ # Trading holidays (YYYY-MM-DD); update from the NSE holiday circular each year
+    '2025-02-26', '2025-03-14', '2025-03-31', '2025-04-10', '2025-04-14', '2025-04-18',
+    '2025-05-01', '2025-08-15', '2025-08-27', '2025-10-02', '2025-10-21', '2025-10-22',
+    '2025-11-05', '2025-12-25',
+    '2026-01-26', '2026-03-03', '2026-03-26', '2026-03-31', '2026-04-03', '2026-04-14',
+    '2026-05-01', '2026-05-28', '2026-06-26', '2026-09-14', '2026-10-02', '2026-10-20',
+    '2026-11-10', '2026-11-24', '2026-12-25',
+]
 NIFTY_50_TICKERS = [
 'RELIANCE.NS', 'TCS.NS', 'HDFCBANK.NS', 'ICICIBANK.NS', 'INFY.NS', 'HINDUNILVR.NS',
 'BHARTIARTL.NS', 'ITC.NS', 'SBIN.NS', 'LICI.NS', 'HCLTECH.NS', 'KOTAKBANK.NS',
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+
+# Registry of index constituents: the static lists in indices.py merged with
+# every successful live resolution, persisted to a JSON snapshot so lookups
+# are a dict access and survive restarts. Each resolution records a
+# timestamp, and the registry version increases whenever a list changes.
+
+
+def _norm(index_name):
+    return index_name.strip().upper()
+
+
+class ConstituentsRegistry:
+    def __init__(self, path, static_indices, max_age_seconds=7 * 86400):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._static = {_norm(name): list(tickers) for name, tickers in static_indices.items()}
+        self._version = 0
+        self._resolved = {}  # name -> {"tickers", "source", "resolved_at", "checked_at", "version"}
+        self._static_checked = {}  # name -> last failed refresh of a static-only entry (not persisted)
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self._version = int(snapshot.get('version', 0))
+            self._resolved = {_norm(name): entry for name, entry in snapshot.get('indices', {}).items()
+                              if isinstance(entry, dict) and entry.get('tickers')}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Warning] Could not read constituents snapshot {self.path}: {e}")
+
+    def _save(self):
+        """Writes the snapshot atomically (caller holds the lock)."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": self._version, "saved_at": time.time(), "indices": self._resolved}, f)
+        os.replace(tmp_path, self.path)
+
+    def get(self, index_name):
+        """Returns {"tickers", "source", "resolved_at", "version"} or None; resolved lists win over static ones."""
+        name = _norm(index_name)
+        with self._lock:
+            entry = self._resolved.get(name)
+            if entry:
+                return dict(entry)
+        tickers = self._static.get(name)
+        if tickers is None:
+            return None
+        return {"tickers": list(tickers), "source": "static", "resolved_at": None, "version": 0}
+
+    def put(self, index_name, tickers, source):
+        """Records a successful resolution; the version only moves when the list actually changes."""
+        name = _norm(index_name)
+        now = time.time()
+        with self._lock:
+            entry = self._resolved.get(name)
+            if entry is None or sorted(entry['tickers']) != sorted(tickers):
+                self._version += 1
+                entry = {"tickers": list(tickers), "version": self._version}
+            entry.update(source=source, resolved_at=now, checked_at=now)
+            self._resolved[name] = entry
+            try:
+                self._save()
+            except Exception as e:
+                print(f"[Warning] Could not persist constituents snapshot: {e}")
+
+    def _mark_checked(self, name):
+        with self._lock:
+            if name in self._resolved:
+                self._resolved[name]['checked_at'] = time.time()
+            else:
+                self._static_checked[name] = time.time()
+
+    def stale(self):
+        """Names not resolved (or attempted) within max_age_seconds."""
+        cutoff = time.time() - self.max_age_seconds
+        with self._lock:
+            checked = {name: entry.get('checked_at') or 0 for name, entry in self._resolved.items()}
+            checked.update({name: ts for name, ts in self._static_checked.items() if name not in self._resolved})
+            return [name for name in sorted(set(self._static) | set(self._resolved)) if checked.get(name, 0) < cutoff]
+
+    def start_background_refresh(self, resolve_fn, check_interval_seconds=6 * 3600, initial_delay_seconds=120):
+        """
+        Re-resolves stale entries on a slow schedule. `resolve_fn(name)` returns
+        (tickers, source) or None; on failure the current list is kept and the
+        name is not retried until it is stale again.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            if self._stop.wait(initial_delay_seconds):
+                return
+            while True:
+                for name in self.stale():
+                    try:
+                        resolved = resolve_fn(name)
+                    except Exception as e:
+                        print(f"[Warning] Constituents refresh failed for {name}: {e}")
+                        resolved = None
+                    if resolved:
+                        self.put(name, *resolved)
+                    else:
+                        self._mark_checked(name)
+                if self._stop.wait(check_interval_seconds):
+                    return
+
+        self._thread = threading.Thread(target=run, name="constituents-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            return {"version": self._version, "static": len(self._static), "resolved": len(self._resolved)}
@@ -1,8 +1,16 @@
 import config
 import os
 import time
-from datetime import datetime
+import json
+import sqlite3
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import uuid
+import copy
+import cache_helper
 
 # --- INITIALIZATION ---
 db_client = None
@@ -23,16 +31,435 @@ if config.DB_MODE == 'FIREBASE':
     db_client = firestore.client()
     print("Firebase Firestore Connected (Permanent Storage)")
 
-elif config.DB_MODE == 'LOCAL':
-    from tinydb import TinyDB, Query
-    db_local = TinyDB(config.LOCAL_DB_FILE, indent=4, separators=(',', ': '))
-    print(f"Local Database Connected: {config.LOCAL_DB_FILE}")
+
+FIRESTORE_BATCH_LIMIT = 500 # Max writes per Firestore batch
+
+# --- LOCAL STORE (SQLite) ---
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS users (id TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS portfolio (
+    user_id TEXT NOT NULL, ticker TEXT NOT NULL, data TEXT NOT NULL,
+    PRIMARY KEY (user_id, ticker)
+);
+CREATE TABLE IF NOT EXISTS watchlist (
+    user_id TEXT NOT NULL, ticker TEXT NOT NULL, added_at TEXT,
+    PRIMARY KEY (user_id, ticker)
+);
+CREATE TABLE IF NOT EXISTS history (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL, timestamp TEXT NOT NULL, data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_ts ON history (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS chats (id TEXT PRIMARY KEY, user_id TEXT NOT NULL, title TEXT, timestamp TEXT);
+CREATE INDEX IF NOT EXISTS idx_chats_user_ts ON chats (user_id, timestamp);
+CREATE TABLE IF NOT EXISTS messages (
+    row_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL, user_id TEXT, role TEXT, text TEXT, metadata TEXT, timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat_ts ON messages (chat_id, timestamp);
+"""
+
+class SQLiteStore:
+    """
+    Embedded SQLite store used in LOCAL mode (WAL journal, one connection per thread).
+    Documents are kept as JSON in a `data` column next to the indexed key columns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn().executescript(_SCHEMA)
+
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, durable=False):
+        """
+        BEGIN IMMEDIATE ... COMMIT. With `durable=True` the commit is fsynced
+        (synchronous=FULL) before returning instead of at the next checkpoint.
+        """
+        conn = self.conn()
+        if durable:
+            conn.execute("PRAGMA synchronous=FULL")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            if durable:
+                conn.execute("PRAGMA synchronous=NORMAL")
+
+    def query(self, sql, params=()):
+        return self.conn().execute(sql, params).fetchall()
+
+def migrate_tinydb_json(json_path, store):
+    """
+    One-shot import of a legacy TinyDB `local_database.json` into the SQLite store.
+    Runs in a single transaction and records itself in `meta`, so it never runs twice.
+    Nothing is recorded while there is no JSON file, so one added later is still imported.
+    """
+    if store.query("SELECT 1 FROM meta WHERE key = 'migrated_from_json'"):
+        return 0
+    if not os.path.exists(json_path):
+        return 0
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+
+    def rows(table):
+        return list((raw.get(table) or {}).values())
+
+    count = 0
+    with store.transaction() as conn:
+        for doc in rows('users'):
+            if not doc.get('id'): continue
+            conn.execute("INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)", (doc['id'], json.dumps(doc)))
+            count += 1
+        for doc in rows('portfolio'):
+            if not doc.get('user_id') or not doc.get('ticker'): continue
+            conn.execute("INSERT OR REPLACE INTO portfolio (user_id, ticker, data) VALUES (?, ?, ?)",
+                         (doc['user_id'], doc['ticker'], json.dumps(doc)))
+            count += 1
+        for doc in rows('watchlist'):
+            if not doc.get('user_id') or not doc.get('ticker'): continue
+            conn.execute("INSERT OR IGNORE INTO watchlist (user_id, ticker, added_at) VALUES (?, ?, ?)",
+                         (doc['user_id'], doc['ticker'], doc.get('added_at')))
+            count += 1
+        for doc in rows('history'):
+            if not doc.get('user_id'): continue
+            conn.execute("INSERT INTO history (user_id, timestamp, data) VALUES (?, ?, ?)",
+                         (doc['user_id'], str(doc.get('timestamp', '')), json.dumps(doc)))
+            count += 1
+        for doc in rows('chats'):
+            if not doc.get('id'): continue
+            conn.execute("INSERT OR REPLACE INTO chats (id, user_id, title, timestamp) VALUES (?, ?, ?, ?)",
+                         (doc['id'], doc.get('user_id'), doc.get('title'), doc.get('timestamp', '')))
+            count += 1
+        for doc in rows('messages'):
+            if not doc.get('chat_id'): continue
+            # Stored as-is: TinyDB returned whatever the document held, including {}
+            metadata = doc.get('metadata')
+            conn.execute("INSERT INTO messages (chat_id, user_id, role, text, metadata, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                         (doc['chat_id'], doc.get('user_id'), doc.get('role'), doc.get('text'),
+                          json.dumps(metadata) if metadata is not None else None, doc.get('timestamp', '')))
+            count += 1
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_from_json', ?)", (datetime.now().isoformat(),))
+
+    print(f"Migrated {count} records from {json_path} into {store.path}")
+    return count
+
+if config.DB_MODE == 'LOCAL':
+    db_local = SQLiteStore(config.LOCAL_SQLITE_FILE)
+    migrate_tinydb_json(config.LOCAL_DB_FILE, db_local)
+    print(f"Local Database Connected: {config.LOCAL_SQLITE_FILE}")
+
+def _load_doc(row):
+    return json.loads(row['data']) if row else None
+
+def _metadata_json(metadata):
+    """Message metadata column value; empty metadata is not stored (read back as None), as before."""
+    return json.dumps(metadata) if metadata else None
+
+def _local_set_cash(conn, user_id, cash_balance):
+    row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+    if row:
+        user = _load_doc(row)
+        user['cash'] = float(cash_balance)
+        conn.execute("UPDATE users SET data = ? WHERE id = ?", (json.dumps(user), user_id))
+
+def _commit_batched(ops):
+    """
+    Commits (kind, ref, data) Firestore writes, kind being 'set', 'merge',
+    'update' or 'delete', in batches of at most 500 (Firestore's per-batch cap).
+    """
+    for start in range(0, len(ops), FIRESTORE_BATCH_LIMIT):
+        batch = db_client.batch()
+        for kind, ref, data in ops[start:start + FIRESTORE_BATCH_LIMIT]:
+            if kind == 'delete':
+                batch.delete(ref)
+            elif kind == 'merge':
+                batch.set(ref, data, merge=True)
+            elif kind == 'update':
+                batch.update(ref, data)
+            else:
+                batch.set(ref, data)
+        batch.commit()
+
+class WriteBehindQueue:
+    """
+    Buffers deferred writes and hands them to `commit_fn(ops, tokens)` in batches.
+
+    `ops` is an ordered list of ('chat' | 'message', user_id, payload) tuples and
+    `tokens` maps user_id -> [input, output] with every queued increment for that
+    user summed into one. A daemon thread flushes every `interval` seconds (or
+    sooner once `max_ops` are queued); `flush()` can also be called directly and
+    returns only after everything queued before it has been committed.
+
+    Each `commit_fn` call carries at most `max_batch_writes` writes (a 'chat'
+    op is two), so a backlog never exceeds one Firestore batch. A failed chunk
+    goes back to the front of the queue and flushes back off exponentially.
+    After `max_attempts` failures in a row the chunk is committed write by
+    write. If every write fails, that looks like an outage and the whole chunk
+    stays queued, however small; only writes that fail while others in the
+    same chunk go through are dropped into `dead_letters`.
+    """
+
+    def __init__(self, commit_fn, interval=0.25, max_ops=400, max_batch_writes=500,
+                 max_attempts=8, max_backoff_seconds=60):
+        self.commit_fn = commit_fn
+        self.interval = interval
+        self.max_ops = max_ops
+        self.max_batch_writes = max_batch_writes
+        self.max_attempts = max_attempts
+        self.max_backoff_seconds = max_backoff_seconds
+        self.dead_letters = deque(maxlen=100)  # (kind, user_id, payload, error) of dropped writes
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # One commit at a time, in queue order
+        self._ops = []
+        self._tokens = {}
+        self._users = {}  # user_id -> number of queued writes
+        self._failures = 0  # consecutive failed commits
+        self._retry_at = 0.0  # no flush attempts before this (backoff)
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _track(self, user_id):
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+
+    def enqueue(self, kind, user_id, payload):
+        with self._cond:
+            self._ops.append((kind, user_id, payload))
+            self._track(user_id)
+            if len(self._ops) >= self.max_ops:
+                self._cond.notify()
+
+    def add_tokens(self, user_id, input_count, output_count):
+        with self._cond:
+            current = self._tokens.setdefault(user_id, [0, 0])
+            current[0] += input_count
+            current[1] += output_count
+            self._track(user_id)
+
+    def has_pending(self, user_id):
+        with self._cond:
+            return user_id in self._users
+
+    def _chunks(self, ops, tokens):
+        """Splits a flush into (ops, tokens) chunks of at most max_batch_writes writes each."""
+        chunks, current, chunk_tokens, size = [], [], {}, 0
+        for op in ops:
+            writes = 2 if op[0] == 'chat' else 1
+            if current and size + writes > self.max_batch_writes:
+                chunks.append((current, {}))
+                current, size = [], 0
+            current.append(op)
+            size += writes
+        for uid, counts in tokens.items():
+            if size + 1 > self.max_batch_writes:
+                chunks.append((current, chunk_tokens))
+                current, chunk_tokens, size = [], {}, 0
+            chunk_tokens[uid] = counts
+            size += 1
+        if current or chunk_tokens:
+            chunks.append((current, chunk_tokens))
+        return chunks
+
+    def _requeue(self, chunks):
+        with self._cond:
+            requeued = [op for chunk_ops, _ in chunks for op in chunk_ops]
+            self._ops = requeued + self._ops
+            for op in requeued:
+                self._track(op[1])
+            for _, chunk_tokens in chunks:
+                for uid, (inp, out) in chunk_tokens.items():
+                    current = self._tokens.setdefault(uid, [0, 0])
+                    current[0] += inp
+                    current[1] += out
+                    self._track(uid)
+
+    def _commit_each(self, ops, tokens):
+        """
+        Commits a chunk write by write to isolate the ones that keep failing.
+        Returns the (ops, tokens) still to retry: everything if nothing went
+        through (an outage), else nothing (the failures are dropped).
+        """
+        failed_ops, failed_tokens, errors = [], {}, []
+        for op in ops:
+            try:
+                self.commit_fn([op], {})
+            except Exception as e:
+                failed_ops.append(op)
+                errors.append(e)
+        for uid, counts in tokens.items():
+            try:
+                self.commit_fn([], {uid: counts})
+            except Exception as e:
+                failed_tokens[uid] = counts
+                errors.append(e)
+        if errors and len(errors) == len(ops) + len(tokens):
+            return failed_ops, failed_tokens
+        for (kind, user_id, payload), e in zip(failed_ops, errors):
+            print(f"[Error] Dropping write-behind {kind} for {user_id} after {self.max_attempts} attempts: {e}")
+            self.dead_letters.append((kind, user_id, payload, str(e)))
+        for (uid, counts), e in zip(failed_tokens.items(), errors[len(failed_ops):]):
+            print(f"[Error] Dropping write-behind token usage {counts} for {uid} after {self.max_attempts} attempts: {e}")
+            self.dead_letters.append(('tokens', uid, counts, str(e)))
+        return [], {}
+
+    def flush(self):
+        with self._flush_lock:
+            if time.time() < self._retry_at:
+                return False  # Backing off after a failed commit
+            with self._cond:
+                ops, tokens = self._ops, self._tokens
+                self._ops, self._tokens, self._users = [], {}, {}
+            if not ops and not tokens:
+                return True
+            chunks = self._chunks(ops, tokens)
+            for i, (chunk_ops, chunk_tokens) in enumerate(chunks):
+                try:
+                    if self._failures >= self.max_attempts:
+                        retry_ops, retry_tokens = self._commit_each(chunk_ops, chunk_tokens)
+                        if retry_ops or retry_tokens:
+                            raise RuntimeError("every write in the chunk failed")
+                    else:
+                        self.commit_fn(chunk_ops, chunk_tokens)
+                except Exception as e:
+                    self._failures += 1
+                    delay = min(self.max_backoff_seconds, self.interval * 2 ** self._failures)
+                    self._retry_at = time.time() + delay
+                    print(f"[Error] Write-behind flush failed ({len(chunk_ops)} writes), retrying in {delay:.1f}s: {e}")
+                    self._requeue(chunks[i:])
+                    return False
+                self._failures = 0
+            return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and len(self._ops) < self.max_ops:
+                    self._cond.wait(self.interval)
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._ops) + len(self._tokens)
+        return {"queued": queued, "consecutive_failures": self._failures, "dead_letters": len(self.dead_letters)}
+
+class UserStateCache:
+    """
+    Read-through cache of per-user state: the user doc ('user'), holdings
+    ('holdings') and watchlist ('watchlist'). Values are copied in and out, so
+    callers can mutate what they get.
+
+    DBManager invalidates the kinds a mutator touches once its write is done.
+    A load that overlapped an invalidation is returned but not stored, so the
+    cache never keeps state older than this process's last write. The TTL
+    bounds staleness from writes made elsewhere (other server instances).
+    """
+
+    KINDS = ('user', 'holdings', 'watchlist')
+
+    def __init__(self, ttl_seconds=30, max_users=2000):
+        self.ttl_seconds = ttl_seconds
+        self._store = cache_helper.LRUCache(max_entries=max_users * len(self.KINDS), max_bytes=64 * 1024 * 1024, stripes=8)
+        self._lock = threading.Lock()
+        self._generations = {}  # user_id -> invalidation count
+
+    def get(self, user_id, kind, load):
+        key = f"{kind}:{user_id}"
+        value = self._store.get(key)
+        if value is not None:
+            return copy.deepcopy(value)
+        with self._lock:
+            generation = self._generations.get(user_id, 0)
+        value = load()
+        if value is not None:
+            with self._lock:
+                if self._generations.get(user_id, 0) == generation:
+                    self._store.set(key, copy.deepcopy(value), self.ttl_seconds)
+        return value
+
+    def invalidate(self, user_id, *kinds):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for kind in kinds or self.KINDS:
+                self._store.delete(f"{kind}:{user_id}")
+
+    def stats(self):
+        return self._store.stats()
 
 class DBManager:
     """
-    Manages database interactions for both Local (TinyDB) and Firebase modes.
+    Manages database interactions for both Local (SQLite) and Firebase modes.
     Handles Users, Portfolio, Watchlist, History, and Chat data persistence.
+
+    Chat messages and token usage can be written with `defer=True`: they are
+    queued and committed by a background flusher in one transaction (LOCAL) or
+    one batch (FIREBASE). Reads of a user with queued writes flush first, so
+    callers always see their own writes.
+
+    User docs, holdings and watchlists are served from a per-user
+    UserStateCache; every mutator below invalidates what it changed.
     """
+
+    def __init__(self):
+        self._write_behind = None
+        if config.DB_WRITE_BEHIND:
+            self._write_behind = WriteBehindQueue(self._commit_deferred,
+                                                  interval=config.DB_FLUSH_INTERVAL_SECONDS,
+                                                  max_ops=config.DB_FLUSH_MAX_OPS,
+                                                  max_batch_writes=FIRESTORE_BATCH_LIMIT,
+                                                  max_attempts=config.DB_FLUSH_MAX_ATTEMPTS,
+                                                  max_backoff_seconds=config.DB_FLUSH_MAX_BACKOFF_SECONDS)
+        self._state = None
+        if config.DB_USER_CACHE:
+            self._state = UserStateCache(ttl_seconds=config.DB_USER_CACHE_TTL_SECONDS,
+                                         max_users=config.DB_USER_CACHE_MAX_USERS)
+
+    def _cached(self, user_id, kind, load):
+        return self._state.get(user_id, kind, load) if self._state else load()
+
+    def _invalidate(self, user_id, *kinds):
+        if self._state:
+            self._state.invalidate(user_id, *kinds)
+
+    @contextmanager
+    def _invalidating(self, user_id, *kinds):
+        """Wraps a write: the cached state is invalidated even if the write fails part-way."""
+        try:
+            yield
+        finally:
+            self._invalidate(user_id, *kinds)
+
+    def state_cache_stats(self):
+        return self._state.stats() if self._state else None
     
     @staticmethod
     def get_timestamp():
@@ -51,28 +478,30 @@ class DBManager:
         Returns:
             dict: User data if found, else None.
         """
+        self._flush_pending(user_id)
+        return self._cached(user_id, 'user', lambda: self._load_user(user_id))
+
+    def _load_user(self, user_id):
         if config.DB_MODE == 'FIREBASE':
             doc = db_client.collection('users').document(user_id).get()
             return doc.to_dict() if doc.exists else None
         else:
-            User = Query()
-            res = db_local.table('users').search(User.id == user_id)
-            return res[0] if res else None
+            rows = db_local.query("SELECT data FROM users WHERE id = ?", (user_id,))
+            return _load_doc(rows[0]) if rows else None
 
     def create_or_update_user(self, user_id, data):
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection('users').document(user_id).set(data, merge=True)
-            return data
-        else:
-            data['id'] = user_id
-            table = db_local.table('users')
-            User = Query()
-            if table.search(User.id == user_id):
-                table.update(data, User.id == user_id)
-                return table.search(User.id == user_id)[0]
-            else:
-                table.insert(data)
+        with self._invalidating(user_id, 'user'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection('users').document(user_id).set(data, merge=True)
                 return data
+            else:
+                data['id'] = user_id
+                with db_local.transaction() as conn:
+                    row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+                    doc = _load_doc(row) or {}
+                    doc.update(data)
+                    conn.execute("INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)", (user_id, json.dumps(doc)))
+                return doc
 
     def update_user_cash(self, user_id, cash_amount):
         """
@@ -82,11 +511,21 @@ class DBManager:
             user_id (str): The unique identifier for the user.
             cash_amount (float): The new cash balance.
         """
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection('users').document(user_id).update({'cash': float(cash_amount)})
-        else:
-            User = Query()
-            db_local.table('users').update({'cash': float(cash_amount)}, User.id == user_id)
+        with self._invalidating(user_id, 'user'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection('users').document(user_id).update({'cash': float(cash_amount)})
+            else:
+                self._local_update_user(user_id, {'cash': float(cash_amount)})
+
+    def _local_update_user(self, user_id, fields):
+        # Merge fields into an existing user doc (no-op if the user doesn't exist)
+        with self._invalidating(user_id, 'user'), db_local.transaction() as conn:
+            row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+            if not row: return False
+            doc = _load_doc(row)
+            doc.update(fields)
+            conn.execute("UPDATE users SET data = ? WHERE id = ?", (json.dumps(doc), user_id))
+        return True
 
     # --- TOKENS (The Critical Fix) ---
     def check_token_access(self, user_id):
@@ -131,10 +570,11 @@ class DBManager:
             # RESET TOKENS
             if config.DB_MODE == 'FIREBASE':
                 try:
-                    db_client.collection('users').document(user_id).set({
-                        'token_usage': {'input': 0, 'output': 0, 'total': 0},
-                        'last_reset_date': current_month_str
-                    }, merge=True)
+                    with self._invalidating(user_id, 'user'):
+                        db_client.collection('users').document(user_id).set({
+                            'token_usage': {'input': 0, 'output': 0, 'total': 0},
+                            'last_reset_date': current_month_str
+                        }, merge=True)
                     usage_reset_triggered = True
                     # Update local variable to reflect reset
                     user_data['token_usage'] = {'input': 0, 'output': 0, 'total': 0}
@@ -142,12 +582,10 @@ class DBManager:
                     print(f"Error resetting monthly tokens: {e}")
             else:
                 # Local Mode
-                table = db_local.table('users')
-                User = Query()
-                table.update({
+                self._local_update_user(user_id, {
                     'token_usage': {'input': 0, 'output': 0, 'total': 0},
                     'last_reset_date': current_month_str
-                }, User.id == user_id)
+                })
                 usage_reset_triggered = True
                 user_data['token_usage'] = {'input': 0, 'output': 0, 'total': 0}
 
@@ -187,7 +625,11 @@ class DBManager:
             "usage_reset": usage_reset_triggered
         }
 
-    def update_user_tokens(self, user_id, input_count, output_count):
+    def update_user_tokens(self, user_id, input_count, output_count, defer=False):
+        if defer and self._write_behind:
+            self._write_behind.add_tokens(user_id, input_count, output_count)
+            return
+
         total = input_count + output_count
         
         if config.DB_MODE == 'FIREBASE':
@@ -203,20 +645,20 @@ class DBManager:
                 }, merge=True)
             except Exception as e:
                 print(f"Token Save Error: {e}")
+            self._invalidate(user_id, 'user')
         else:
-            # LOCAL MODE logic
-            User = Query()
-            table = db_local.table('users')
-            results = table.search(User.id == user_id)
-            if results:
-                user = results[0]
-                current = user.get('token_usage', {'input': 0, 'output': 0, 'total': 0})
-                new_usage = {
-                    'input': current.get('input', 0) + input_count,
-                    'output': current.get('output', 0) + output_count,
-                    'total': current.get('total', 0) + total
-                }
-                table.update({'token_usage': new_usage}, User.id == user_id)
+            # LOCAL MODE logic (read-modify-write inside one transaction)
+            with self._invalidating(user_id, 'user'), db_local.transaction() as conn:
+                row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+                if row:
+                    user = _load_doc(row)
+                    current = user.get('token_usage', {'input': 0, 'output': 0, 'total': 0})
+                    user['token_usage'] = {
+                        'input': current.get('input', 0) + input_count,
+                        'output': current.get('output', 0) + output_count,
+                        'total': current.get('total', 0) + total
+                    }
+                    conn.execute("UPDATE users SET data = ? WHERE id = ?", (json.dumps(user), user_id))
 
     # --- PORTFOLIO ---
     def get_portfolio_holdings(self, user_id):
@@ -229,70 +671,118 @@ class DBManager:
         Returns:
             dict: A dictionary of holdings keyed by ticker symbol.
         """
+        return self._cached(user_id, 'holdings', lambda: self._load_holdings(user_id))
+
+    def _load_holdings(self, user_id):
         if config.DB_MODE == 'FIREBASE':
             docs = db_client.collection(f'users/{user_id}/portfolio').stream()
             return {doc.id: doc.to_dict() for doc in docs}
         else:
-            Portfolio = Query()
-            items = db_local.table('portfolio').search(Portfolio.user_id == user_id)
-            return {item['ticker']: item for item in items}
+            rows = db_local.query("SELECT ticker, data FROM portfolio WHERE user_id = ?", (user_id,))
+            return {row['ticker']: _load_doc(row) for row in rows}
 
     def update_holding(self, user_id, ticker, data):
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection(f'users/{user_id}/portfolio').document(ticker).set(data, merge=True)
-        else:
-            table = db_local.table('portfolio')
-            Portfolio = Query()
-            data['user_id'] = user_id
-            data['ticker'] = ticker
-            if table.contains((Portfolio.user_id == user_id) & (Portfolio.ticker == ticker)):
-                table.update(data, (Portfolio.user_id == user_id) & (Portfolio.ticker == ticker))
+        with self._invalidating(user_id, 'holdings'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection(f'users/{user_id}/portfolio').document(ticker).set(data, merge=True)
             else:
-                table.insert(data)
+                data['user_id'] = user_id
+                data['ticker'] = ticker
+                with db_local.transaction() as conn:
+                    row = conn.execute("SELECT data FROM portfolio WHERE user_id = ? AND ticker = ?", (user_id, ticker)).fetchone()
+                    doc = _load_doc(row) or {}
+                    doc.update(data)
+                    conn.execute("INSERT OR REPLACE INTO portfolio (user_id, ticker, data) VALUES (?, ?, ?)",
+                                 (user_id, ticker, json.dumps(doc)))
 
     def delete_holding(self, user_id, ticker):
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection(f'users/{user_id}/portfolio').document(ticker).delete()
-        else:
-            Portfolio = Query()
-            db_local.table('portfolio').remove((Portfolio.user_id == user_id) & (Portfolio.ticker == ticker))
+        with self._invalidating(user_id, 'holdings'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection(f'users/{user_id}/portfolio').document(ticker).delete()
+            else:
+                with db_local.transaction() as conn:
+                    conn.execute("DELETE FROM portfolio WHERE user_id = ? AND ticker = ?", (user_id, ticker))
 
     def reset_portfolio(self, user_id, cash_balance):
-        if config.DB_MODE == 'FIREBASE':
-            coll = db_client.collection(f'users/{user_id}/portfolio')
-            for doc in coll.stream(): doc.reference.delete()
-            db_client.collection('users').document(user_id).update({'cash': cash_balance})
-        else:
-            Portfolio = Query()
-            db_local.table('portfolio').remove(Portfolio.user_id == user_id)
-            self.update_user_cash(user_id, cash_balance)
+        self.replace_holdings(user_id, {}, cash_balance)
+
+    def replace_holdings(self, user_id, holdings, cash_balance):
+        """
+        Replaces the user's whole portfolio with `holdings` ({ticker: data}) and
+        sets the cash balance in one transaction (LOCAL) or in 500-op batches
+        (FIREBASE) instead of a reset followed by one write per holding.
+        """
+        with self._invalidating(user_id, 'holdings', 'user'):
+            if config.DB_MODE == 'FIREBASE':
+                coll = db_client.collection(f'users/{user_id}/portfolio')
+                ops = [('delete', ref, None) for ref in coll.list_documents() if ref.id not in holdings]
+                ops += [('set', coll.document(ticker), data) for ticker, data in holdings.items()]
+                ops.append(('update', db_client.collection('users').document(user_id), {'cash': float(cash_balance)}))
+                _commit_batched(ops)
+            else:
+                with db_local.transaction() as conn:
+                    conn.execute("DELETE FROM portfolio WHERE user_id = ?", (user_id,))
+                    conn.executemany("INSERT INTO portfolio (user_id, ticker, data) VALUES (?, ?, ?)",
+                                     [(user_id, ticker, json.dumps(dict(data, user_id=user_id, ticker=ticker)))
+                                      for ticker, data in holdings.items()])
+                    _local_set_cash(conn, user_id, cash_balance)
+
+    def bulk_update_holdings(self, user_id, updates, cash_balance=None):
+        """
+        Applies several holding changes at once: `updates` maps ticker -> fields
+        to merge (as update_holding) or None to delete the holding. The cash
+        balance, if given, is written in the same transaction/batch.
+        """
+        with self._invalidating(user_id, 'holdings', 'user'):
+            if config.DB_MODE == 'FIREBASE':
+                coll = db_client.collection(f'users/{user_id}/portfolio')
+                ops = [('delete', coll.document(ticker), None) if data is None else ('merge', coll.document(ticker), data)
+                       for ticker, data in updates.items()]
+                if cash_balance is not None:
+                    ops.append(('update', db_client.collection('users').document(user_id), {'cash': float(cash_balance)}))
+                _commit_batched(ops)
+            else:
+                with db_local.transaction() as conn:
+                    rows = conn.execute("SELECT ticker, data FROM portfolio WHERE user_id = ?", (user_id,)).fetchall()
+                    current = {row['ticker']: _load_doc(row) for row in rows}
+                    deletes = [(user_id, ticker) for ticker, data in updates.items() if data is None]
+                    writes = [(user_id, ticker, json.dumps({**current.get(ticker, {}), **data, 'user_id': user_id, 'ticker': ticker}))
+                              for ticker, data in updates.items() if data is not None]
+                    conn.executemany("DELETE FROM portfolio WHERE user_id = ? AND ticker = ?", deletes)
+                    conn.executemany("INSERT OR REPLACE INTO portfolio (user_id, ticker, data) VALUES (?, ?, ?)", writes)
+                    if cash_balance is not None:
+                        _local_set_cash(conn, user_id, cash_balance)
 
     # --- WATCHLIST ---
     def get_watchlist(self, user_id):
+        return self._cached(user_id, 'watchlist', lambda: self._load_watchlist(user_id))
+
+    def _load_watchlist(self, user_id):
         if config.DB_MODE == 'FIREBASE':
             docs = db_client.collection(f'users/{user_id}/watchlist').stream()
             return [doc.id for doc in docs]
         else:
-            Watch = Query()
-            items = db_local.table('watchlist').search(Watch.user_id == user_id)
-            return [item['ticker'] for item in items]
+            rows = db_local.query("SELECT ticker FROM watchlist WHERE user_id = ? ORDER BY rowid", (user_id,))
+            return [row['ticker'] for row in rows]
 
     def add_to_watchlist(self, user_id, ticker):
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection(f'users/{user_id}/watchlist').document(ticker).set({'added_at': self.get_timestamp()})
-        else:
-            table = db_local.table('watchlist')
-            Watch = Query()
-            if not table.contains((Watch.user_id == user_id) & (Watch.ticker == ticker)):
-                table.insert({'user_id': user_id, 'ticker': ticker, 'added_at': self.get_timestamp()})
+        with self._invalidating(user_id, 'watchlist'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection(f'users/{user_id}/watchlist').document(ticker).set({'added_at': self.get_timestamp()})
+            else:
+                with db_local.transaction() as conn:
+                    conn.execute("INSERT OR IGNORE INTO watchlist (user_id, ticker, added_at) VALUES (?, ?, ?)",
+                                 (user_id, ticker, self.get_timestamp()))
 
     def remove_from_watchlist(self, user_id, ticker):
-        if config.DB_MODE == 'FIREBASE':
-            db_client.collection(f'users/{user_id}/watchlist').document(ticker).delete()
-            return True
-        else:
-            Watch = Query()
-            return db_local.table('watchlist').remove((Watch.user_id == user_id) & (Watch.ticker == ticker))
+        with self._invalidating(user_id, 'watchlist'):
+            if config.DB_MODE == 'FIREBASE':
+                db_client.collection(f'users/{user_id}/watchlist').document(ticker).delete()
+                return True
+            else:
+                with db_local.transaction() as conn:
+                    cur = conn.execute("DELETE FROM watchlist WHERE user_id = ? AND ticker = ?", (user_id, ticker))
+                return cur.rowcount > 0
 
     # --- HISTORY ---
     def add_history_entry(self, user_id, entry_data):
@@ -302,20 +792,31 @@ class DBManager:
         else:
             entry_data['user_id'] = user_id
             entry_data['timestamp'] = datetime.now().isoformat()
-            db_local.table('history').insert(entry_data)
+            with db_local.transaction() as conn:
+                conn.execute("INSERT INTO history (user_id, timestamp, data) VALUES (?, ?, ?)",
+                             (user_id, entry_data['timestamp'], json.dumps(entry_data)))
 
     def get_history(self, user_id, limit=15):
         if config.DB_MODE == 'FIREBASE':
             docs = db_client.collection(f'users/{user_id}/history').order_by('timestamp', direction='DESCENDING').limit(limit).stream()
             return [doc.to_dict() for doc in docs]
         else:
-            Hist = Query()
-            items = db_local.table('history').search(Hist.user_id == user_id)
-            items.sort(key=lambda x: x['timestamp'], reverse=True)
-            return items[:limit]
+            rows = db_local.query("SELECT data FROM history WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?", (user_id, limit))
+            return [_load_doc(row) for row in rows]
 
     # --- CHATS ---
-    def create_chat(self, user_id, title, first_msg_text, first_msg_role='user'):
+    def create_chat(self, user_id, title, first_msg_text, first_msg_role='user', defer=False):
+        if defer and self._write_behind:
+            if config.DB_MODE == 'FIREBASE':
+                chat_id = db_client.collection(f'users/{user_id}/chats').document().id
+            else:
+                chat_id = str(uuid.uuid4())[:8]
+            self._write_behind.enqueue('chat', user_id, {
+                "chat_id": chat_id, "title": title, "role": first_msg_role,
+                "text": first_msg_text, "timestamp": datetime.now(timezone.utc)
+            })
+            return chat_id
+
         timestamp = self.get_timestamp()
         if config.DB_MODE == 'FIREBASE':
             chat_ref = db_client.collection(f'users/{user_id}/chats').document()
@@ -330,11 +831,20 @@ class DBManager:
         else:
             chat_id = str(uuid.uuid4())[:8]
             ts_iso = datetime.now().isoformat()
-            db_local.table('chats').insert({'id': chat_id, 'user_id': user_id, 'title': title, 'timestamp': ts_iso})
-            db_local.table('messages').insert({'chat_id': chat_id, 'user_id': user_id, 'role': first_msg_role, 'text': first_msg_text, 'timestamp': ts_iso})
+            with db_local.transaction() as conn:
+                conn.execute("INSERT INTO chats (id, user_id, title, timestamp) VALUES (?, ?, ?, ?)", (chat_id, user_id, title, ts_iso))
+                conn.execute("INSERT INTO messages (chat_id, user_id, role, text, metadata, timestamp) VALUES (?, ?, ?, ?, NULL, ?)",
+                             (chat_id, user_id, first_msg_role, first_msg_text, ts_iso))
             return chat_id
 
-    def add_message(self, user_id, chat_id, role, text, metadata=None):
+    def add_message(self, user_id, chat_id, role, text, metadata=None, defer=False):
+        if defer and self._write_behind:
+            self._write_behind.enqueue('message', user_id, {
+                "chat_id": chat_id, "role": role, "text": text,
+                "metadata": metadata, "timestamp": datetime.now(timezone.utc)
+            })
+            return
+
         timestamp = self.get_timestamp()
         msg_data = {"role": role, "text": text, "timestamp": timestamp}
         if metadata:
@@ -343,42 +853,101 @@ class DBManager:
         if config.DB_MODE == 'FIREBASE':
             db_client.collection(f'users/{user_id}/chats/{chat_id}/messages').add(msg_data)
         else:
-            msg_data['chat_id'] = chat_id
-            msg_data['user_id'] = user_id
-            msg_data['timestamp'] = datetime.now().isoformat()
-            db_local.table('messages').insert(msg_data)
+            with db_local.transaction() as conn:
+                conn.execute("INSERT INTO messages (chat_id, user_id, role, text, metadata, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                             (chat_id, user_id, role, text, _metadata_json(metadata), datetime.now().isoformat()))
 
     def get_chats(self, user_id):
+        self._flush_pending(user_id)
         if config.DB_MODE == 'FIREBASE':
             docs = db_client.collection(f'users/{user_id}/chats').order_by('timestamp', direction='DESCENDING').limit(50).stream()
             return [{"chatId": d.id, "title": d.to_dict().get("title", "Chat")} for d in docs]
         else:
-            Chat = Query()
-            items = db_local.table('chats').search(Chat.user_id == user_id)
-            items.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            return [{"chatId": d['id'], "title": d.get('title', 'Chat')} for d in items]
+            rows = db_local.query("SELECT id, title FROM chats WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
+            return [{"chatId": row['id'], "title": row['title'] or 'Chat'} for row in rows]
 
     def get_chat_messages(self, user_id, chat_id):
+        self._flush_pending(user_id)
         if config.DB_MODE == 'FIREBASE':
             docs = db_client.collection(f'users/{user_id}/chats/{chat_id}/messages').order_by('timestamp', direction='ASCENDING').limit(100).stream()
             return [{"role": d.to_dict().get('role'), "text": d.to_dict().get('text'), "metadata": d.to_dict().get('metadata')} for d in docs]
         else:
-            Msg = Query()
-            items = db_local.table('messages').search(Msg.chat_id == chat_id)
-            items.sort(key=lambda x: x['timestamp'])
-            return [{"role": d['role'], "text": d['text'], "metadata": d.get('metadata')} for d in items]
+            rows = db_local.query("SELECT role, text, metadata FROM messages WHERE chat_id = ? ORDER BY timestamp, row_id", (chat_id,))
+            return [{"role": row['role'], "text": row['text'], "metadata": json.loads(row['metadata']) if row['metadata'] is not None else None} for row in rows]
 
     def delete_chat(self, user_id, chat_id):
+        self._flush_pending(user_id)
         if config.DB_MODE == 'FIREBASE':
             db_client.collection(f'users/{user_id}/chats').document(chat_id).delete()
         else:
-            Chat, Msg = Query(), Query()
-            db_local.table('chats').remove((Chat.id == chat_id) & (Chat.user_id == user_id))
-            db_local.table('messages').remove(Msg.chat_id == chat_id)
+            with db_local.transaction() as conn:
+                conn.execute("DELETE FROM chats WHERE id = ? AND user_id = ?", (chat_id, user_id))
+                conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
 
     def rename_chat(self, user_id, chat_id, new_title):
+        self._flush_pending(user_id)
         if config.DB_MODE == 'FIREBASE':
             db_client.collection(f'users/{user_id}/chats').document(chat_id).update({'title': new_title})
         else:
-            Chat = Query()
-            db_local.table('chats').update({'title': new_title}, (Chat.id == chat_id) & (Chat.user_id == user_id))
\ No newline at end of file
+            with db_local.transaction() as conn:
+                conn.execute("UPDATE chats SET title = ? WHERE id = ? AND user_id = ?", (new_title, chat_id, user_id))
+
+    # --- WRITE-BEHIND ---
+    def _flush_pending(self, user_id):
+        if self._write_behind and self._write_behind.has_pending(user_id):
+            self._write_behind.flush()
+
+    def flush_pending_writes(self):
+        """Commits every queued write now. Returns False if the commit failed (writes stay queued)."""
+        return self._write_behind.flush() if self._write_behind else True
+
+    def _commit_deferred(self, ops, tokens):
+        """
+        Applies one flush worth of queued writes atomically. Timestamps were taken
+        at enqueue time, so messages keep their order even though they share a batch.
+        """
+        try:
+            if config.DB_MODE == 'FIREBASE':
+                # The queue never hands over more than FIRESTORE_BATCH_LIMIT writes at once
+                batch = db_client.batch()
+                for kind, user_id, p in ops:
+                    chat_ref = db_client.collection(f'users/{user_id}/chats').document(p['chat_id'])
+                    if kind == 'chat':
+                        batch.set(chat_ref, {"title": p['title'], "timestamp": p['timestamp']})
+                    msg_data = {"role": p['role'], "text": p['text'], "timestamp": p['timestamp']}
+                    if p.get('metadata'):
+                        msg_data["metadata"] = p['metadata']
+                    batch.set(chat_ref.collection('messages').document(), msg_data)
+                for user_id, (input_count, output_count) in tokens.items():
+                    batch.set(db_client.collection('users').document(user_id), {
+                        'token_usage': {
+                            'input': firestore.Increment(input_count),
+                            'output': firestore.Increment(output_count),
+                            'total': firestore.Increment(input_count + output_count)
+                        }
+                    }, merge=True)
+                batch.commit()
+            else:
+                with db_local.transaction(durable=True) as conn:
+                    for kind, user_id, p in ops:
+                        ts_iso = p['timestamp'].astimezone().replace(tzinfo=None).isoformat()
+                        if kind == 'chat':
+                            conn.execute("INSERT INTO chats (id, user_id, title, timestamp) VALUES (?, ?, ?, ?)",
+                                         (p['chat_id'], user_id, p['title'], ts_iso))
+                        conn.execute("INSERT INTO messages (chat_id, user_id, role, text, metadata, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                                     (p['chat_id'], user_id, p['role'], p['text'],
+                                      _metadata_json(p.get('metadata')), ts_iso))
+                    for user_id, (input_count, output_count) in tokens.items():
+                        row = conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+                        if not row: continue
+                        user = _load_doc(row)
+                        current = user.get('token_usage', {'input': 0, 'output': 0, 'total': 0})
+                        user['token_usage'] = {
+                            'input': current.get('input', 0) + input_count,
+                            'output': current.get('output', 0) + output_count,
+                            'total': current.get('total', 0) + input_count + output_count
+                        }
+                        conn.execute("UPDATE users SET data = ? WHERE id = ?", (json.dumps(user), user_id))
+        finally:
+            for user_id in tokens:
+                self._invalidate(user_id, 'user')
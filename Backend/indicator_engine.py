@@ -0,0 +1,307 @@
+import copy
+import threading
+from collections import OrderedDict, deque
+import numpy as np
+import pandas as pd
+
+# Vectorized indicator math over a (dates x tickers) matrix.
+# Formulas match the `ta` package (RSIIndicator, EMAIndicator, MACD), which
+# uses pandas ewm(adjust=False) with min_periods=window, so the last values
+# agree with the per-ticker path to floating point precision.
+
+
+def build_panel(frames, fields=('Open', 'High', 'Low', 'Close', 'Volume')):
+    """
+    Stacks {ticker: OHLCV DataFrame} into right-aligned 2-D arrays.
+
+    Rows where any requested field is missing are dropped per ticker (same as
+    `df.dropna()`), and each column's remaining bars are shifted to the bottom
+    so row -1 is every ticker's latest bar. Leading rows are NaN padding.
+
+    Returns:
+        (tickers, {field: ndarray[dates, tickers]}, bars_per_ticker)
+    """
+    tickers = [t for t, f in frames.items() if f is not None and not f.empty]
+    if not tickers:
+        return [], {f: np.empty((0, 0)) for f in fields}, np.zeros(0, dtype=int)
+
+    raw = {}
+    for field in fields:
+        raw[field] = pd.DataFrame({t: frames[t][field] for t in tickers}).sort_index().to_numpy(dtype=np.float64)
+
+    valid = np.ones_like(raw[fields[0]], dtype=bool)
+    for field in fields:
+        valid &= ~np.isnan(raw[field])
+
+    # Stable sort puts invalid rows first and keeps valid bars in time order
+    order = np.argsort(valid, axis=0, kind='stable')
+    aligned_valid = np.take_along_axis(valid, order, axis=0)
+    panel = {}
+    for field in fields:
+        arr = np.take_along_axis(raw[field], order, axis=0)
+        arr[~aligned_valid] = np.nan
+        panel[field] = arr
+
+    return tickers, panel, valid.sum(axis=0)
+
+
+def ewm(values, alpha, min_periods):
+    """
+    pandas `ewm(alpha=..., adjust=False, min_periods=...).mean()` for every column.
+    Assumes NaNs only appear as leading padding (see build_panel).
+    """
+    out = np.full(values.shape, np.nan)
+    if values.size == 0:
+        return out
+    state = np.full(values.shape[1], np.nan)
+    count = np.zeros(values.shape[1], dtype=int)
+
+    for t in range(values.shape[0]):
+        x = values[t]
+        has_x = ~np.isnan(x)
+        started = ~np.isnan(state)
+        state = np.where(has_x & started, (1 - alpha) * state + alpha * x, np.where(has_x, x, state))
+        count += has_x
+        out[t] = np.where(count >= min_periods, state, np.nan)
+    return out
+
+
+def ema(close, window):
+    return ewm(close, 2.0 / (window + 1), window)
+
+
+def rsi(close, window=14):
+    diff = np.full(close.shape, np.nan)
+    diff[1:] = close[1:] - close[:-1]
+    # `ta` turns the first (NaN) diff into 0.0, so the smoothing starts on the first bar
+    first_bar = ~np.isnan(close) & np.isnan(diff)
+    diff[first_bar] = 0.0
+
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    up[np.isnan(diff)] = np.nan
+    down[np.isnan(diff)] = np.nan
+
+    ema_up = ewm(up, 1.0 / window, window)
+    ema_down = ewm(down, 1.0 / window, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = 100 - (100 / (1 + ema_up / ema_down))
+    return np.where(ema_down == 0, 100.0, value)
+
+
+def macd_diff(close, window_fast=12, window_slow=26, window_sign=9):
+    macd_line = ema(close, window_fast) - ema(close, window_slow)
+    return macd_line - ema(macd_line, window_sign)
+
+
+def volume_ratio(volume, window=20):
+    """Last bar's volume over the mean of the last `window` bars (1.0 when the mean is 0)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg = np.nanmean(volume[-window:], axis=0)
+        ratio = volume[-1] / avg
+    return np.where(avg > 0, ratio, 1.0)
+
+
+def screen_indicators(frames):
+    """
+    Computes the screener's last-bar indicators for a whole universe at once.
+
+    Returns:
+        dict of equally sized arrays keyed by 'ticker', 'price', 'rsi', 'ema_50',
+        'macd_hist', 'vol_ratio' and 'bars'.
+    """
+    tickers, panel, bars = build_panel(frames)
+    if not tickers:
+        empty = np.zeros(0)
+        return {"ticker": np.array([], dtype=object), "price": empty, "rsi": empty,
+                "ema_50": empty, "macd_hist": empty, "vol_ratio": empty, "bars": bars}
+
+    close = panel['Close']
+    return {
+        "ticker": np.array(tickers, dtype=object),
+        "price": close[-1],
+        "rsi": rsi(close, 14)[-1],
+        "ema_50": ema(close, 50)[-1],
+        "macd_hist": macd_diff(close)[-1],
+        "vol_ratio": volume_ratio(panel['Volume'], 20),
+        "bars": bars
+    }
+
+
+# --- INCREMENTAL STATE ---
+# Per-ticker, per-timeframe running state for get_technical_rating. Every
+# recursive indicator (Wilder RSI, EMA-12/26, MACD signal) advances in O(1)
+# per bar; rolling windows (Bollinger 20, volume 50) keep fixed-size deques.
+# The newest bar is applied provisionally on a copy, because during a session
+# it keeps changing; only bars that have been superseded get committed.
+
+def _naive(index):
+    idx = pd.DatetimeIndex(index)
+    return idx.tz_localize(None) if idx.tz is not None else idx
+
+
+class IndicatorState:
+    RSI_WINDOW = 14
+    EMA_FAST, EMA_SLOW, SIGNAL = 12, 26, 9
+    BB_WINDOW, BB_DEV = 20, 2
+    VOLUME_WINDOW = 50
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.bars = 0
+        self.last_ts = None
+        self.last_close = None
+        self.avg_gain = None
+        self.avg_loss = None
+        self.ema_fast = None
+        self.ema_slow = None
+        self.macd_count = 0
+        self.signal = None
+        self.closes = deque(maxlen=self.BB_WINDOW)
+        self.volumes = deque(maxlen=self.VOLUME_WINDOW)
+
+    @property
+    def ready(self):
+        return self.last_ts is not None
+
+    def _step(self, close, volume):
+        a_rsi = 1.0 / self.RSI_WINDOW
+        if self.last_close is None:
+            gain = loss = 0.0
+        else:
+            change = close - self.last_close
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+        self.avg_gain = gain if self.avg_gain is None else (1 - a_rsi) * self.avg_gain + a_rsi * gain
+        self.avg_loss = loss if self.avg_loss is None else (1 - a_rsi) * self.avg_loss + a_rsi * loss
+
+        a_fast = 2.0 / (self.EMA_FAST + 1)
+        a_slow = 2.0 / (self.EMA_SLOW + 1)
+        self.ema_fast = close if self.ema_fast is None else (1 - a_fast) * self.ema_fast + a_fast * close
+        self.ema_slow = close if self.ema_slow is None else (1 - a_slow) * self.ema_slow + a_slow * close
+
+        self.bars += 1
+        if self.bars >= self.EMA_SLOW:
+            macd_line = self.ema_fast - self.ema_slow
+            a_sig = 2.0 / (self.SIGNAL + 1)
+            self.signal = macd_line if self.signal is None else (1 - a_sig) * self.signal + a_sig * macd_line
+            self.macd_count += 1
+
+        self.last_close = close
+        self.closes.append(close)
+        self.volumes.append(0.0 if np.isnan(volume) else volume)
+
+    def _readings(self):
+        nan = float('nan')
+        if self.bars >= self.RSI_WINDOW:
+            rsi_val = 100.0 if self.avg_loss == 0 else 100 - (100 / (1 + self.avg_gain / self.avg_loss))
+        else:
+            rsi_val = nan
+
+        macd_diff_val = nan
+        if self.macd_count >= self.SIGNAL:
+            macd_diff_val = (self.ema_fast - self.ema_slow) - self.signal
+
+        bb_upper = bb_lower = nan
+        if len(self.closes) == self.BB_WINDOW:
+            window = np.fromiter(self.closes, dtype=np.float64)
+            mean, std = window.mean(), window.std()
+            bb_upper, bb_lower = mean + self.BB_DEV * std, mean - self.BB_DEV * std
+
+        closes = list(self.closes)
+        momentum = ((closes[-1] - closes[-4]) / closes[-4]) * 100 if len(closes) > 3 else 0
+        avg_volume = float(np.mean(self.volumes)) if self.volumes else 0.0
+
+        return {
+            "bars": self.bars,
+            "price": self.last_close,
+            "rsi": rsi_val,
+            "macd_diff": macd_diff_val,
+            "bb_upper": bb_upper,
+            "bb_lower": bb_lower,
+            "volume_spike": self.volumes[-1] / avg_volume if avg_volume > 0 else 1.0,
+            "momentum": momentum
+        }
+
+    def _apply_rows(self, closes, volumes, index, commit_upto):
+        for i in range(commit_upto):
+            self._step(closes[i], volumes[i])
+            self.last_ts = index[i]
+
+    def rebuild(self, hist):
+        """
+        Full recomputation from a history DataFrame (Close, Volume). Commits all
+        bars except the newest and returns the readings including it.
+        """
+        self.reset()
+        return self.advance(hist)
+
+    def advance(self, hist):
+        """
+        Applies bars from `hist` that are newer than the last committed bar.
+
+        `hist` should start at (or before) the last committed bar so the
+        overlap can be checked; if that bar's close has changed (history
+        correction, split/dividend adjustment) or is missing, returns None and
+        the caller must `rebuild` from full history.
+        """
+        hist = hist.dropna(subset=['Close'])
+        if hist.empty:
+            return None if self.ready else self._readings()
+        index = _naive(hist.index)
+        closes = hist['Close'].to_numpy(dtype=np.float64)
+        volumes = hist['Volume'].to_numpy(dtype=np.float64) if 'Volume' in hist.columns else np.zeros(len(hist))
+
+        if self.ready:
+            pos = index.searchsorted(self.last_ts)
+            if pos >= len(index) or index[pos] != self.last_ts:
+                return None
+            if not np.isclose(closes[pos], self.last_close, rtol=1e-4):
+                return None
+            index, closes, volumes = index[pos + 1:], closes[pos + 1:], volumes[pos + 1:]
+            if len(index) == 0:
+                return self._readings()
+
+        # Commit everything but the newest bar, which may still be forming
+        self._apply_rows(closes, volumes, index, len(index) - 1)
+        provisional = copy.copy(self)
+        provisional.closes = deque(self.closes, maxlen=self.BB_WINDOW)
+        provisional.volumes = deque(self.volumes, maxlen=self.VOLUME_WINDOW)
+        provisional._step(closes[-1], volumes[-1])
+        return provisional._readings()
+
+
+class IndicatorStates:
+    """
+    Shared IndicatorState per key (e.g. (ticker, period, interval)).
+    Beyond `max_states` the least recently used state is dropped; it is
+    simply rebuilt from full history on its next use.
+    """
+
+    def __init__(self, max_states=2000):
+        self.max_states = max_states
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+        self._evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = IndicatorState()
+                while len(self._states) > self.max_states:
+                    self._states.popitem(last=False)
+                    self._evictions += 1
+            else:
+                self._states.move_to_end(key)
+            return state
+
+    def discard(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"states": len(self._states), "max_states": self.max_states, "evictions": self._evictions}
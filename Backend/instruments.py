@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Local copy of the Kite instrument master for NSE/BSE equities.
+# Rows live in an indexed SQLite table and are mirrored into dicts on load,
+# so instrument token, exchange symbol, ISIN and Yahoo ticker map onto each
+# other in O(1). Kite's dump has no ISINs; they are learned from holdings and
+# kept across refreshes (equity instrument tokens are stable).
+
+EXCHANGES = ('NSE', 'BSE')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS instruments (
+    instrument_token INTEGER PRIMARY KEY,
+    exchange TEXT NOT NULL, tradingsymbol TEXT NOT NULL, name TEXT, isin TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_instruments_symbol ON instruments (exchange, tradingsymbol);
+CREATE INDEX IF NOT EXISTS idx_instruments_isin ON instruments (isin);
+"""
+
+
+def _is_equity(item):
+    return item.get('exchange') in EXCHANGES and item.get('segment') == item.get('exchange') \
+        and item.get('instrument_type') == 'EQ' and item.get('tradingsymbol')
+
+
+class InstrumentMaster:
+    def __init__(self, path, max_age_seconds=86400):
+        self.path = path
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._refreshed_at = 0.0
+        self._by_token = {}  # token -> row dict
+        self._by_symbol = {}  # (exchange, tradingsymbol) -> row dict
+        self._by_isin = {}  # isin -> {exchange: row dict}
+        self._by_yahoo = {}  # Yahoo ticker -> row dict
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._load()
+
+    def _load(self):
+        with self._lock:
+            meta = self._conn.execute("SELECT value FROM meta WHERE key = 'refreshed_at'").fetchone()
+            rows = [dict(row) for row in self._conn.execute(
+                "SELECT instrument_token, exchange, tradingsymbol, name, isin FROM instruments")]
+        self._refreshed_at = float(meta['value']) if meta else 0.0
+        self._build(rows)
+
+    def _build(self, rows):
+        by_token, by_symbol, by_isin = {}, {}, {}
+        for row in rows:
+            by_token[row['instrument_token']] = row
+            by_symbol[(row['exchange'], row['tradingsymbol'])] = row
+            if row['isin']:
+                by_isin.setdefault(row['isin'], {})[row['exchange']] = row
+        self._by_token, self._by_symbol, self._by_isin = by_token, by_symbol, by_isin
+        self._by_yahoo = {}
+        for row in rows:
+            self._by_yahoo.setdefault(self._yahoo(row), row)
+
+    def _yahoo(self, row):
+        """NSE listings map to .NS; BSE ones too when the same stock trades on NSE, else .BO."""
+        if row['exchange'] == 'NSE':
+            return f"{row['tradingsymbol']}.NS"
+        nse = self._by_isin.get(row['isin'], {}).get('NSE') if row['isin'] else None
+        if nse:
+            return f"{nse['tradingsymbol']}.NS"
+        if ('NSE', row['tradingsymbol']) in self._by_symbol:
+            return f"{row['tradingsymbol']}.NS"
+        return f"{row['tradingsymbol']}.BO"
+
+    def refresh(self, instruments):
+        """Replaces the table with the NSE/BSE equities from a Kite instruments dump. Returns the row count."""
+        rows = [{'instrument_token': int(item['instrument_token']), 'exchange': item['exchange'],
+                 'tradingsymbol': item['tradingsymbol'].strip().upper(), 'name': item.get('name') or None,
+                 'isin': None} for item in instruments if _is_equity(item)]
+        if not rows:
+            return 0
+        now = time.time()
+        with self._lock:
+            known_isins = {row['instrument_token']: row['isin'] for row in self._conn.execute(
+                "SELECT instrument_token, isin FROM instruments WHERE isin IS NOT NULL")}
+            for row in rows:
+                row['isin'] = known_isins.get(row['instrument_token'])
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM instruments")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO instruments (instrument_token, exchange, tradingsymbol, name, isin) "
+                    "VALUES (:instrument_token, :exchange, :tradingsymbol, :name, :isin)", rows)
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('refreshed_at', ?)", (str(now),))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._refreshed_at = now
+        self._build(rows)
+        return len(rows)
+
+    def record_isins(self, pairs):
+        """Stores ISINs reported for instrument tokens (e.g. by Kite holdings); unknown tokens are ignored."""
+        updates = [(isin, token) for token, isin in pairs
+                   if isin and token in self._by_token and self._by_token[token]['isin'] != isin]
+        if not updates:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("UPDATE instruments SET isin = ? WHERE instrument_token = ?", updates)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            rows = dict(self._by_token)
+            for isin, token in updates:
+                rows[token] = dict(rows[token], isin=isin)
+        self._build(list(rows.values()))
+
+    def lookup(self, token=None, exchange=None, tradingsymbol=None, isin=None):
+        """Row dict (with its Yahoo ticker) by token, exchange symbol or ISIN, whichever matches first."""
+        row = self._by_token.get(token) if token is not None else None
+        if row is None and tradingsymbol:
+            row = self._by_symbol.get((exchange or 'NSE', tradingsymbol.strip().upper()))
+        if row is None and isin:
+            listings = self._by_isin.get(isin, {})
+            row = listings.get(exchange) or listings.get('NSE') or listings.get('BSE')
+        return dict(row, yahoo=self._yahoo(row)) if row else None
+
+    def yahoo_symbol(self, tradingsymbol, exchange='NSE', token=None, isin=None):
+        row = self.lookup(token, exchange, tradingsymbol, isin)
+        return row['yahoo'] if row else None
+
+    def from_yahoo(self, ticker):
+        row = self._by_yahoo.get(ticker)
+        return dict(row, yahoo=ticker) if row else None
+
+    def resolver_rows(self):
+        """(ticker, name, exchanges) rows for ticker_resolver."""
+        return [(f"{row['tradingsymbol']}{'.NS' if row['exchange'] == 'NSE' else '.BO'}", row['name'], [row['exchange']])
+                for row in self._by_token.values()]
+
+    def stale(self):
+        return time.time() - self._refreshed_at > self.max_age_seconds
+
+    def start_background_refresh(self, fetch_fn, on_refresh=None, check_interval_seconds=3600, initial_delay_seconds=90):
+        """
+        Re-downloads the master once it is older than max_age_seconds.
+        `fetch_fn()` returns the Kite instrument dicts; `on_refresh()` runs
+        after each successful refresh. Failures keep the current copy.
+        """
+        if self._thread is not None:
+            return
+
+        def run():
+            if self._stop.wait(initial_delay_seconds):
+                return
+            while True:
+                if self.stale():
+                    try:
+                        if self.refresh(fetch_fn()) and on_refresh:
+                            on_refresh()
+                    except Exception as e:
+                        print(f"[Warning] Instrument master refresh failed: {e}")
+                if self._stop.wait(check_interval_seconds):
+                    return
+
+        self._thread = threading.Thread(target=run, name="instrument-master-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {"instruments": len(self._by_token), "isins": len(self._by_isin),
+                "age_seconds": int(time.time() - self._refreshed_at) if self._refreshed_at else None}
@@ -0,0 +1,85 @@
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+import config
+
+# NSE trading session, in exchange time (IST, no DST)
+IST = timezone(timedelta(hours=5, minutes=30))
+_HOLIDAYS = frozenset(date.fromisoformat(d) for d in config.NSE_HOLIDAYS)
+
+
+def _parse_hhmm(value):
+    hours, minutes = value.split(':')
+    return dt_time(int(hours), int(minutes))
+
+
+def now_ist():
+    return datetime.now(IST)
+
+
+def is_trading_day(day):
+    """True for weekdays that are not on the NSE_HOLIDAYS list."""
+    return day.weekday() < 5 and day not in _HOLIDAYS
+
+
+def is_market_open(now=None):
+    """True during the regular NSE session (trading days, NSE_SESSION_OPEN-NSE_SESSION_CLOSE IST)."""
+    now = (now or now_ist()).astimezone(IST)
+    if not is_trading_day(now.date()):
+        return False
+    return _parse_hhmm(config.NSE_SESSION_OPEN) <= now.time() <= _parse_hhmm(config.NSE_SESSION_CLOSE)
+
+
+def next_session_open(now=None):
+    """Start of the next regular session strictly after `now` (today's, if it has not opened yet)."""
+    now = (now or now_ist()).astimezone(IST)
+    open_time = _parse_hhmm(config.NSE_SESSION_OPEN)
+    day = now.date()
+    if not (is_trading_day(day) and now.time() < open_time):
+        day += timedelta(days=1)
+        while not is_trading_day(day):
+            day += timedelta(days=1)
+    return datetime.combine(day, open_time, tzinfo=IST)
+
+
+def ttl_for(data_class, now=None):
+    """
+    Cache TTL (seconds) for a data class ('price', 'info', 'indicator', 'news', 'fundamentals').
+    During a session (and while closing prices settle) this is the class TTL from
+    CACHE_TTL_BY_CLASS; outside it, market-bound classes live until the next open.
+    """
+    ttl = config.CACHE_TTL_BY_CLASS.get(data_class, config.CACHE_TTL_SECONDS)
+    if data_class not in config.CACHE_MARKET_BOUND_CLASSES:
+        return ttl
+
+    now = (now or now_ist()).astimezone(IST)
+    if is_market_open(now):
+        return ttl
+    if is_trading_day(now.date()):
+        close = datetime.combine(now.date(), _parse_hhmm(config.NSE_SESSION_CLOSE), tzinfo=IST)
+        if close <= now < close + timedelta(seconds=config.CACHE_CLOSE_SETTLE_SECONDS):
+            return ttl
+    return max(ttl, int((next_session_open(now) - now).total_seconds()))
+
+
+def _settled_close(day):
+    close = datetime.combine(day, _parse_hhmm(config.NSE_SESSION_CLOSE), tzinfo=IST)
+    return close + timedelta(seconds=config.CACHE_CLOSE_SETTLE_SECONDS)
+
+
+def last_closed_session(now=None):
+    """Date of the most recent trading session whose closing prices have settled."""
+    now = (now or now_ist()).astimezone(IST)
+    day = now.date()
+    if not (is_trading_day(day) and now >= _settled_close(day)):
+        day -= timedelta(days=1)
+        while not is_trading_day(day):
+            day -= timedelta(days=1)
+    return day
+
+
+def next_settled_close(now=None):
+    """Moment the next session to close (possibly today's) has settled, i.e. when last_closed_session() moves on."""
+    now = (now or now_ist()).astimezone(IST)
+    day = now.date()
+    while not is_trading_day(day) or now >= _settled_close(day):
+        day += timedelta(days=1)
+    return _settled_close(day)
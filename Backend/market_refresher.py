@@ -0,0 +1,153 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class HotTickerTracker:
+    """
+    Remembers which tickers users are looking at (watchlists, holdings,
+    screens, lookups). A ticker stays hot for `idle_seconds` after its last
+    touch; beyond `max_tickers` the least recently touched are dropped.
+    """
+
+    def __init__(self, idle_seconds=1800, max_tickers=200):
+        self.idle_seconds = idle_seconds
+        self.max_tickers = max_tickers
+        self._lock = threading.Lock()
+        self._touched = {}  # ticker -> last touch time
+
+    def touch(self, tickers):
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        now = time.time()
+        with self._lock:
+            for t in tickers:
+                if isinstance(t, str) and t:
+                    self._touched[t] = now
+            if len(self._touched) > self.max_tickers:
+                keep = sorted(self._touched.items(), key=lambda kv: kv[1], reverse=True)[:self.max_tickers]
+                self._touched = dict(keep)
+
+    def hot(self):
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            self._touched = {t: ts for t, ts in self._touched.items() if ts >= cutoff}
+            return list(self._touched)
+
+
+class BackgroundRefresher:
+    """
+    Periodically calls `refresh_fn(hot_tickers)` while `is_active()` holds
+    (e.g. during market hours), and runs one-off stale-while-revalidate
+    refreshes on a small pool, at most one per key at a time.
+    """
+
+    def __init__(self, refresh_fn, tracker, interval_seconds=60, is_active=None, workers=4):
+        self.refresh_fn = refresh_fn
+        self.tracker = tracker
+        self.interval_seconds = interval_seconds
+        self.is_active = is_active or (lambda: True)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cache-refresh")
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"cycles": 0, "paused_cycles": 0, "revalidations": 0, "last_refresh": None, "last_refreshed": 0}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="market-refresher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            if not self.is_active():
+                self._stats["paused_cycles"] += 1
+                continue
+            tickers = self.tracker.hot()
+            if not tickers:
+                continue
+            try:
+                refreshed = self.refresh_fn(tickers)
+                self._stats["cycles"] += 1
+                self._stats["last_refresh"] = time.time()
+                self._stats["last_refreshed"] = refreshed or 0
+            except Exception as e:
+                print(f"[Error] Background refresh failed: {e}")
+
+    def revalidate(self, key, fn, *args):
+        """Schedules `fn(*args)` in the background unless a refresh for `key` is already queued."""
+        with self._pending_lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+        self._stats["revalidations"] += 1
+
+        def task():
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[Warning] Revalidation failed for {key}: {e}")
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(key)
+
+        self._pool.submit(task)
+        return True
+
+    def stats(self):
+        with self._pending_lock:
+            pending = len(self._pending)
+        return dict(self._stats, hot_tickers=len(self.tracker.hot()), pending_revalidations=pending,
+                    active=self.is_active())
+
+
+class SessionJob:
+    """
+    Runs `job_fn(session)` once per closed trading session, where `session` is
+    what `latest_session()` returns (e.g. the last session whose close has
+    settled). A daemon thread checks every `check_interval_seconds` (first
+    after `initial_delay_seconds`); a failed run is retried on the next check.
+    """
+
+    def __init__(self, job_fn, latest_session, check_interval_seconds=900, initial_delay_seconds=0, name="session-job"):
+        self.job_fn = job_fn
+        self.latest_session = latest_session
+        self.check_interval_seconds = check_interval_seconds
+        self.initial_delay_seconds = initial_delay_seconds
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {"runs": 0, "failures": 0, "last_session": None, "last_run_seconds": None}
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        if self._stop.wait(self.initial_delay_seconds):
+            return
+        while True:
+            session = self.latest_session()
+            if session != self._stats["last_session"]:
+                started = time.time()
+                try:
+                    self.job_fn(session)
+                    self._stats["runs"] += 1
+                    self._stats["last_session"] = session
+                    self._stats["last_run_seconds"] = round(time.time() - started, 1)
+                except Exception as e:
+                    self._stats["failures"] += 1
+                    print(f"[Error] {self.name} failed for session {session}: {e}")
+            if self._stop.wait(self.check_interval_seconds):
+                return
+
+    def stats(self):
+        return dict(self._stats, last_session=str(self._stats["last_session"]) if self._stats["last_session"] else None)
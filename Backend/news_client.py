@@ -0,0 +1,181 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import config
+
+# NewsAPI client shared by the sync tools and the ASGI server.
+# One pooled HTTP session, and key state that outlives a single call: keys
+# that are rate limited or rejected sit out a cooldown instead of being
+# retried on every lookup. Keys are picked per config.NEWS_API_MODE.
+
+NEWSAPI_URL = "https://newsapi.org/v2/everything"
+
+# NewsAPI error codes that are specific to the key (another key may still work)
+_KEY_ERRORS = {'rateLimited', 'apiKeyExhausted', 'apiKeyInvalid', 'apiKeyDisabled', 'apiKeyMissing'}
+_BAD_KEY_ERRORS = {'apiKeyInvalid', 'apiKeyDisabled', 'apiKeyMissing'}
+
+
+def format_articles(articles):
+    return [{"title": a.get('title'), "source": (a.get('source') or {}).get('name'), "description": a.get('description'),
+             "url": a.get('url'), "publishedAt": a.get('publishedAt')} for a in articles]
+
+
+def batch_queries(names, max_chars):
+    """Splits company names into OR-joined phrase queries of at most `max_chars` characters."""
+    batches, current = [], []
+    for name in names:
+        candidate = current + [name]
+        if current and len(" OR ".join(f'"{n}"' for n in candidate)) > max_chars:
+            batches.append(current)
+            candidate = [name]
+        current = candidate
+    if current:
+        batches.append(current)
+    return batches
+
+
+def match_articles(names, articles, per_name):
+    """Assigns each article to the names mentioned in its title or description."""
+    matched = {name: [] for name in names}
+    for a in articles:
+        text = f"{a.get('title') or ''} {a.get('description') or ''}".lower()
+        for name in names:
+            if len(matched[name]) < per_name and name.lower() in text:
+                matched[name].append(a)
+    return matched
+
+
+class KeyRotation:
+    """
+    Orders NewsAPI keys for each call: 'sequential' always starts from the
+    first key, 'round_robin' starts one key further each call. Keys on
+    cooldown are skipped until it expires.
+    """
+
+    def __init__(self, keys, mode='sequential', cooldown_seconds=3600):
+        self.keys = [k for k in keys if k]
+        self.mode = mode
+        self.cooldown_seconds = cooldown_seconds
+        self._lock = threading.Lock()
+        self._next = 0
+        self._cooldown_until = {}
+
+    def order(self):
+        now = time.time()
+        with self._lock:
+            keys = self.keys
+            if self.mode == 'round_robin' and keys:
+                start = self._next % len(keys)
+                self._next = start + 1
+                keys = keys[start:] + keys[:start]
+            return [k for k in keys if self._cooldown_until.get(k, 0) <= now]
+
+    def bench(self, key, seconds=None):
+        with self._lock:
+            self._cooldown_until[key] = time.time() + (seconds or self.cooldown_seconds)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            cooling = sum(1 for until in self._cooldown_until.values() if until > now)
+        return {"mode": self.mode, "keys": len(self.keys), "cooling_down": cooling}
+
+
+class NewsClient:
+    def __init__(self, keys, mode='sequential', cooldown_seconds=3600, timeout=5, pool_size=20):
+        self.rotation = KeyRotation(keys, mode, cooldown_seconds)
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._counters_lock = threading.Lock()
+        self._counters = {"requests": 0, "key_errors": 0, "failures": 0}
+
+    def _count(self, **deltas):
+        with self._counters_lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+
+    @staticmethod
+    def params(query, page_size=5):
+        return {'language': 'en', 'sortBy': 'relevancy', 'pageSize': page_size, 'q': query}
+
+    def handle_response(self, key, status, data, headers):
+        """
+        Returns (articles, retry): the article list on success, or None plus
+        whether the next key should be tried. Key-specific errors bench the key.
+        """
+        if status == 200 and data.get('status') == 'ok':
+            return data.get('articles', []), False
+        code = data.get('code')
+        if status in (401, 429) or code in _KEY_ERRORS:
+            retry_after = headers.get('Retry-After')
+            seconds = int(retry_after) if retry_after and retry_after.isdigit() else None
+            if code in _BAD_KEY_ERRORS:
+                seconds = 24 * 3600
+            self.rotation.bench(key, seconds)
+            self._count(key_errors=1)
+            return None, True
+        self._count(failures=1)
+        return None, False
+
+    def search(self, query, page_size=5):
+        """Articles for `query`, or None if NewsAPI is unavailable (no usable key, network or server error)."""
+        for key in self.rotation.order():
+            self._count(requests=1)
+            try:
+                response = self._session.get(NEWSAPI_URL, params=self.params(query, page_size),
+                                             headers={'X-Api-Key': key}, timeout=self.timeout)
+                data = response.json()
+            except (requests.RequestException, ValueError):
+                self._count(failures=1)
+                return None
+            articles, retry = self.handle_response(key, response.status_code, data, response.headers)
+            if not retry:
+                return articles
+        return None
+
+    async def search_async(self, http, query, page_size=5):
+        """Same as `search` over an httpx.AsyncClient, sharing the key state."""
+        for key in self.rotation.order():
+            self._count(requests=1)
+            try:
+                response = await http.get(NEWSAPI_URL, params=self.params(query, page_size), headers={'X-Api-Key': key})
+                data = response.json()
+            except Exception:
+                self._count(failures=1)
+                return None
+            articles, retry = self.handle_response(key, response.status_code, data, response.headers)
+            if not retry:
+                return articles
+        return None
+
+    def search_many(self, names, per_name=5):
+        """
+        One OR-joined query per batch of company names instead of one call
+        each. Returns {name: articles} (possibly empty lists), or None if
+        NewsAPI was unavailable for every batch.
+        """
+        found, any_ok = {}, False
+        for batch in batch_queries(names, config.NEWS_BATCH_MAX_QUERY_CHARS):
+            query = " OR ".join(f'"{n}"' for n in batch)
+            articles = self.search(query, page_size=min(100, per_name * len(batch) * 2))
+            if articles is None:
+                continue
+            any_ok = True
+            found.update(match_articles(batch, articles, per_name))
+        return found if any_ok else None
+
+    def stats(self):
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return dict(counters, **self.rotation.stats())
+
+
+client = NewsClient(
+    config.NEWSAPI_KEYS,
+    mode=config.NEWS_API_MODE,
+    cooldown_seconds=config.NEWS_KEY_COOLDOWN_SECONDS,
+    pool_size=config.NEWS_HTTP_POOL_SIZE
+)
@@ -0,0 +1,300 @@
+import os
+import json
+import time
+import threading
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+import yfinance as yf
+import config
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+_EPOCH = pd.Timestamp('1970-01-01')
+# How far after the requested start a series' first bar may be and still count as covering it
+_START_SLACK_DAYS = {'1wk': 7, '1mo': 31, '3mo': 92}
+# A re-fetched settled bar whose adjusted close moved more than this was re-based upstream (split, bonus, dividend)
+_REBASE_RTOL = 1e-4
+
+
+def _to_timestamp(value):
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_localize(None)
+    return ts
+
+
+def _to_epoch(index):
+    idx = pd.DatetimeIndex(index)
+    if idx.tz is not None:
+        # Keep exchange wall-clock time, same as yfinance daily bars
+        idx = idx.tz_localize(None)
+    return ((idx - _EPOCH) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+class OHLCVStore:
+    """
+    Local per-ticker, per-interval OHLCV bar store.
+
+    Each series lives in `<root>/<interval>/<ticker>.npy` as a float64 array of
+    shape (n, 6): [epoch_seconds, Open, High, Low, Close, Volume], sorted by time
+    and read back memory-mapped. Reads only hit yfinance for what is missing:
+    a backfill for tickers never seen (or seen with a shorter history) and one
+    small tail download from the last stored bar for everything else.
+    Bars are split/dividend adjusted, so a tail download whose overlap with
+    the stored bars no longer matches means Yahoo re-based the history; the
+    series is then dropped and backfilled again.
+
+    The earliest start already backfilled is kept next to the series in
+    `<ticker>.json`, so listings younger than the requested window are not
+    backfilled again after a restart.
+    """
+
+    def __init__(self, root_dir, sync_interval_seconds=300):
+        self.root_dir = root_dir
+        self.sync_interval_seconds = sync_interval_seconds
+        self._lock = threading.Lock()
+        self._file_locks = {}
+        self._key_locks = {}  # (ticker, interval) -> lock held while deciding and fetching its bars
+        self._last_sync = {}   # (ticker, interval) -> time of last tail fetch
+        self._covered_from = {}  # (ticker, interval) -> earliest start already requested upstream
+
+    # --- FILES ---
+    def _path(self, ticker, interval):
+        safe = ticker.replace(os.sep, '_').replace('/', '_')
+        return os.path.join(self.root_dir, interval, f"{safe}.npy")
+
+    def _coverage_path(self, ticker, interval):
+        return self._path(ticker, interval)[:-len('.npy')] + '.json'
+
+    def _file_lock(self, path):
+        with self._lock:
+            if path not in self._file_locks:
+                self._file_locks[path] = threading.Lock()
+            return self._file_locks[path]
+
+    def _key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    def _get_covered_from(self, ticker, interval):
+        key = (ticker, interval)
+        if key not in self._covered_from:
+            covered_from = None
+            path = self._coverage_path(ticker, interval)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        covered_from = pd.Timestamp(json.load(f)['covered_from'])
+                except Exception as e:
+                    print(f"      [Warning] Ignoring unreadable OHLCV coverage file {path}: {e}")
+            self._covered_from[key] = covered_from
+        return self._covered_from[key]
+
+    def _set_covered_from(self, ticker, interval, start):
+        self._covered_from[(ticker, interval)] = start
+        path = self._coverage_path(ticker, interval)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"covered_from": start.isoformat()}, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"      [Warning] Could not save OHLCV coverage for {ticker}: {e}")
+
+    def _load(self, ticker, interval):
+        path = self._path(ticker, interval)
+        if not os.path.exists(path):
+            return None
+        try:
+            arr = np.load(path, mmap_mode='r')
+            return arr if arr.ndim == 2 and arr.shape[0] > 0 else None
+        except Exception as e:
+            print(f"      [Warning] Corrupt OHLCV file {path}: {e}")
+            return None
+
+    def _merge_and_save(self, ticker, interval, frame):
+        frame = frame.dropna(subset=['Close'])
+        if frame.empty:
+            return False
+        new_rows = np.column_stack([_to_epoch(frame.index)] + [
+            frame[f].to_numpy(dtype=np.float64) if f in frame.columns else np.full(len(frame), np.nan)
+            for f in FIELDS
+        ])
+
+        path = self._path(ticker, interval)
+        with self._file_lock(path):
+            existing = self._load(ticker, interval)
+            if existing is not None:
+                # Newly fetched bars replace stored ones with the same timestamp (partial last bar, corrections)
+                keep = ~np.isin(existing[:, 0], new_rows[:, 0])
+                merged = np.vstack([np.asarray(existing[keep]), new_rows])
+            else:
+                merged = new_rows
+            merged = merged[np.argsort(merged[:, 0], kind='stable')]
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, merged)
+            os.replace(tmp_path, path)
+        return True
+
+    def _drop(self, ticker, interval):
+        """Deletes a stored series and its coverage record."""
+        path = self._path(ticker, interval)
+        with self._file_lock(path):
+            for file_path in (path, self._coverage_path(ticker, interval)):
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+        self._covered_from[(ticker, interval)] = None
+
+    # --- UPSTREAM ---
+    def _download(self, tickers, start, interval, overlap=None):
+        """
+        Fetches and stores bars from `start`.
+
+        `overlap` maps ticker -> (epoch_seconds, close) of a stored settled bar
+        the download covers; tickers whose re-fetched close differs are not
+        stored but reported as re-based.
+
+        Returns:
+            (set of tickers that got bars, set of re-based tickers)
+        """
+        try:
+            data = yf.download(tickers, start=start, interval=interval, progress=False,
+                               group_by='ticker', auto_adjust=True, threads=True)
+        except Exception as e:
+            print(f"      [Warning] OHLCV download failed for {len(tickers)} tickers: {e}")
+            return set(), set()
+        if data is None or data.empty:
+            return set(), set()
+
+        stored, rebased = set(), set()
+        for ticker in tickers:
+            try:
+                if isinstance(data.columns, pd.MultiIndex):
+                    if ticker not in data.columns.get_level_values(0): continue
+                    frame = data[ticker]
+                else:
+                    frame = data
+                if overlap and ticker in overlap and self._rebased(frame, *overlap[ticker]):
+                    rebased.add(ticker)
+                elif self._merge_and_save(ticker, interval, frame):
+                    stored.add(ticker)
+            except Exception as e:
+                print(f"      [Warning] Could not store bars for {ticker}: {e}")
+        return stored, rebased
+
+    @staticmethod
+    def _rebased(frame, epoch, close):
+        frame = frame.dropna(subset=['Close'])
+        matches = np.flatnonzero(_to_epoch(frame.index) == epoch)
+        if not len(matches):
+            return False
+        return not np.isclose(frame['Close'].to_numpy(dtype=np.float64)[matches[0]], close, rtol=_REBASE_RTOL)
+
+    def sync(self, tickers, start, interval='1d'):
+        """
+        Makes sure every ticker has bars from `start` up to now, fetching only the gaps.
+
+        Each ticker's lock is held from the check to the end of its download
+        (taken in sorted order), so concurrent callers wait for one fetch
+        instead of repeating it.
+        """
+        start = _to_timestamp(start)
+        slack = pd.Timedelta(days=_START_SLACK_DAYS.get(interval, 7))
+        with ExitStack() as stack:
+            for key in sorted((ticker, interval) for ticker in set(tickers)):
+                stack.enter_context(self._key_lock(key))
+
+            now = time.time()
+            backfill = []
+            tails = {}  # tail start date -> tickers, so one stale ticker doesn't widen everyone's download
+            overlap = {}
+            for ticker in tickers:
+                key = (ticker, interval)
+                arr = self._load(ticker, interval)
+                covered_from = self._get_covered_from(ticker, interval)
+                has_start = arr is not None and (
+                    _EPOCH + pd.Timedelta(seconds=float(arr[0, 0])) <= start + slack
+                    or (covered_from is not None and covered_from <= start)
+                )
+
+                if not has_start:
+                    backfill.append(ticker)
+                elif now - self._last_sync.get(key, 0) > self.sync_interval_seconds:
+                    # Re-fetch from the last settled bar: the newest may have been a partial (in-session)
+                    # bar, and the settled one shows whether the adjusted history was re-based since
+                    settled = arr[-2] if len(arr) > 1 else None
+                    tail_from = _EPOCH + pd.Timedelta(seconds=float(arr[-2 if len(arr) > 1 else -1, 0]))
+                    tails.setdefault(tail_from.date(), []).append(ticker)
+                    if settled is not None:
+                        overlap[ticker] = (float(settled[0]), float(settled[4]))
+
+            if backfill:
+                self._backfill(backfill, start, interval, now)
+
+            rebackfill = {}
+            for tail_from, group in sorted(tails.items()):
+                _, rebased = self._download(group, tail_from, interval, overlap)
+                for ticker in group:
+                    self._last_sync[(ticker, interval)] = now
+                for ticker in rebased:
+                    covered_from = self._get_covered_from(ticker, interval) or start
+                    self._drop(ticker, interval)
+                    rebackfill.setdefault(min(covered_from, start), []).append(ticker)
+
+            for backfill_from, group in rebackfill.items():
+                print(f"      [OHLCV] Adjusted history changed for {len(group)} tickers ({interval}), re-downloading...")
+                self._backfill(group, backfill_from, interval, now)
+
+    def _backfill(self, tickers, start, interval, now):
+        print(f"      [OHLCV] Backfilling {len(tickers)} tickers ({interval}) from {start.date()}...")
+        stored, _ = self._download(tickers, start.date(), interval)
+        for ticker in tickers:
+            # Tickers that came back empty (failed download, unknown symbol) are retried next time
+            if ticker in stored:
+                self._set_covered_from(ticker, interval, start)
+                self._last_sync[(ticker, interval)] = now
+
+    # --- READS ---
+    def get_history(self, tickers, start, end=None, interval='1d'):
+        """
+        Returns {ticker: DataFrame[Open, High, Low, Close, Volume]} for bars with
+        start <= time < end (end is exclusive, like yf.download). Tickers with no
+        data are omitted.
+        """
+        if isinstance(tickers, str):
+            tickers = [tickers]
+        tickers = list(dict.fromkeys(tickers))
+        self.sync(tickers, start, interval)
+
+        lo = (_to_timestamp(start) - _EPOCH).total_seconds()
+        hi = (_to_timestamp(end) - _EPOCH).total_seconds() if end is not None else np.inf
+
+        frames = {}
+        for ticker in tickers:
+            arr = self._load(ticker, interval)
+            if arr is None: continue
+            i, j = np.searchsorted(arr[:, 0], [lo, hi], side='left')
+            if j <= i: continue
+            rows = np.asarray(arr[i:j])
+            index = pd.DatetimeIndex(_EPOCH + pd.to_timedelta(rows[:, 0], unit='s'))
+            frames[ticker] = pd.DataFrame(rows[:, 1:], index=index, columns=FIELDS)
+        return frames
+
+    def get_panel(self, tickers, start, end=None, interval='1d', field='Close'):
+        """
+        Returns a dates x tickers DataFrame of one field, aligned on the union of dates.
+        """
+        frames = self.get_history(tickers, start, end, interval)
+        if not frames:
+            return pd.DataFrame()
+        return pd.DataFrame({t: f[field] for t, f in frames.items()}).sort_index()
+
+
+store = OHLCVStore(config.OHLCV_STORE_DIR, sync_interval_seconds=config.OHLCV_SYNC_SECONDS)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+import ohlcv_store
+from ohlcv_store import FIELDS, OHLCVStore
+
+
+class FakeDownload:
+    """Stands in for yf.download: serves `closes[ticker]` (a daily Series) from `start` on."""
+
+    def __init__(self, closes):
+        self.closes = closes
+        self.calls = []
+
+    def __call__(self, tickers, start, **kwargs):
+        self.calls.append((tuple(tickers), pd.Timestamp(start)))
+        frames = {}
+        for ticker in tickers:
+            close = self.closes[ticker]
+            close = close[close.index >= pd.Timestamp(start)]
+            frames[ticker] = pd.DataFrame({f: close if f != 'Volume' else 1000.0 for f in FIELDS})
+        return pd.concat(frames, axis=1)
+
+
+def make_store(tmp_path, monkeypatch, closes):
+    fake = FakeDownload(closes)
+    monkeypatch.setattr(ohlcv_store.yf, 'download', fake)
+    return OHLCVStore(str(tmp_path), sync_interval_seconds=0), fake
+
+
+def test_tail_sync_rebuilds_a_rebased_history(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2026-01-01', periods=60)
+    closes = {'ABC.NS': pd.Series(np.linspace(200, 260, 60), index=dates)}
+    store, fake = make_store(tmp_path, monkeypatch, closes)
+    store.sync(['ABC.NS'], dates[0])
+
+    # A 2:1 split: upstream halves the whole adjusted history and adds new bars
+    new_dates = pd.bdate_range('2026-01-01', periods=63)
+    closes['ABC.NS'] = pd.Series(np.linspace(200, 266, 63) / 2, index=new_dates)
+    frames = store.get_history(['ABC.NS'], dates[0])
+
+    stored = frames['ABC.NS']['Close']
+    assert len(stored) == 63
+    np.testing.assert_allclose(stored.to_numpy(), closes['ABC.NS'].to_numpy())
+    assert fake.calls[-1][1] == dates[0]  # Re-backfilled from the covered start
+
+
+def test_tail_sync_appends_when_history_is_unchanged(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2026-01-01', periods=63)
+    closes = {'ABC.NS': pd.Series(np.linspace(200, 266, 63), index=dates)}
+    full = closes['ABC.NS']
+    closes['ABC.NS'] = full[:60]
+    store, fake = make_store(tmp_path, monkeypatch, closes)
+    store.sync(['ABC.NS'], dates[0])
+
+    closes['ABC.NS'] = full
+    frames = store.get_history(['ABC.NS'], dates[0])
+    assert len(frames['ABC.NS']) == 63
+    assert fake.calls[-1][1] == dates[58]  # Only the tail, from the last settled bar
+
+
+def test_stale_ticker_does_not_widen_other_tail_downloads(tmp_path, monkeypatch):
+    dates = pd.bdate_range('2026-01-01', periods=60)
+    closes = {'OLD.NS': pd.Series(np.linspace(100, 160, 60), index=dates),
+              'NEW.NS': pd.Series(np.linspace(100, 160, 60), index=dates)}
+    store, fake = make_store(tmp_path, monkeypatch, closes)
+    store.sync(['OLD.NS', 'NEW.NS'], dates[0])
+    closes['OLD.NS'] = closes['OLD.NS'][:30]
+    store._drop('OLD.NS', '1d')
+    store.sync(['OLD.NS'], dates[0])
+    closes['OLD.NS'] = closes['NEW.NS']
+
+    fake.calls.clear()
+    store.sync(['OLD.NS', 'NEW.NS'], dates[0])
+    assert sorted(fake.calls) == [(('NEW.NS',), dates[58]), (('OLD.NS',), dates[28])]
@@ -0,0 +1,53 @@
+from ticker_resolver import TickerResolver
+
+
+def make_resolver(complete=False):
+    resolver = TickerResolver()
+    resolver.add_many([
+        ('RELIANCE.NS', 'Reliance Industries', None),
+        ('BAJAJHLDNG.NS', 'Bajaj Holdings & Investment', None),
+        ('TATACONSUM.NS', 'Tata Consumer Products', None),
+        ('ONGC.NS', 'Oil and Natural Gas Corporation', None),
+        ('INFY.NS', 'Infosys', None),
+    ], complete=complete)
+    return resolver
+
+
+def test_known_symbols_and_names():
+    resolver = make_resolver()
+    assert resolver.resolve('reliance') == 'RELIANCE.NS'
+    assert resolver.resolve('Reliance Industries Ltd') == 'RELIANCE.NS'
+    assert resolver.resolve('infosys') == 'INFY.NS'
+    assert resolver.resolve('infy.ns') == 'INFY.NS'
+
+
+def test_unknown_plain_symbols_pass_through_until_complete():
+    resolver = make_resolver()
+    assert resolver.resolve('BAJAJHFL') == 'BAJAJHFL.NS'
+    assert resolver.resolve('TATACOMM') == 'TATACOMM.NS'
+    assert resolver.resolve('OIL') == 'OIL.NS'
+    assert resolver.resolve('RELAINCE') == 'RELAINCE.NS'
+    assert resolver.resolve('XYZ.BO') == 'XYZ.BO'
+
+
+def test_prefix_and_fuzzy_hits_only_suggested_for_plain_symbols():
+    resolver = make_resolver()
+    assert 'BAJAJHLDNG.NS' in resolver.suggest('BAJAJHFL')
+    assert 'TATACONSUM.NS' in resolver.suggest('TATACOMM')
+    assert 'ONGC.NS' in resolver.suggest('OIL')
+
+
+def test_no_prefix_completion_of_bare_symbols_when_complete():
+    resolver = make_resolver(complete=True)
+    assert resolver.resolve('BAJAJ') is None
+    assert resolver.resolve('TATACONS') is None
+    assert resolver.resolve('OIL') is None
+    assert resolver.resolve('RELAINCE') == 'RELIANCE.NS'
+
+
+def test_names_are_completed_and_corrected():
+    for complete in (False, True):
+        resolver = make_resolver(complete)
+        assert resolver.resolve('Tata Consumer') == 'TATACONSUM.NS'
+        assert resolver.resolve('Relaince Industries') == 'RELIANCE.NS'
+        assert resolver.resolve('Some Random Words') is None
@@ -0,0 +1,77 @@
+import os
+import tempfile
+
+import config
+
+# Importing db_helper opens the LOCAL store; keep it out of Backend/database
+_tmp = tempfile.mkdtemp()
+config.LOCAL_SQLITE_FILE = os.path.join(_tmp, 'local_database.db')
+config.LOCAL_DB_FILE = os.path.join(_tmp, 'local_database.json')
+
+from db_helper import WriteBehindQueue  # noqa: E402
+
+
+class FlakyCommit:
+    """commit_fn that fails while `down`, and always for payloads marked poison."""
+
+    def __init__(self):
+        self.down = False
+        self.committed = []
+
+    def __call__(self, ops, tokens):
+        if self.down or any(p.get('poison') for _, _, p in ops):
+            raise RuntimeError("commit failed")
+        self.committed += ops
+        self.committed += [('tokens', uid, counts) for uid, counts in tokens.items()]
+
+
+def make_queue(commit):
+    queue = WriteBehindQueue(commit, interval=3600, max_ops=10 ** 6, max_attempts=2, max_backoff_seconds=0)
+    queue._retry_at = 0.0
+    return queue
+
+
+def flush_until_failures(queue, attempts):
+    for _ in range(attempts):
+        queue._retry_at = 0.0
+        queue.flush()
+
+
+def test_single_write_survives_an_outage():
+    commit = FlakyCommit()
+    queue = make_queue(commit)
+    commit.down = True
+    queue.enqueue('message', 'u1', {'text': 'hi'})
+    flush_until_failures(queue, 5)
+    assert not queue.dead_letters
+    assert queue.has_pending('u1')
+
+    commit.down = False
+    queue._retry_at = 0.0
+    assert queue.flush()
+    assert commit.committed == [('message', 'u1', {'text': 'hi'})]
+
+
+def test_single_token_update_survives_an_outage():
+    commit = FlakyCommit()
+    queue = make_queue(commit)
+    commit.down = True
+    queue.add_tokens('u1', 10, 5)
+    flush_until_failures(queue, 5)
+    assert not queue.dead_letters
+
+    commit.down = False
+    queue._retry_at = 0.0
+    assert queue.flush()
+    assert commit.committed == [('tokens', 'u1', [10, 5])]
+
+
+def test_poison_write_is_dead_lettered_once_others_go_through():
+    commit = FlakyCommit()
+    queue = make_queue(commit)
+    queue.enqueue('message', 'u1', {'text': 'bad', 'poison': True})
+    queue.enqueue('message', 'u2', {'text': 'ok'})
+    flush_until_failures(queue, 5)
+    assert [d[:2] for d in queue.dead_letters] == [('message', 'u1')]
+    assert commit.committed == [('message', 'u2', {'text': 'ok'})]
+    assert not queue.has_pending('u1')
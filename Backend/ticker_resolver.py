@@ -0,0 +1,201 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import Counter
+import config
+import indices
+
+# Offline ticker resolution for normalize_ticker.
+# Every known listing (symbol, company name, NSE/BSE flags) is indexed once in
+# a sorted key array (prefix search by bisection) and a trigram index, so
+# symbols, names, prefixes and typos resolve without touching the network.
+# Until a complete symbol universe is registered (the instrument master),
+# unknown symbols pass through as <SYMBOL>.NS like before; afterwards they are
+# rejected unless a confident correction exists.
+
+_SUFFIXES = {'.NS': 'NSE', '.BO': 'BSE'}
+_NAME_NOISE = re.compile(r'\b(LTD|LIMITED|INC|CORP|CORPORATION|CO|THE)\b\.?')
+_NON_KEY = re.compile(r'[^A-Z0-9&\- ]+')
+_PLAIN_SYMBOL = re.compile(r'[A-Z0-9&\-]{1,20}')  # Looks like an exchange symbol rather than a name
+
+
+def _key(text):
+    text = _NAME_NOISE.sub(' ', _NON_KEY.sub(' ', text.upper()))
+    return ' '.join(text.split())
+
+
+def _grams(key, n=3):
+    padded = f" {key} "
+    return {padded[i:i + n] for i in range(max(1, len(padded) - n + 1))}
+
+
+def split_suffix(ticker):
+    """Returns (bare symbol, exchange or None) for 'SYMBOL.NS' / 'SYMBOL.BO' / 'SYMBOL'."""
+    ticker = ticker.strip().upper()
+    for suffix, exchange in _SUFFIXES.items():
+        if ticker.endswith(suffix):
+            return ticker[:-len(suffix)], exchange
+    return ticker, None
+
+
+class TickerResolver:
+    def __init__(self, prefix_hits=8, fuzzy_threshold=0.5, fuzzy_margin=0.1):
+        self.prefix_hits = prefix_hits
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_margin = fuzzy_margin
+        self.complete = False  # True once a full instrument list has been registered
+        self._lock = threading.Lock()
+        self._listings = {}  # bare symbol -> {"name": str, "exchanges": set}
+        self._exact = {}  # symbol/name key -> bare symbol
+        self._sorted_keys = []  # every key, sorted, for prefix search
+        self._unsorted_keys = []  # keys added since the last sort
+        self._keys = []  # key id -> (key, symbol, gram count)
+        self._gram_index = {}  # trigram -> [key ids]
+
+    def add(self, ticker, name=None, exchanges=None):
+        """Registers a listing; `exchanges` defaults to the ticker's suffix (NSE if none)."""
+        symbol, suffix_exchange = split_suffix(ticker)
+        if not symbol:
+            return
+        exchanges = set(exchanges or [suffix_exchange or 'NSE'])
+        with self._lock:
+            listing = self._listings.get(symbol)
+            if listing is None:
+                listing = self._listings[symbol] = {"name": None, "exchanges": set()}
+                self._index(symbol, symbol)
+            listing["exchanges"] |= exchanges
+            if name and not listing["name"]:
+                listing["name"] = name
+                self._index(_key(name), symbol)
+
+    def add_many(self, rows, complete=False):
+        """Registers (ticker, name, exchanges) rows, e.g. from the instrument master."""
+        for ticker, name, exchanges in rows:
+            self.add(ticker, name, exchanges)
+        if complete:
+            self.complete = True
+
+    def _index(self, key, symbol):
+        if not key or key in self._exact:
+            return
+        self._exact[key] = symbol
+        self._unsorted_keys.append(key)
+
+        grams = _grams(key)
+        key_id = len(self._keys)
+        self._keys.append((key, symbol, len(grams)))
+        for gram in grams:
+            self._gram_index.setdefault(gram, []).append(key_id)
+
+    def listing(self, ticker):
+        """Returns {"name", "exchanges"} for a known symbol, else None."""
+        listing = self._listings.get(split_suffix(ticker)[0])
+        return {"name": listing["name"], "exchanges": set(listing["exchanges"])} if listing else None
+
+    def _prefix(self, key):
+        """Up to prefix_hits distinct symbols with a key starting with `key`, in key order."""
+        if self._unsorted_keys:
+            # Bulk registrations are sorted once, on the first lookup after them
+            with self._lock:
+                if self._unsorted_keys:
+                    self._sorted_keys = sorted(self._sorted_keys + self._unsorted_keys)
+                    self._unsorted_keys = []
+        keys, symbols = self._sorted_keys, []
+        for i in range(bisect_left(keys, key), len(keys)):
+            if not keys[i].startswith(key) or len(symbols) >= self.prefix_hits:
+                break
+            symbol = self._exact[keys[i]]
+            if symbol not in symbols:
+                symbols.append(symbol)
+        return symbols
+
+    def _fuzzy(self, key, limit=5):
+        grams = _grams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._gram_index.get(gram, ()))
+        best = {}
+        for key_id, count in shared.items():
+            _, symbol, gram_count = self._keys[key_id]
+            score = 2 * count / (len(grams) + gram_count)
+            if score > best.get(symbol, 0):
+                best[symbol] = score
+        return sorted(best.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+
+    def _with_exchange(self, symbol, preferred=None):
+        exchanges = self._listings[symbol]["exchanges"]
+        # An explicit suffix is only corrected once the listings are known to be complete
+        if preferred in exchanges or (preferred and not self.complete) or not exchanges:
+            exchange = preferred or 'NSE'
+        else:
+            exchange = 'NSE' if 'NSE' in exchanges else 'BSE'
+        return symbol + ('.BO' if exchange == 'BSE' else '.NS')
+
+    def _confident_fuzzy(self, key):
+        matches = self._fuzzy(key, limit=2) if len(key) >= 3 else []
+        if matches and matches[0][1] >= self.fuzzy_threshold and (
+                len(matches) == 1 or matches[0][1] - matches[1][1] >= self.fuzzy_margin):
+            return matches[0][0]
+        return None
+
+    def resolve(self, query):
+        """
+        Maps a symbol or company name to a Yahoo ticker (.NS, or .BO for
+        BSE-only listings). Returns None for ambiguous or unknown input.
+
+        Plain symbols are never completed by prefix (BAJAJHFL is not
+        BAJAJHLDNG) and, until the universe is complete, never corrected
+        either: an unknown one may simply be missing from our lists, so it
+        passes through as <SYMBOL>.NS and candidates are left to suggest().
+        """
+        symbol, exchange = split_suffix(query)
+        if not symbol:
+            return None
+        if symbol in self._listings:
+            return self._with_exchange(symbol, exchange)
+
+        key = _key(symbol)
+        if key in self._exact:
+            return self._with_exchange(self._exact[key], exchange)
+
+        if _PLAIN_SYMBOL.fullmatch(symbol):
+            if not self.complete:
+                return f"{symbol}{'.BO' if exchange == 'BSE' else '.NS'}"
+            # Typo corrections only: a longer symbol starting with the input would be a prefix completion
+            match = self._confident_fuzzy(key)
+            if match and abs(len(match) - len(symbol)) <= 2 and not match.startswith(symbol):
+                return self._with_exchange(match, exchange)
+            return None
+
+        # Company names: unique prefix, then a confident typo correction
+        # (too short a key is not completed, e.g. 'AB' is not ABB)
+        prefix_hits = self._prefix(key) if len(key) >= 3 else []
+        if len(prefix_hits) == 1:
+            return self._with_exchange(prefix_hits[0], exchange)
+        match = self._confident_fuzzy(key) if not prefix_hits else None
+        return self._with_exchange(match, exchange) if match else None
+
+    def suggest(self, query, limit=5):
+        """Candidate tickers for an unresolved query (prefix hits first, then fuzzy matches)."""
+        key = _key(split_suffix(query)[0])
+        if not key:
+            return []
+        symbols = self._prefix(key)
+        symbols += [s for s, _ in self._fuzzy(key, limit) if s not in symbols]
+        return [self._with_exchange(s) for s in symbols[:limit]]
+
+    def stats(self):
+        return {"listings": len(self._listings), "keys": len(self._keys), "complete": self.complete}
+
+
+def _build_default():
+    resolver = TickerResolver(fuzzy_threshold=config.TICKER_FUZZY_THRESHOLD)
+    for ticker, name in indices.COMPANY_NAMES.items():
+        resolver.add(ticker, name)
+    for tickers in indices.STATIC_INDICES.values():
+        for ticker in tickers:
+            resolver.add(ticker)
+    return resolver
+
+
+resolver = _build_default()
@@ -7,6 +7,7 @@ import google.generativeai as genai
 import yfinance as yf
 import requests
 import json
+import hashlib
 from urllib.parse import quote_plus
 from concurrent.futures import ThreadPoolExecutor
 import concurrent.futures
@@ -16,10 +17,20 @@ from ta.momentum import RSIIndicator, StochasticOscillator
 from ta.trend import EMAIndicator, MACD, SMAIndicator, ADXIndicator
 from ta.volatility import BollingerBands
 import pandas as pd
+import numpy as np
 import traceback
 from typing import Optional, List
 import indices
 import db_helper
+import cache_helper
+import indicator_engine
+import market_hours
+import news_client
+import constituents
+import ticker_resolver
+import instruments
+from market_refresher import HotTickerTracker, BackgroundRefresher, SessionJob
+from ohlcv_store import store as ohlcv
 import logging
 
 # Initialize DB Manager
@@ -28,57 +39,161 @@ db = db_helper.DBManager()
 # Initialize Gemini
 genai.configure(api_key=config.GENIE_API_KEY)
 
-# Simple in-memory cache
-_cache = {}
+# Cache backend: in-process LRU by default, or a tier shared between workers (see config.CACHE_BACKEND),
+# with a persistent on-disk L2 behind it so a restart does not start cold
+_cache = cache_helper.create_cache(
+    config.CACHE_BACKEND,
+    max_entries=config.CACHE_MAX_ENTRIES,
+    max_bytes=config.CACHE_MAX_BYTES,
+    stripes=config.CACHE_LOCK_STRIPES,
+    shm_path=config.CACHE_SHM_PATH,
+    redis_url=config.CACHE_REDIS_URL,
+    key_prefix=config.CACHE_KEY_PREFIX,
+    persistent_path=config.CACHE_PERSISTENT_FILE if config.CACHE_PERSISTENT else None,
+    persistent_max_bytes=config.CACHE_PERSISTENT_MAX_BYTES
+)
 CACHE_TTL_SECONDS = config.CACHE_TTL_SECONDS
 
+# Slow tier: company fundamentals change daily at most, so they live on disk
+# with a long TTL and survive restarts; prices come from the fast `quote_*` tier.
+_funda_cache = cache_helper.SharedMemoryCache(
+    config.CACHE_FUNDAMENTALS_FILE,
+    max_entries=config.CACHE_FUNDAMENTALS_MAX_ENTRIES,
+    durable=True
+)
+
 # Cache setter and getter
 def set_cache(key, value, ttl_seconds=CACHE_TTL_SECONDS):
     if not config.CACHE_STORE:
         return
-    _cache[key] = (value, time.time() + ttl_seconds)
-    pass
+    _cache.set(key, value, ttl_seconds)
 
 def get_cache(key):
     if not config.CACHE_STORE:
         return None
-    if key in _cache:
-        value, expiry_time = _cache[key]
-        if time.time() < expiry_time:
-            # print(f"      CACHE HIT for {key}")
-            return value
-        else:
-            del _cache[key]
-    return None
+    return _cache.get(key)
+
+def get_cache_entry(key):
+    """Returns (value, expires_at) or (None, None)."""
+    if not config.CACHE_STORE:
+        return None, None
+    return _cache.get_entry(key)
+
+# Stale-while-revalidate entries: fresh for `ttl_seconds`, then served stale
+# for CACHE_STALE_GRACE_SECONDS more while a background refresh replaces them.
+def set_cache_swr(key, value, ttl_seconds):
+    set_cache(key, value, ttl_seconds=ttl_seconds + config.CACHE_STALE_GRACE_SECONDS)
+
+def get_cache_swr(key):
+    """Returns (value, is_fresh) for an entry stored with set_cache_swr."""
+    value, expires_at = get_cache_entry(key)
+    if value is None:
+        return None, False
+    return value, expires_at - time.time() > config.CACHE_STALE_GRACE_SECONDS
+
+def get_cache_stats():
+    stats = _cache.stats()
+    stats['fundamentals'] = _funda_cache.stats()
+    stats['single_flight'] = _inflight.stats()
+    stats['indicator_states'] = _indicator_states.stats()
+    stats['refresher'] = _refresher.stats()
+    stats['screen_snapshots'] = _screen_snapshots.stats()
+    stats['news_api'] = news_client.client.stats()
+    stats['constituents'] = _constituents.stats()
+    stats['ticker_resolver'] = ticker_resolver.resolver.stats()
+    stats['instruments'] = _instruments.stats()
+    stats['user_state'] = db.state_cache_stats() if db else None
+    return stats
+
+# Concurrent misses for the same key share one upstream fetch
+_inflight = cache_helper.SingleFlight()
+
+# Running indicator state per (ticker, period, interval) for technical ratings
+_indicator_states = indicator_engine.IndicatorStates(max_states=config.INDICATOR_STATE_MAX_ENTRIES)
+
+# Tickers users are looking at get their quotes (and computed ratings)
+# refreshed in bulk before they expire, during NSE market hours only.
+_hot_tickers = HotTickerTracker(idle_seconds=config.HOT_TICKER_IDLE_SECONDS, max_tickers=config.HOT_TICKER_MAX)
+_refresher = BackgroundRefresher(
+    lambda tickers: _refresh_hot_tickers(tickers),
+    _hot_tickers,
+    interval_seconds=config.REFRESH_INTERVAL_SECONDS,
+    is_active=market_hours.is_market_open,
+    workers=config.REFRESH_WORKERS
+)
+if config.BACKGROUND_REFRESH:
+    _refresher.start()
+
+# Index constituents: static lists merged with persisted live resolutions,
+# re-resolved from the NSE API on a slow schedule.
+_constituents = constituents.ConstituentsRegistry(
+    config.CONSTITUENTS_FILE,
+    indices.STATIC_INDICES,
+    max_age_seconds=config.CONSTITUENTS_MAX_AGE_SECONDS
+)
+if config.CONSTITUENTS_BACKGROUND_REFRESH:
+    _constituents.start_background_refresh(
+        lambda name: _constituents_from_nse(name),
+        check_interval_seconds=config.CONSTITUENTS_REFRESH_CHECK_SECONDS
+    )
+
+# After each close, the screener tables of the static indices are rebuilt so
+# screening requests only slice them and overlay live news.
+_screen_snapshots = SessionJob(
+    lambda session: build_screen_snapshots(session),
+    market_hours.last_closed_session,
+    check_interval_seconds=config.SCREEN_SNAPSHOT_CHECK_SECONDS,
+    initial_delay_seconds=60,  # let the server come up first
+    name="screen-snapshots"
+)
+if config.SCREEN_SNAPSHOTS:
+    _screen_snapshots.start()
 
 # Initialize Zerodha Kite Connect
 def get_kite_instance():
    return KiteConnect(api_key=config.ZERODHA_API_KEY)
 
+# Kite instrument master: token/symbol/ISIN -> Yahoo ticker lookups for the
+# portfolio sync, and the complete NSE/BSE listing set for the ticker resolver.
+_instruments = instruments.InstrumentMaster(config.INSTRUMENTS_FILE, max_age_seconds=config.INSTRUMENTS_MAX_AGE_SECONDS)
+
+def _fetch_instruments(kite=None):
+    kite = kite or get_kite_instance()
+    return [item for exchange in instruments.EXCHANGES for item in kite.instruments(exchange)]
+
+def _register_instruments():
+    if _instruments.stats()['instruments']:
+        ticker_resolver.resolver.add_many(_instruments.resolver_rows(), complete=True)
+
+def _zerodha_configured():
+    # The shipped config holds placeholders; kite.instruments() would fail every check with them
+    return bool(config.ZERODHA_API_KEY) and not config.ZERODHA_API_KEY.startswith("YOUR_")
+
+_register_instruments()
+if config.INSTRUMENTS_BACKGROUND_REFRESH and _zerodha_configured():
+    _instruments.start_background_refresh(
+        _fetch_instruments,
+        on_refresh=_register_instruments,
+        check_interval_seconds=config.INSTRUMENTS_REFRESH_CHECK_SECONDS
+    )
+
 # Ticker Normalization
 def normalize_ticker(ticker: str) -> Optional[str]:
+    """
+    Resolves a symbol or company name to a Yahoo ticker offline via the ticker
+    resolver (exact, prefix, then fuzzy match). Returns None when the input is
+    ambiguous or unknown.
+    """
     if not ticker:
         return None
     
     ticker = ticker.strip().upper()
     
-    # If already has exchange suffix, return as-is
-    if ticker.endswith('.NS') or ticker.endswith('.BO'):
-        # print(f"      Ticker {ticker} already has exchange suffix")
+    # Non-Indian listings pass through untouched
+    if any(ticker.endswith(suffix) for suffix in ['.US', '.L', '.TO', '.AX']):
         return ticker
     
-    # Check Nifty 50 mapping
-    if ticker in indices.NAME_TO_SYMBOL:
-        normalized = indices.NAME_TO_SYMBOL[ticker]
-        # print(f"      Mapped {ticker} -> {normalized} via N50")
-        return normalized
-    if not any(ticker.endswith(suffix) for suffix in ['.US', '.L', '.TO', '.AX']):
-        normalized = f"{ticker}.NS"
-        # print(f"      Assumed Indian stock: {ticker} -> {normalized}")
-        return normalized
-    
-    # print(f"      Could not normalize '{ticker}' via N50 maps. Assuming direct ticker.")
-    return ticker
+    return ticker_resolver.resolver.resolve(ticker)
 
 # Investment Simulation
 def simulate_investment(ticker: str, amount: float, duration_years: int, mode: str = 'lumpsum'):
@@ -93,10 +208,10 @@ def simulate_investment(ticker: str, amount: float, duration_years: int, mode: s
         end_date = datetime.now()
         start_date = end_date - timedelta(days=duration_years * 365)
         
-        # Fetch History
-        data = yf.download(norm_ticker, start=start_date, end=end_date, interval="1mo", progress=False)
+        # Fetch History (local bar store, only the missing tail goes upstream)
+        data = ohlcv.get_history(norm_ticker, start=start_date, end=end_date, interval="1mo").get(norm_ticker)
         
-        if data.empty: return {"error": "No historical data found"}
+        if data is None or data.empty: return {"error": "No historical data found"}
         
         data = data['Close']
         
@@ -355,7 +470,7 @@ def project_portfolio_performance(user_id: str, direction: str = 'future', durat
             prices = get_bulk_live_prices(tickers)
             
             with ThreadPoolExecutor() as executor:
-                future_infos = {executor.submit(get_ticker_info, t): t for t in tickers}
+                future_infos = {executor.submit(get_fundamentals, t): t for t in tickers}
                 
                 for future in concurrent.futures.as_completed(future_infos):
                     t = future_infos[future]
@@ -387,17 +502,14 @@ def project_portfolio_performance(user_id: str, direction: str = 'future', durat
             # Backtest
             end_date = date.today()
             start_date = end_date - timedelta(days=int(duration_months * 30))
-            data = yf.download(tickers, start=start_date, end=end_date, progress=False)['Close']
+            data = ohlcv.get_panel(tickers, start=start_date, end=end_date, field='Close')
             
             if data.empty: return {"error": "Historical data unavailable"}
 
             for t in tickers:
                 qty = holdings[t]['quantity']
-                if len(tickers) > 1:
-                    if t not in data.columns: continue
-                    hist_series = data[t].dropna()
-                else:
-                    hist_series = data.dropna()
+                if t not in data.columns: continue
+                hist_series = data[t].dropna()
                 
                 if hist_series.empty: continue
                 
@@ -523,34 +635,89 @@ def _get_compact_ticker_info(ticker_str: str) -> Optional[dict]:
         return None
 
 def get_ticker_info(ticker_str: str):
+    """Compact ticker info: cached fundamentals with the price fields taken from the latest quote."""
     if not isinstance(ticker_str, str): 
         return None
     
-    cache_key = f"info_{ticker_str}"
-    cached_info = get_cache(cache_key)
+    _hot_tickers.touch(ticker_str)
+    funda = get_fundamentals(ticker_str)
+    if not funda:
+        return None
     
-    if cached_info: 
-        return cached_info
+    quote = _get_quote(ticker_str)
+    if not quote:
+        # Last resort: the price fields captured with the fundamentals
+        return funda
+    return dict(funda, currentPrice=quote['price'], previousClose=quote['previous_close'] or quote['price'],
+                dayLow=quote['day_low'], dayHigh=quote['day_high'])
+
+def get_fundamentals(ticker_str: str):
+    cache_key = f"funda_{ticker_str}"
+    funda = _funda_cache.get(cache_key) if config.CACHE_STORE else None
+    if funda:
+        return funda
     
+    return _inflight.do(cache_key, _fetch_fundamentals, ticker_str, cache_key)
+
+def _fetch_fundamentals(ticker_str: str, cache_key: str):
+    # Another caller may have filled the cache while we waited to lead
+    if config.CACHE_STORE:
+        funda = _funda_cache.get(cache_key)
+        if funda:
+            return funda
+
     try:
         compact_info = _get_compact_ticker_info(ticker_str)
         
         if not compact_info:
             return None
-            
-        set_cache(cache_key, compact_info, ttl_seconds=config.CACHE_PRICE_DATA_SECONDS)
+        
+        if config.CACHE_STORE:
+            _funda_cache.set(cache_key, compact_info, market_hours.ttl_for('fundamentals'))
+        # The same payload carries a quote; use it to seed the fast tier
+        quote = _quote_from_info(compact_info)
+        if quote and get_cache(f"quote_{ticker_str}") is None:
+            set_cache_swr(f"quote_{ticker_str}", quote, ttl_seconds=market_hours.ttl_for('price'))
         return compact_info
         
     except Exception as e: 
         print(f"     [Error] yfinance info exception for {ticker_str}: {e}")
         return None
 
+def _get_quote(ticker_str: str):
+    cache_key = f"quote_{ticker_str}"
+    quote, fresh = get_cache_swr(cache_key)
+    if quote is not None:
+        if not fresh:
+            _refresher.revalidate(("quotes", ticker_str), _refresh_quotes, [ticker_str])
+        return quote
+    
+    return _inflight.do(cache_key, _fetch_quote, ticker_str, cache_key)
+
+def _fetch_quote(ticker_str: str, cache_key: str):
+    quote, fresh = get_cache_swr(cache_key)
+    if quote is not None and fresh:
+        return quote
+    
+    quote = _download_quotes([ticker_str]).get(ticker_str)
+    if quote:
+        set_cache_swr(cache_key, quote, ttl_seconds=market_hours.ttl_for('price'))
+    return quote
+
 def get_technical_rating(ticker: str, timeframe: str = '1D') -> str:
     cache_key = f"tech_rating_{ticker}_{timeframe}"
     cached_rating = get_cache(cache_key)
     if cached_rating:
         return cached_rating
-    
+
+    return _inflight.do(cache_key, _compute_technical_rating, ticker, timeframe, cache_key)
+
+def _compute_technical_rating(ticker: str, timeframe: str, cache_key: str, refresh: bool = False) -> str:
+    if not refresh:
+        cached_rating = get_cache(cache_key)
+        if cached_rating:
+            return cached_rating
+
     try:
         norm_ticker = normalize_ticker(ticker)
         if not norm_ticker:
@@ -574,33 +741,37 @@ def get_technical_rating(ticker: str, timeframe: str = '1D') -> str:
         params = timeframe_map.get(timeframe, timeframe_map['1d'])
         
         stock = yf.Ticker(norm_ticker)
-        hist = stock.history(period=params['period'], interval=params['interval'])
-        
-        if hist.empty or 'Close' not in hist.columns or 'Volume' not in hist.columns:
-            return "N/A"
-        
-        close_prices = hist['Close'].dropna()
-        volumes = hist['Volume'].dropna()
-        
-        if len(close_prices) < 50:
+        state_key = (norm_ticker, params['period'], params['interval'])
+        state = _indicator_states.get(state_key)
+
+        with state.lock:
+            readings = None
+            if state.ready:
+                # Only fetch bars since the last committed one and advance the running state
+                delta = stock.history(start=state.last_ts.date(), interval=params['interval'])
+                if not delta.empty and 'Close' in delta.columns:
+                    readings = state.advance(delta)
+
+            if readings is None:
+                # First build, or the stored history no longer lines up (corrections/adjustments)
+                hist = stock.history(period=params['period'], interval=params['interval'])
+                
+                if hist.empty or 'Close' not in hist.columns or 'Volume' not in hist.columns:
+                    return "N/A"
+                readings = state.rebuild(hist)
+                # A single bar is never committed (it may still be forming), so there is nothing to keep
+                if not state.ready: _indicator_states.discard(state_key)
+
+        if readings['bars'] < 50:
             return "N/A"
 
-        rsi_indicator = RSIIndicator(close_prices, window=14)
-        current_rsi = rsi_indicator.rsi().iloc[-1]
-        
-        macd_indicator = MACD(close_prices, window_slow=26, window_fast=12, window_sign=9)
-        macd_diff = macd_indicator.macd_diff().iloc[-1] 
-        
-        bb_indicator = BollingerBands(close_prices, window=20, window_dev=2)
-        current_price = close_prices.iloc[-1]
-        bb_upper = bb_indicator.bollinger_hband().iloc[-1]
-        bb_lower = bb_indicator.bollinger_lband().iloc[-1]
+        current_rsi = readings['rsi']
+        macd_diff = readings['macd_diff']
+        current_price = readings['price']
+        bb_upper, bb_lower = readings['bb_upper'], readings['bb_lower']
         bb_position = (current_price - bb_lower) / (bb_upper - bb_lower) if (bb_upper - bb_lower) > 0 else 0.5
-        avg_volume_50 = volumes.iloc[-50:].mean()
-        current_volume = volumes.iloc[-1]
-        volume_spike = current_volume / avg_volume_50 if avg_volume_50 > 0 else 1.0
-        
-        price_momentum = ((close_prices.iloc[-1] - close_prices.iloc[-4]) / close_prices.iloc[-4]) * 100 if len(close_prices) > 3 else 0
+        volume_spike = readings['volume_spike']
+        price_momentum = readings['momentum']
         
         if pd.isna(current_rsi) or pd.isna(macd_diff) or pd.isna(bb_position):
             return "N/A"
@@ -628,7 +799,9 @@ def get_technical_rating(ticker: str, timeframe: str = '1D') -> str:
         elif score >= 42: rating = "Neutral"
         elif score >= 25: rating = "Sell"
         else: rating = "Strong Sell"
-        set_cache(cache_key, rating, ttl_seconds=config.CACHE_NEWS_DATA_SECONDS) 
+        rating_ttl = market_hours.ttl_for('indicator')
+        set_cache(cache_key, rating, ttl_seconds=rating_ttl)
+        _rating_expiry[cache_key] = (norm_ticker, ticker, timeframe, time.time() + rating_ttl)
 
         return rating
             
@@ -741,7 +914,8 @@ def get_index_data_for_agent(index_name: str) -> dict:
 # screen_static_index
 def screen_static_index(index_name: str = "NIFTY 100", num_stocks: int = 3, duration_days: int = 30, prefer_buy: bool = False):
     norm_name = index_name.strip().upper()
-    ticker_list = indices.STATIC_INDICES.get(norm_name)  
+    entry = _constituents.get(norm_name) if norm_name in indices.STATIC_INDICES else None
+    ticker_list = entry['tickers'] if entry else None
 
     if ticker_list is None:
         valid_indices = list(indices.STATIC_INDICES.keys())
@@ -750,6 +924,278 @@ def screen_static_index(index_name: str = "NIFTY 100", num_stocks: int = 3, dura
 
     return screen_custom_stock_list(tickers=ticker_list, num_stocks=num_stocks, duration_days=duration_days, prefer_buy=prefer_buy, index_name_for_log=index_name)
 
+# Vectorized technical scoring for the screener
+def _score_technical_table(hist_data: dict):
+    """
+    Scores every ticker in {ticker: OHLCV DataFrame} on trend, RSI, MACD and volume.
+
+    Indicators for the whole universe come from indicator_engine as last-value
+    vectors and the scoring rules run as array masks. Returns the scored rows
+    sorted by score plus the market breadth counters (checked, in uptrend).
+    """
+    ind = indicator_engine.screen_indicators(hist_data)
+    price, rsi_val, ema_50 = ind['price'], ind['rsi'], ind['ema_50']
+    macd_hist, vol_ratio = ind['macd_hist'], ind['vol_ratio']
+
+    eligible = (ind['bars'] >= 50) & ~np.isnan(rsi_val) & ~np.isnan(ema_50)
+    uptrend = price > ema_50
+    rsi_strong = (rsi_val >= 40) & (rsi_val <= 65)
+    rsi_oversold = rsi_val < 30
+    rsi_overbought = rsi_val > 70
+    macd_bull = macd_hist > 0
+    macd_bear = macd_hist < 0
+    high_vol = vol_ratio > 1.2
+
+    score = (
+        np.where(uptrend, 20, -10)
+        + np.select([rsi_strong, rsi_oversold, rsi_overbought], [25, 30, -15], default=0)
+        + np.select([macd_bull, macd_bear], [20, -10], default=0)
+        + np.where(high_vol, 15, 0)
+    )
+
+    candidates = []
+    for i in np.flatnonzero(eligible):
+        r = rsi_val[i]
+        if rsi_strong[i]: rsi_reason = f"RSI Strong ({r:.0f})"
+        elif rsi_oversold[i]: rsi_reason = f"RSI Oversold ({r:.0f})"
+        elif rsi_overbought[i]: rsi_reason = f"RSI Overbought ({r:.0f})"
+        else: rsi_reason = f"RSI Neutral ({r:.0f})"
+
+        reasons = ["Uptrend (>50EMA)" if uptrend[i] else "Downtrend (<50EMA)", rsi_reason]
+        if macd_bull[i]: reasons.append("MACD Bullish")
+        elif macd_bear[i]: reasons.append("MACD Bearish")
+        reasons.append(f"High Vol ({vol_ratio[i]:.1f}x)" if high_vol[i] else "Vol Normal")
+
+        candidates.append({
+            'Ticker': ind['ticker'][i],
+            'Price': float(round(price[i], 2)),
+            'RSI': float(round(r, 2)),
+            'Score': int(score[i]),
+            'MACD_Signal': "Bullish" if macd_bull[i] else "Bearish",
+            'Volume_Spike': f"{vol_ratio[i]:.1f}x" if high_vol[i] else "Normal",
+            'Reasons': ", ".join(reasons)
+        })
+
+    candidates.sort(key=lambda x: x['Score'], reverse=True)
+    return candidates, int(eligible.sum()), int((eligible & uptrend).sum())
+
+# Scored screener tables, one per universe, history window and closed session
+def _screen_universe(tickers) -> list:
+    return sorted(set(t for t in tickers if isinstance(t, str) and t.endswith('.NS')))
+
+def _screen_history_days(duration_days) -> int:
+    """Rounds the requested window up to a SCREEN_HISTORY_BUCKETS entry (at least 100 days for MACD/EMA warm-up)."""
+    try: needed = max(int(duration_days), 100)
+    except (TypeError, ValueError): needed = 100
+    for bucket in sorted(config.SCREEN_HISTORY_BUCKETS):
+        if needed <= bucket: return bucket
+    return needed
+
+def get_screen_table(valid_tickers: list, history_days: int, session: Optional[date] = None):
+    """
+    Returns {"candidates", "checked", "uptrend"}: every ticker of the universe
+    scored on bars up to and including `session` (default: the last closed
+    session), ranked by technical score. Cached until the next session closes.
+    """
+    session = session or market_hours.last_closed_session()
+    digest = hashlib.sha1(",".join(valid_tickers).encode()).hexdigest()[:16]
+    cache_key = f"screen_table_{digest}_{history_days}_{session.isoformat()}"
+    table = get_cache(cache_key)
+    if table: return table
+    return _inflight.do(cache_key, _build_screen_table, valid_tickers, history_days, session, cache_key)
+
+def _build_screen_table(valid_tickers: list, history_days: int, session: date, cache_key: str):
+    table = get_cache(cache_key)
+    if table: return table
+
+    # Local bar store (one small delta download for stale tickers)
+    print(f"      [Tool] Loading historical data for {len(valid_tickers)} stocks...")
+    hist_data = ohlcv.get_history(valid_tickers, start=session - timedelta(days=history_days), end=session + timedelta(days=1))
+    if not hist_data: return None
+
+    candidates, checked, uptrend = _score_technical_table(hist_data)
+    table = {"candidates": candidates, "checked": checked, "uptrend": uptrend}
+    ttl = max(60, int((market_hours.next_settled_close() - market_hours.now_ist()).total_seconds()))
+    set_cache(cache_key, table, ttl_seconds=ttl)
+    return table
+
+def build_screen_snapshots(session: date):
+    """
+    Nightly job: scored tables for every static index and history bucket, as of `session`.
+    Raises if any table could not be built, so the job retries the session
+    (tables that did build are cached and are not rebuilt).
+    """
+    universes = {tuple(_screen_universe(_constituents.get(name)['tickers'])) for name in indices.STATIC_INDICES}
+    started = time.time()
+    built = failed = 0
+    # Longest window first, so each ticker's bar history is synced once
+    for days in sorted(config.SCREEN_HISTORY_BUCKETS, reverse=True):
+        for universe in universes:
+            if not universe: continue
+            try:
+                table = get_screen_table(list(universe), days, session)
+            except Exception as e:
+                print(f"[Warning] Screen snapshot failed ({len(universe)} tickers, {days}d): {e}")
+                table = None
+            if table: built += 1
+            else: failed += 1
+    print(f"[Screen Snapshots] Built {built} tables ({failed} failed) for {session} in {time.time() - started:.1f}s")
+    if failed:
+        raise RuntimeError(f"{failed} of {built + failed} screen tables failed for {session}")
+
+# News validation stage of the screener
+def _news_name(ticker: str, cached_only: bool = False) -> str:
+    """
+    Company name to search news for: the mapped clean name, else the listed name minus corporate suffixes.
+    With `cached_only`, fundamentals are only read from the cache (no upstream call).
+    """
+    if cached_only:
+        info = _funda_cache.get(f"funda_{ticker}") if config.CACHE_STORE else None
+    else:
+        info = get_fundamentals(ticker)
+    raw_name = info.get('shortName', info.get('longName', ticker)) if info else ticker
+    
+    # CLEAN NAME for News Search
+    # 1. First, check if we have a manually mapped clean name
+    clean_name = indices.COMPANY_NAMES.get(ticker)
+    
+    if not clean_name:
+       # 2. Fallback: Aggressive Regex Cleaning
+       # Remove LTD, LIMITED, PVT, INC, CORP, SERV, IND, SERVICES, CONSULTANCY if at end
+       # Also remove "PASS VEH" type suffixes
+       clean_name = re.sub(r'\b(LTD|LIMITED|PVT|INC|CORP|SERV|IND|INDUSTRIES|ENTERPRISES|TECHNOLOGIES|SERVICES|CONSULTANCY|SYSTEMS|GLOBAL|INDIA|PASS VEH)\b\.?', '', raw_name, flags=re.IGNORECASE).strip()
+       # Remove trailing hyphens or dots
+       clean_name = re.sub(r'[\.\-]+$', '', clean_name).strip()
+    
+    # If name became too short (<3 chars) or empty, revert to raw
+    if len(clean_name) < 3: clean_name = raw_name
+    return clean_name
+
+def _news_sentiment(ticker: str) -> dict:
+    """Headline sentiment for one ticker, cached per ticker so every screen reuses it."""
+    cache_key = f"news_sentiment_{ticker}"
+    cached = get_cache(cache_key)
+    if cached: return cached
+
+    clean_name = _news_name(ticker)
+    
+    # Fetch News with CLEAN NAME
+    news_res = get_stock_news(query=clean_name, company_name=clean_name)
+    
+    sentiment = {"Name": clean_name, "News_Score": 0, "News_Summary": "No significant news.", "Reason": "", "News_Headlines": None}
+    
+    if 'articles' in news_res and news_res['articles']:
+        headlines = [a['title'] for a in news_res['articles'][:3]]
+        
+        # Basic Keyword Sentiment (Heuristic)
+        positive_keywords = ['growth', 'profit', 'rise', 'jump', 'record', 'buy', 'bull', 'upgrade', 'expansion', 'win', 'positive', 'strong']
+        negative_keywords = ['loss', 'fall', 'drop', 'decline', 'miss', 'sell', 'bear', 'downgrade', 'fraud', 'investigation', 'negative', 'weak']
+        
+        pos_count = 0
+        neg_count = 0
+        
+        for h in headlines:
+            h_lower = h.lower()
+            if any(k in h_lower for k in positive_keywords): pos_count += 1
+            if any(k in h_lower for k in negative_keywords): neg_count += 1
+        
+        if pos_count > neg_count:
+            sentiment.update(News_Score=10, News_Summary=f"Positive Sentiment ({pos_count} bullish headlines)", Reason=", Positive News")
+        elif neg_count > pos_count:
+            # Penalize bad news heavily
+            sentiment.update(News_Score=-15, News_Summary=f"Negative Sentiment ({neg_count} bearish headlines)", Reason=", Caution (Negative News)")
+        else:
+            sentiment['News_Summary'] = "Neutral News"
+            
+        sentiment['News_Headlines'] = headlines
+    
+    set_cache(cache_key, sentiment, ttl_seconds=market_hours.ttl_for('news'))
+    return sentiment
+
+def prefetch_stock_news(names: list):
+    """
+    Looks up news for many companies with batched (OR-joined) NewsAPI queries
+    and seeds the per-name cache used by get_stock_news. Names without a hit
+    go straight to the DuckDuckGo fallback in get_stock_news.
+    """
+    todo = [n for n in dict.fromkeys(names) if n and get_cache(news_cache_key(n)) is None]
+    if len(todo) < 2: return
+    found = news_client.client.search_many(todo)
+    if not found: return
+    ttl = market_hours.ttl_for('news')
+    for name, articles in found.items():
+        if articles:
+            set_cache(news_cache_key(name), {"articles": news_client.format_articles(articles), "source": "NewsAPI"}, ttl_seconds=ttl)
+        else:
+            set_cache(f"newsapi_miss_{news_cache_key(name)}", True, ttl_seconds=ttl)
+
+def _apply_news_sentiment(p: dict, sentiment: dict) -> dict:
+    p = dict(p)
+    p['Name'] = sentiment['Name'] # Use CLEAN name for display too (prettier)
+    p['Reasons'] += sentiment['Reason']
+    if sentiment['News_Headlines']: p['News_Headlines'] = sentiment['News_Headlines']
+    p['News_Score'] = sentiment['News_Score']
+    p['Total_Score'] = p['Score'] + sentiment['News_Score']
+    p['News_Summary'] = sentiment['News_Summary']
+    return p
+
+def _news_check_candidate(p: dict) -> dict:
+    try:
+        return _apply_news_sentiment(p, _news_sentiment(p['Ticker']))
+    except Exception as e:
+        # print(f"News check failed for {p['Ticker']}: {e}")
+        return dict(p, Total_Score=p['Score'])
+
+def _validate_candidates_with_news(candidates: list) -> list:
+    """
+    Overlays news sentiment on the candidates. Cached sentiments are applied
+    directly; for the rest, news is prefetched with batched NewsAPI queries
+    and the sentiments are then computed concurrently, bounded by
+    SCREENER_NEWS_WORKERS threads and a SCREENER_NEWS_DEADLINE_SECONDS budget.
+    Candidates whose lookup misses the deadline keep their technical score and
+    are reported as having no news.
+    """
+    if not candidates: return []
+
+    cached = {p['Ticker']: get_cache(f"news_sentiment_{p['Ticker']}") for p in candidates}
+    pending = [p for p in candidates if not cached[p['Ticker']]]
+    results = {}
+
+    if pending:
+        deadline = time.time() + config.SCREENER_NEWS_DEADLINE_SECONDS
+        executor = ThreadPoolExecutor(max_workers=min(config.SCREENER_NEWS_WORKERS, len(pending)))
+
+        # One batched NewsAPI query for the whole list seeds most per-name lookups below.
+        # Names come from cached data only, and the prefetch counts against the deadline.
+        prefetch = executor.submit(prefetch_stock_news, [_news_name(p['Ticker'], cached_only=True) for p in pending])
+        try: prefetch.result(timeout=max(0, deadline - time.time()))
+        except concurrent.futures.TimeoutError: print("      [Warning] Batched news prefetch hit the deadline.")
+        except Exception as e: print(f"      [Warning] Batched news prefetch failed: {e}")
+
+        futures = {p['Ticker']: executor.submit(_news_check_candidate, p) for p in pending}
+        done, not_done = concurrent.futures.wait(futures.values(), timeout=max(0, deadline - time.time()))
+        # Don't block on stragglers; queued and running lookups finish in the background and still warm the cache
+        executor.shutdown(wait=False)
+
+        if not_done:
+            print(f"      [Tool] News validation deadline hit; {len(not_done)} candidates scored without news.")
+        results = {t: f.result() for t, f in futures.items() if f in done and f.exception() is None}
+
+    final_list = []
+    for p in candidates:
+        sentiment = cached[p['Ticker']]
+        if sentiment:
+            final_list.append(_apply_news_sentiment(p, sentiment))
+        elif p['Ticker'] in results:
+            final_list.append(results[p['Ticker']])
+        else:
+            late = dict(p)
+            late['News_Score'] = 0
+            late['Total_Score'] = late['Score']
+            late['News_Summary'] = "No significant news."
+            final_list.append(late)
+    return final_list
+
 # screen_custom_stock_list
 def screen_custom_stock_list(tickers: List[str], num_stocks: int = 10, duration_days: int = 60, prefer_buy: bool = False, index_name_for_log: str = "Custom List"):
     print(f"\n[Agent Thought] Screening {len(tickers)} stocks from {index_name_for_log} for top {num_stocks} candidates (Indicators: RSI, EMA, MACD, BB, Volume)...")
@@ -763,212 +1209,35 @@ def screen_custom_stock_list(tickers: List[str], num_stocks: int = 10, duration_
             if num_stocks <= 0: num_stocks = 5 
         except: num_stocks = 5
 
-        cache_key = f"filtered_stocks_v4_{index_name_for_log.replace(' ','_')}_{num_stocks}_{duration_days}_{prefer_buy}"
-        cached_result = get_cache(cache_key)
-        if cached_result: return cached_result
-
-        # Require enough history for MACD (26) + some buffer -> 60 days min
-        history_days_needed = max(duration_days, 100)
-        
-        end_date = date.today()
-        start_date = end_date - timedelta(days=history_days_needed)
-        valid_tickers = sorted(list(set([t for t in tickers if isinstance(t, str) and t.endswith('.NS')])))
+        valid_tickers = _screen_universe(tickers)
         if not valid_tickers: return {"error": "No valid .NS tickers found."}
         
-        # Batch download
-        print(f"      [Tool] Downloading historical data for {len(valid_tickers)} stocks...")
-        hist_data = yf.download(valid_tickers, start=start_date, end=end_date, progress=False, group_by='ticker', auto_adjust=True)
-        
-        if hist_data.empty: 
+        # Scored table for the last closed session (prebuilt nightly for static indices)
+        table = get_screen_table(valid_tickers, _screen_history_days(duration_days))
+        if not table: 
             return {"error": "yfinance download returned empty data."}
 
-        candidates = []
-        is_multi_ticker = len(valid_tickers) > 1
-        
-        # Market Breadth Counters
-        checked_stocks_count = 0
-        market_uptrend_count = 0
-
-        for ticker in valid_tickers:
-            try:
-                # Handle Data Access safe for Multi/Single index
-                if is_multi_ticker:
-                    if ticker not in hist_data.columns.levels[0]: continue
-                    stock_df = hist_data[ticker].dropna()
-                else:
-                    stock_df = hist_data.dropna()
-
-                if stock_df.empty or 'Close' not in stock_df.columns: continue
-                
-                close_prices = stock_df['Close']
-                volumes = stock_df['Volume'] if 'Volume' in stock_df.columns else None
+        candidates, checked_stocks_count, market_uptrend_count = table['candidates'], table['checked'], table['uptrend']
 
-                if len(close_prices) < 50: continue 
-
-                current_price = float(close_prices.iloc[-1])
-                
-                # --- Indicators ---
-                # 1. RSI
-                rsi_val = RSIIndicator(close_prices, window=14).rsi().iloc[-1]
-                
-                # 2. EMA/Trend
-                ema_50 = EMAIndicator(close_prices, window=50).ema_indicator().iloc[-1]
-                
-                # 3. MACD
-                macd = MACD(close_prices)
-                macd_hist = macd.macd_diff().iloc[-1]
-
-                # 4. Volume
-                vol_avg = volumes.iloc[-20:].mean() if volumes is not None else 1
-                vol_ratio = (volumes.iloc[-1] / vol_avg) if volumes is not None and vol_avg > 0 else 1.0
-
-                if pd.isna(rsi_val) or pd.isna(ema_50): continue
-
-                # --- Scoring Logic ---
-                score = 0
-                reasons = []
-
-                # Trend (50 EMA)
-                checked_stocks_count += 1
-                if current_price > ema_50: 
-                    market_uptrend_count += 1
-                    score += 20
-                    reasons.append("Uptrend (>50EMA)")
-                else: 
-                     score -= 10
-                     reasons.append("Downtrend (<50EMA)")
-
-                # RSI
-                if 40 <= rsi_val <= 65: 
-                    score += 25
-                    reasons.append(f"RSI Strong ({rsi_val:.0f})")
-                elif rsi_val < 30: 
-                    score += 30 # Oversold bounce potential
-                    reasons.append(f"RSI Oversold ({rsi_val:.0f})")
-                elif rsi_val > 70: 
-                    score -= 15 # Overbought
-                    reasons.append(f"RSI Overbought ({rsi_val:.0f})")
-                else:
-                    reasons.append(f"RSI Neutral ({rsi_val:.0f})")
-                
-                # MACD
-                if macd_hist > 0:
-                    score += 20
-                    reasons.append("MACD Bullish")
-                elif macd_hist < 0:
-                    score -= 10
-                    reasons.append("MACD Bearish")
-                
-                # Volume
-                if vol_ratio > 1.2:
-                    score += 15
-                    reasons.append(f"High Vol ({vol_ratio:.1f}x)")
-                else:
-                    reasons.append("Vol Normal")
-
-                # Final Adjustments
-                if prefer_buy and score < 35: continue 
-                
-                candidates.append({
-                    'Ticker': ticker,
-                    'Price': float(round(current_price, 2)),
-                    'RSI': float(round(rsi_val, 2)),
-                    'Score': score,
-                    'MACD_Signal': "Bullish" if macd_hist > 0 else "Bearish",
-                    'Volume_Spike': f"{vol_ratio:.1f}x" if vol_ratio > 1.2 else "Normal",
-                    'Reasons': ", ".join(reasons)
-                })
-
-            except Exception as e: 
-                continue
-
-        if not candidates:
-            return {"message": "No suitable candidates found."}
+        # Final Adjustments
+        if prefer_buy:
+            candidates = [c for c in candidates if c['Score'] >= 35]
 
         if not candidates:
             return {"message": "No suitable candidates found."}
 
-        # Sort by Score (Technical)
-        candidates.sort(key=lambda x: x['Score'], reverse=True)
-        
         # --- NEWS INTEGRATION ---
         # 1. LIMIT to Top 15 candidates for news verification (Reduced from 20/2X)
         candidates_to_analyze = candidates[:15] 
         
         print(f"      [Tool] Validating top {len(candidates_to_analyze)} candidates with live news...")
         
-        final_list = []
-        for p in candidates_to_analyze:
-            try:
-                # Get Name
-                info = get_ticker_info(p['Ticker'])
-                raw_name = info.get('shortName', info.get('longName', p['Ticker'])) if info else p['Ticker']
-                
-                # CLEAN NAME for News Search
-                # 1. First, check if we have a manually mapped clean name
-                clean_name = indices.COMPANY_NAMES.get(p['Ticker'])
-                
-                if not clean_name:
-                   # 2. Fallback: Aggressive Regex Cleaning
-                   # Remove LTD, LIMITED, PVT, INC, CORP, SERV, IND, SERVICES, CONSULTANCY if at end
-                   # Also remove "PASS VEH" type suffixes
-                   clean_name = re.sub(r'\b(LTD|LIMITED|PVT|INC|CORP|SERV|IND|INDUSTRIES|ENTERPRISES|TECHNOLOGIES|SERVICES|CONSULTANCY|SYSTEMS|GLOBAL|INDIA|PASS VEH)\b\.?', '', raw_name, flags=re.IGNORECASE).strip()
-                   # Remove trailing hyphens or dots
-                   clean_name = re.sub(r'[\.\-]+$', '', clean_name).strip()
-                
-                # If name became too short (<3 chars) or empty, revert to raw
-                if len(clean_name) < 3: clean_name = raw_name
-                
-                p['Name'] = clean_name # Use CLEAN name for display too (prettier)
-                
-                # Fetch News with CLEAN NAME
-                news_res = get_stock_news(query=clean_name, company_name=clean_name)
-                
-                news_score = 0
-                news_summary = "No significant news."
-                
-                if 'articles' in news_res and news_res['articles']:
-                    headlines = [a['title'] for a in news_res['articles'][:3]]
-                    
-                    # Basic Keyword Sentiment (Heuristic)
-                    positive_keywords = ['growth', 'profit', 'rise', 'jump', 'record', 'buy', 'bull', 'upgrade', 'expansion', 'win', 'positive', 'strong']
-                    negative_keywords = ['loss', 'fall', 'drop', 'decline', 'miss', 'sell', 'bear', 'downgrade', 'fraud', 'investigation', 'negative', 'weak']
-                    
-                    pos_count = 0
-                    neg_count = 0
-                    
-                    for h in headlines:
-                        h_lower = h.lower()
-                        if any(k in h_lower for k in positive_keywords): pos_count += 1
-                        if any(k in h_lower for k in negative_keywords): neg_count += 1
-                    
-                    if pos_count > neg_count:
-                        news_score = 10
-                        news_summary = f"Positive Sentiment ({pos_count} bullish headlines)"
-                        p['Reasons'] += ", Positive News"
-                    elif neg_count > pos_count:
-                        news_score = -15 # Penalize bad news heavily
-                        news_summary = f"Negative Sentiment ({neg_count} bearish headlines)"
-                        p['Reasons'] += ", Caution (Negative News)"
-                    else:
-                        news_summary = "Neutral News"
-                        
-                    p['News_Headlines'] = headlines
-                
-                p['News_Score'] = news_score
-                p['Total_Score'] = p['Score'] + news_score
-                p['News_Summary'] = news_summary
-                
-                final_list.append(p)
-                
-            except Exception as e:
-                # print(f"News check failed for {p['Ticker']}: {e}")
-                p['Total_Score'] = p['Score']
-                final_list.append(p)
+        final_list = _validate_candidates_with_news(candidates_to_analyze)
 
         # Re-Sort by Total Score (Tech + News)
         final_list.sort(key=lambda x: x['Total_Score'], reverse=True)
         top_picks = final_list[:num_stocks]
+        _hot_tickers.touch([p['Ticker'] for p in top_picks])
         
         print(f"      [Tool] Screening complete. Found {len(top_picks)} top candidates after news validation.")
         
@@ -984,9 +1253,7 @@ def screen_custom_stock_list(tickers: List[str], num_stocks: int = 10, duration_
         market_trend_str = f"{market_trend_label} ({breadth_pct}% of {index_name_for_log} > 50EMA)"
         print(f"      [Tool] Market Trend Calculated: {market_trend_str}")
 
-        result = {"top_filtered_stocks": top_picks, "market_trend": market_trend_str}
-        set_cache(cache_key, result, ttl_seconds=config.CACHE_NEWS_DATA_SECONDS)
-        return result
+        return {"top_filtered_stocks": top_picks, "market_trend": market_trend_str}
 
     except Exception as e:
         print(f"      [Error] Screening error: {traceback.format_exc()}")
@@ -1041,8 +1308,8 @@ def get_fundamental_data(ticker: str) -> dict:
         info = get_ticker_info(norm_t) 
         
         if not info:
-            if norm_t.endswith('.NS'):
-                # print(f"     Retrying with .BO suffix...")
+            # Only unknown symbols are retried on BSE; known listings already carry the right suffix
+            if norm_t.endswith('.NS') and not ticker_resolver.resolver.listing(norm_t):
                 alt_ticker = norm_t.replace('.NS', '.BO')
                 info = get_ticker_info(alt_ticker)
                 if info:
@@ -1106,26 +1373,17 @@ def find_intraday_trade_setups(tickers: Optional[List[str]] = None, num_setups:
     start_date = end_date - timedelta(days=history_days_needed)
     
     try:
-        hist_data = yf.download(tickers_to_scan, start=start_date, end=end_date, progress=False, auto_adjust=True)
-        if hist_data.empty or 'Close' not in hist_data.columns:
+        hist_data = ohlcv.get_history(tickers_to_scan, start=start_date, end=end_date)
+        if not hist_data:
             raise ValueError("yfinance download returned empty data.")
     except Exception as e:
         return {"error": f"Failed to download historical data for screening: {str(e)}"}
-        
-    is_multi_ticker = len(tickers_to_scan) > 1
 
     for ticker in tickers_to_scan:
         try:
-            stock_hist_data = None
-            if is_multi_ticker:
-                if ticker not in hist_data['Close'].columns or hist_data['Close'][ticker].isnull().all():
-                    continue
-                stock_hist_data = hist_data.loc[:, (slice(None), ticker)]
-                stock_hist_data.columns = stock_hist_data.columns.droplevel(1)
-            else:
-                if hist_data.empty or 'Close' not in hist_data.columns:
-                    continue
-                stock_hist_data = hist_data
+            stock_hist_data = hist_data.get(ticker)
+            if stock_hist_data is None or stock_hist_data['Close'].isnull().all():
+                continue
             
             if stock_hist_data.empty or len(stock_hist_data['Close'].dropna()) < 55:  
                 continue
@@ -1148,7 +1406,7 @@ def find_intraday_trade_setups(tickers: Optional[List[str]] = None, num_setups:
             prev_low = stock_hist_data['Low'].iloc[-2]
             prev_high = stock_hist_data['High'].iloc[-2]
             
-            info = get_ticker_info(ticker)
+            info = get_fundamentals(ticker)
             company_name = info.get('shortName', ticker) if info else ticker
             if 50 < rsi_val < 70:
                 sl_price_buy = prev_low
@@ -1218,34 +1476,27 @@ def get_stock_news(query: str, company_name: Optional[str] = None) -> dict:
     if not search_term: return {"error": "No query/company name."}
     
     # Try Cache
-    cache_key = f"news_combined_{search_term.replace(' ', '_').lower()}"
+    cache_key = news_cache_key(search_term)
     cached_result = get_cache(cache_key)
     if cached_result: return cached_result
 
-    # 1. Try NewsAPI
-    encoded_search_term = quote_plus(search_term)
-    params = {'language': 'en', 'sortBy': 'relevancy', 'pageSize': 5, 'q': encoded_search_term}
-    base_url = "https://newsapi.org/v2/everything"
-    
-    news_api_success = False
-    result = {}
-    
-    for api_key in config.NEWSAPI_KEYS:
-        params['apiKey'] = api_key
-        try:
-            response = requests.get(base_url, params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get('status') == 'ok':
-                articles = data.get('articles', [])
-                if articles:
-                    fmt_news = [{"title": a.get('title'), "source": a.get('source', {}).get('name'), "description": a.get('description'), "url": a.get('url'), "publishedAt": a.get('publishedAt')} for a in articles]
-                    result = {"articles": fmt_news, "source": "NewsAPI"}
-                    news_api_success = True
-                    break
-        except:
-             continue
+    return _inflight.do(cache_key, _fetch_stock_news, search_term, cache_key)
+
+def news_cache_key(search_term: str) -> str:
+    return f"news_combined_{search_term.replace(' ', '_').lower()}"
+
+def _fetch_stock_news(search_term: str, cache_key: str) -> dict:
+    cached_result = get_cache(cache_key)
+    if cached_result: return cached_result
+
+    # 1. Try NewsAPI (pooled session; rate-limited keys are skipped while cooling down),
+    # unless a batched query just came back without this name
+    articles = None
+    if not get_cache(f"newsapi_miss_{cache_key}"):
+        articles = news_client.client.search(search_term)
+    news_api_success = bool(articles)
+    if news_api_success:
+        result = {"articles": news_client.format_articles(articles), "source": "NewsAPI"}
     
     # 2. Fallback to DDGS if NewsAPI failed or returned empty
     if not news_api_success:
@@ -1257,7 +1508,7 @@ def get_stock_news(query: str, company_name: Optional[str] = None) -> dict:
         else:
              result = {"message": f"No news found for '{search_term}' via NewsAPI or DDGS."}
 
-    set_cache(cache_key, result, ttl_seconds=config.CACHE_NEWS_DATA_SECONDS)
+    set_cache(cache_key, result, ttl_seconds=market_hours.ttl_for('news'))
     return result
 
 def internet_search_news(query: str) -> dict:
@@ -1270,7 +1521,7 @@ def internet_search_news(query: str) -> dict:
         else:
             fmt_res = [{"title": i.get('title'), "source": i.get('source'), "description": i.get('body'), "url": i.get('url'), "publishedAt": i.get('date')} for i in results]
             result = {"articles": fmt_res}
-        set_cache(cache_key, result, ttl_seconds=config.CACHE_NEWS_DATA_SECONDS); return result
+        set_cache(cache_key, result, ttl_seconds=market_hours.ttl_for('news')); return result
     except Exception as e:
         return {"error": f"DDGS news search error: {str(e)}"}
 
@@ -1284,17 +1535,24 @@ def internet_search(query: str) -> dict:
         else:
             fmt_res = [{"title": i.get('title'), "snippet": i.get('body'), "url": i.get('href')} for i in results]
             result = {"results": fmt_res}
-        set_cache(cache_key, result, ttl_seconds=config.CACHE_NEWS_DATA_SECONDS); return result
+        set_cache(cache_key, result, ttl_seconds=market_hours.ttl_for('news')); return result
     except Exception as e: return {"error": f"DDGS search error: {str(e)}"}
 
 def get_index_constituents(index_name: str) -> dict:
+    # Registry snapshot first (static lists + persisted resolutions): a dict lookup
+    entry = _constituents.get(index_name)
+    if entry:
+        return {"index_name": index_name, "tickers": entry['tickers'], "source": entry['source'], "as_of": entry['resolved_at']}
+
     cache_key = f"constituents_{index_name.strip().upper().replace(' ', '_')}"
     cached_result = get_cache(cache_key)
     if cached_result:
         return cached_result
 
-    nse_error = None 
+    return _inflight.do(cache_key, _resolve_index_constituents, index_name, cache_key)
 
+def _constituents_from_nse(index_name: str):
+    """Returns (tickers, source) from the NSE index API, or None."""
     index_symbol_map = {
         "NIFTY 200 MOMENTUM 30": "NIFTY200 MOMENTUM 30",
     }
@@ -1324,17 +1582,23 @@ def get_index_constituents(index_name: str) -> dict:
             constituents = data.get("data", [])
 
             if constituents:
-                ticker_list = [item.get("symbol") + ".NS" for item in constituents if item.get("symbol")]
-                valid_tickers = [ticker for ticker in ticker_list if ticker is not None]
-                if valid_tickers:
-                    result = {"index_name": index_name, "tickers": valid_tickers, "source": f"NSE API ('{name_attempt}')"}
-                    set_cache(cache_key, result, ttl_seconds=3600) 
-                    return result
-
-            if nse_error is None: nse_error = f"NSE API returned empty data for '{name_attempt}'."
-
+                # NSE lists the index itself as the first row (its symbol is the index name)
+                ticker_list = [item.get("symbol") + ".NS" for item in constituents if item.get("symbol") and item.get("symbol") != name_attempt]
+                if ticker_list:
+                    return ticker_list, f"NSE API ('{name_attempt}')"
         except:
              break
+    return None
+
+def _resolve_index_constituents(index_name: str, cache_key: str) -> dict:
+    cached_result = get_cache(cache_key)
+    if cached_result:
+        return cached_result
+
+    resolved = _constituents_from_nse(index_name)
+    if resolved:
+        _constituents.put(index_name, *resolved)
+        return {"index_name": index_name, "tickers": resolved[0], "source": resolved[1]}
 
     try:
         query = f"{index_name} constituents tickers list NSE"
@@ -1392,9 +1656,8 @@ def get_index_constituents(index_name: str) -> dict:
             if not valid_tickers:
                return {"error": "Could not extract tickers."}
 
-            result = {"index_name": index_name, "tickers": valid_tickers, "source": "DDGS+AI"}
-            set_cache(cache_key, result, ttl_seconds=1800) 
-            return result
+            _constituents.put(index_name, valid_tickers, "DDGS+AI")
+            return {"index_name": index_name, "tickers": valid_tickers, "source": "DDGS+AI"}
 
         except Exception as e:
             final_error = f"Error processing AI response/DDGS fallback for '{index_name}': {e}"
@@ -1443,7 +1706,9 @@ def sync_zerodha_portfolio(user_id: str, access_token: str) -> dict:
                 'avg_price': float(item.get('average_price', 0)),
                 'exchange': item.get('exchange'), 
                 'product': item.get('product', 'CNC').upper(),
-                'prev_close_price': float(item.get('close_price', 0)) 
+                'prev_close_price': float(item.get('close_price', 0)),
+                'instrument_token': item.get('instrument_token'),
+                'isin': item.get('isin')
             }
 
         for item in positions:
@@ -1466,52 +1731,45 @@ def sync_zerodha_portfolio(user_id: str, access_token: str) -> dict:
                         'avg_price': float(item.get('average_price', 0)),
                         'exchange': exchange,
                         'product': product,
-                        'prev_close_price': float(item.get('close_price', 0))
+                        'prev_close_price': float(item.get('close_price', 0)),
+                        'instrument_token': item.get('instrument_token'),
+                        'isin': None
                     }
         
-        # 3. Database Updates
+        # 3. Map to Yahoo tickers via the instrument master (O(1) per instrument)
+        if not _instruments.stats()['instruments']:
+            try:
+                if _instruments.refresh(_fetch_instruments(kite)):
+                    _register_instruments()
+            except Exception as e:
+                print(f"[Warning] Could not download the instrument master: {e}")
+        _instruments.record_isins((item['instrument_token'], item['isin']) for item in all_instruments.values())
+
+        new_holdings = {}
+        for ticker, item in all_instruments.items():
+            exchange = item.get('exchange') or 'NSE'
+            clean_ticker = ticker.strip().upper()
+            ticker_yf = _instruments.yahoo_symbol(clean_ticker, exchange, token=item['instrument_token'], isin=item['isin']) \
+                or f"{clean_ticker}{'.BO' if exchange == 'BSE' else '.NS'}"
+
+            holding = new_holdings.get(ticker_yf)
+            if holding:
+                # Same stock held on both exchanges: one position at the blended cost
+                total_qty = holding['quantity'] + item['quantity']
+                holding['avg_price'] = (holding['avg_price'] * holding['quantity'] + item['avg_price'] * item['quantity']) / total_qty
+                holding['quantity'] = total_qty
+                continue
+            new_holdings[ticker_yf] = {
+                'quantity': item['quantity'],
+                'avg_price': item['avg_price'],
+                'product_type': item['product'],
+                'prev_close_price': item['prev_close_price']
+            }
+
+        # 4. Database Updates
         try:
-            db.reset_portfolio(user_id, float(cash_balance))
-            holdings_synced_count = 0
-            
-            MAJOR_STOCKS = [
-                'RELIANCE', 'TCS', 'HDFCBANK', 'INFY', 'ITC', 'SBIN', 'BHARTIARTL', 
-                'HINDUNILVR', 'ICICIBANK', 'KOTAKBANK', 'LT', 'AXISBANK', 'BAJFINANCE',
-                'MARUTI', 'ASIANPAINT', 'TITAN', 'ULTRACEMCO', 'SUNPHARMA', 'WIPRO',
-                'TATAMOTORS', 'ADANIENT', 'ADANIPORTS', 'POWERGRID', 'NTPC', 'ONGC'
-            ]
-
-            for ticker, item in all_instruments.items():
-                exchange = item.get('exchange', 'NSE') 
-                quantity = item.get('quantity')
-                avg_price = item.get('avg_price')
-                product = item.get('product')
-                prev_close_price = item.get('prev_close_price') 
-
-                ticker_yf = None
-                clean_ticker = ticker.strip().upper()
-                
-                if exchange == 'NSE':
-                    ticker_yf = f"{clean_ticker}.NS"
-                elif exchange == 'BSE':
-                    if clean_ticker in MAJOR_STOCKS:
-                        ticker_yf = f"{clean_ticker}.NS"
-                    else:
-                        ticker_yf = f"{clean_ticker}.BO"
-                
-                if not ticker_yf and (clean_ticker.endswith('ETF') or clean_ticker.endswith('BEES') or 'INDX' in clean_ticker):
-                    ticker_yf = f"{clean_ticker}.NS"
-                
-                if not ticker_yf:
-                    ticker_yf = f"{clean_ticker}.NS"
-
-                db.update_holding(user_id, ticker_yf, {
-                    'quantity': quantity,
-                    'avg_price': avg_price,
-                    'product_type': product,
-                    'prev_close_price': prev_close_price 
-                })
-                holdings_synced_count += 1
+            db.replace_holdings(user_id, new_holdings, float(cash_balance))
+            holdings_synced_count = len(new_holdings)
 
             current_port_value = calculate_current_portfolio_value(user_id, float(cash_balance))
             today_str = datetime.now().strftime('%Y-%m-%d')
@@ -1549,64 +1807,142 @@ def get_watchlist_for_agent(user_id: str) -> dict:
             return {"message": "User's watchlist is empty."}
         
         watchlist_items = []
-        prices = get_bulk_live_prices(tickers)
+        quotes = get_bulk_quotes(tickers)
         
         for t in tickers:
-            cp = prices.get(t)
-            if cp is None: continue
-            price_data = get_current_price(t)
-            if price_data.get("error"): continue
+            quote = quotes.get(t)
+            if quote is None: continue
             
             watchlist_items.append({
                 "ticker": t,
-                "company_name": price_data.get("company_name"),
-                "current_price": price_data.get("current_price"),
-                "change_percentage": price_data.get("change_percentage")
+                "company_name": cached_company_name(t),
+                "current_price": quote["price"],
+                "change_percentage": quote["change_percentage"]
             })
         return {"watchlist": watchlist_items}
     except Exception as e:
         print(f"     [Error] Error in get_watchlist_for_agent: {traceback.format_exc()}")
         return {"error": str(e)}
 
-# Bulk Live Prices
-def get_bulk_live_prices(tickers: list) -> dict:
+# Bulk Quotes
+def get_bulk_quotes(tickers: list) -> dict:
+    """
+    Returns {ticker: quote} for the listed (.NS/.BO) tickers, where a quote holds
+    price, previous_close, day_low, day_high, change_value and change_percentage.
+    Uncached tickers are fetched with one multi-ticker download; stale ones are
+    served while refreshed in the background.
+    """
     if not tickers: return {}
     valid_tickers = [t for t in tickers if isinstance(t, str) and (t.endswith('.NS') or t.endswith('.BO'))]
-    
+
     if not valid_tickers: return {}
+    _hot_tickers.touch(valid_tickers)
+
+    quotes, missing, stale = {}, [], []
+    for t in valid_tickers:
+        quote, fresh = get_cache_swr(f"quote_{t}")
+        if quote is None:
+            missing.append(t)
+            continue
+        quotes[t] = quote
+        if not fresh: stale.append(t)
+
+    if stale:
+        _refresher.revalidate(("quotes",) + tuple(sorted(stale)), _refresh_quotes, stale)
+    if missing:
+        fetched = _download_quotes(missing)
+        ttl = market_hours.ttl_for('price')
+        for t in missing:
+            if t not in fetched:
+                # Not in the bulk download: fall back to the price captured with the fundamentals
+                quote = _quote_from_info(get_fundamentals(t))
+                if quote: fetched[t] = quote
+            if t in fetched:
+                set_cache_swr(f"quote_{t}", fetched[t], ttl_seconds=ttl)
+        quotes.update(fetched)
+    return quotes
+
+def get_bulk_live_prices(tickers: list) -> dict:
+    return {t: q['price'] for t, q in get_bulk_quotes(tickers).items()}
+
+def _make_quote(price, previous_close, day_low, day_high) -> dict:
+    change = price - previous_close if previous_close else 0.0
+    return {
+        "price": round(price, config.PRICE_DECIMAL_PLACES),
+        "previous_close": round(previous_close, config.PRICE_DECIMAL_PLACES) if previous_close else None,
+        "day_low": round(day_low, config.PRICE_DECIMAL_PLACES),
+        "day_high": round(day_high, config.PRICE_DECIMAL_PLACES),
+        "change_value": round(change, config.PRICE_DECIMAL_PLACES),
+        "change_percentage": round(change / previous_close * 100, 2) if previous_close else 0.0,
+    }
+
+def _quote_from_info(info) -> Optional[dict]:
+    if not info or info.get('currentPrice') is None: return None
+    price = float(info['currentPrice'])
+    previous_close = info.get('previousClose')
+    return _make_quote(price, float(previous_close) if previous_close else None,
+                       float(info.get('dayLow') or price), float(info.get('dayHigh') or price))
+
+def _download_quotes(tickers: list) -> dict:
+    """Builds quotes for `tickers` from one multi-ticker daily OHLCV download (unadjusted, so previous close matches the exchange)."""
     try:
-        data = yf.download(valid_tickers, period='2d', progress=False, auto_adjust=True, ignore_tz=True)
-        if data.empty or 'Close' not in data.columns: raise ValueError("Empty bulk download")
-        prices = {}
-        close_data = data['Close'] if len(valid_tickers) > 1 else data[['Close']]
-        last_valid_index = close_data.last_valid_index()
-        if last_valid_index is None: raise ValueError("No valid close prices in bulk download.")
-        last_prices = close_data.loc[last_valid_index]
-        for ticker in valid_tickers:
-            if len(valid_tickers) > 1:
-                if ticker in last_prices.index and pd.notna(last_prices[ticker]): 
-                    prices[ticker] = float(round(last_prices[ticker], config.PRICE_DECIMAL_PLACES))
-                else:                   
-                     try: prices[ticker] = float(round(get_live_price(ticker), config.PRICE_DECIMAL_PLACES))
-                     except ValueError: pass
-            else: 
-                if pd.notna(last_prices.iloc[0]):
-                    prices[ticker] = float(round(last_prices.iloc[0], config.PRICE_DECIMAL_PLACES))
-                else:
-                     try: prices[ticker] = float(round(get_live_price(ticker), config.PRICE_DECIMAL_PLACES))
-                     except ValueError: pass
-        return prices
+        data = yf.download(tickers, period='5d', interval='1d', progress=False, auto_adjust=False,
+                           group_by='ticker', ignore_tz=True, threads=True)
     except Exception as e:
-        # Fallback
-        prices = {}
-        time.sleep(1) 
-        for t in valid_tickers:
-            try: 
-                price = get_live_price(t)
-                prices[t] = float(round(price, config.PRICE_DECIMAL_PLACES))
-                time.sleep(0.1) 
-            except ValueError: pass
-        return prices
+        print(f"      [Warning] Bulk quote download failed: {e}")
+        return {}
+    if data is None or data.empty: return {}
+
+    quotes = {}
+    for t in tickers:
+        try:
+            if isinstance(data.columns, pd.MultiIndex):
+                if t not in data.columns.get_level_values(0): continue
+                frame = data[t]
+            else:
+                frame = data
+            frame = frame.dropna(subset=['Close'])
+            if frame.empty: continue
+            last = frame.iloc[-1]
+            previous_close = float(frame['Close'].iloc[-2]) if len(frame) > 1 else None
+            quotes[t] = _make_quote(float(last['Close']), previous_close, float(last['Low']), float(last['High']))
+        except Exception as e:
+            print(f"      [Warning] Could not build quote for {t}: {e}")
+    return quotes
+
+def _refresh_quotes(tickers: list) -> int:
+    """Refreshes the cached `quote_*` entries of `tickers` from one multi-ticker download. Returns the number updated."""
+    quotes = _download_quotes(tickers)
+    price_ttl = market_hours.ttl_for('price')
+    for t, quote in quotes.items():
+        set_cache_swr(f"quote_{t}", quote, ttl_seconds=price_ttl)
+    return len(quotes)
+
+def cached_company_name(ticker: str) -> str:
+    """Company name from cached fundamentals or the static name map, without an upstream call."""
+    info = _funda_cache.get(f"funda_{ticker}") if config.CACHE_STORE else None
+    if info: return info.get('shortName', info.get('longName', ticker))
+    return indices.COMPANY_NAMES.get(ticker, ticker)
+
+# cache_key -> (norm_ticker, ticker, timeframe, expires_at) for ratings computed in this process
+_rating_expiry = {}
+
+def _refresh_hot_tickers(tickers: list) -> int:
+    """Background refresher cycle: bulk quote refresh, then ratings that expire before the next cycle."""
+    listed = [t for t in tickers if t.endswith('.NS') or t.endswith('.BO')]
+    updated = 0
+    for i in range(0, len(listed), config.REFRESH_BATCH_SIZE):
+        updated += _refresh_quotes(listed[i:i + config.REFRESH_BATCH_SIZE])
+
+    hot = set(listed)
+    horizon = time.time() + config.REFRESH_INTERVAL_SECONDS + config.REFRESH_LEAD_SECONDS
+    for cache_key, (norm_ticker, ticker, timeframe, expires_at) in list(_rating_expiry.items()):
+        if norm_ticker not in hot:
+            if expires_at < time.time(): _rating_expiry.pop(cache_key, None)
+            continue
+        if expires_at <= horizon:
+            _refresher.revalidate(cache_key, _compute_technical_rating, ticker, timeframe, cache_key, True)
+    return updated
 
 def initialize_user_account(user_id: str) -> dict:
     try:
@@ -1694,30 +2030,22 @@ def get_portfolio(user_id: str) -> dict:
         total_day_pnl = 0.0; total_prev_day_value = 0.0
 
         if tickers:
-            prices = get_bulk_live_prices(tickers)
-            infos = {}
-            max_w = min(10, len(tickers) if len(tickers) > 0 else 1) 
-            with ThreadPoolExecutor(max_workers=max_w) as executor:
-                future_to_ticker = {executor.submit(get_ticker_info, t): t for t in tickers}
-                for future in concurrent.futures.as_completed(future_to_ticker):
-                    ticker = future_to_ticker[future]
-                    try: infos[ticker] = future.result()
-                    except: infos[ticker] = None
+            quotes = get_bulk_quotes(tickers)
 
             for t, h in holdings_data.items():
                 q, avg_p = h.get('quantity', 0), h.get('avg_price', 0)
-                cp = prices.get(t, avg_p) 
+                quote = quotes.get(t)
+                cp = quote['price'] if quote else avg_p
                 
                 inv_v, curr_v = q * avg_p, q * cp; pnl = curr_v - inv_v
                 pnl_pct = (pnl / inv_v * 100) if inv_v != 0 else 0
                 total_inv += inv_v; total_curr_h_val += curr_v; total_pnl += pnl
                 
-                price_info = infos.get(t) 
-                company_name = price_info.get('shortName', t) if price_info else indices.COMPANY_NAMES.get(t, t)
+                company_name = cached_company_name(t)
                 
                 prev_close = h.get('prev_close_price') 
                 if not prev_close or prev_close == 0:
-                    prev_close = price_info.get('previousClose', cp) if price_info else cp
+                    prev_close = (quote['previous_close'] if quote else None) or cp
                 
                 approx_day_pnl = (cp - prev_close) * q
                 prev_day_value = prev_close * q
@@ -1811,8 +2139,7 @@ def execute_trade(user_id: str, ticker: str, quantity: int, action: str):
             new_qty = current_qty + quantity
             new_avg = ((current_qty * current_avg) + trade_val) / new_qty
             
-            db.update_user_cash(user_id, new_cash)
-            db.update_holding(user_id, norm_ticker, {'quantity': new_qty, 'avg_price': new_avg, 'company_name': norm_ticker})
+            db.bulk_update_holdings(user_id, {norm_ticker: {'quantity': new_qty, 'avg_price': new_avg, 'company_name': norm_ticker}}, new_cash)
 
         elif act == 'SELL':
             if current_qty < quantity: 
@@ -1821,11 +2148,8 @@ def execute_trade(user_id: str, ticker: str, quantity: int, action: str):
             new_cash = cash + trade_val
             new_qty = current_qty - quantity
             
-            db.update_user_cash(user_id, new_cash)
-            if new_qty > 0:
-                db.update_holding(user_id, norm_ticker, {'quantity': new_qty}) 
-            else:
-                db.delete_holding(user_id, norm_ticker)
+            # Cash and holding change in one write
+            db.bulk_update_holdings(user_id, {norm_ticker: {'quantity': new_qty} if new_qty > 0 else None}, new_cash)
 
         db.add_history_entry(user_id, {
             'action': act, 'ticker': norm_ticker, 'quantity': quantity, 
@@ -1848,7 +2172,7 @@ def add_to_watchlist(user_id: str, tickers: List[str]) -> dict:
     
     for t in tickers[:20]:
         norm = normalize_ticker(t)
-        if norm and get_ticker_info(norm):
+        if norm and get_fundamentals(norm):
             db.add_to_watchlist(user_id, norm)
             added.append(norm)
         else:
@@ -1973,19 +2297,23 @@ def get_stock_analysis_data(ticker, timeframe, indicators):
         # traceback.print_exc()
         return {'error': str(e)}
 
+# Shared pool so concurrent deep analyses stay under one global concurrency cap
+_deep_analysis_executor = ThreadPoolExecutor(max_workers=config.DEEP_ANALYSIS_MAX_WORKERS, thread_name_prefix="deep-analysis")
+
 def deep_screen_and_analyze(index_name: str = "NIFTY 100", target_count: int = 5, holding_period_days: int = 30):
     """
     Performs a deep multi-step analysis:
     1. Screens stocks from the given index (or 'NIFTY 50') using technical indicators.
     2. Takes the top candidates.
-    3. Fetches Fundamentals and News for each.
+    3. Fetches Fundamentals, Technical Rating and News for all candidates in parallel.
     4. Returns a rich dataset for the Agent to make final picks.
     """
     print(f"\n[Deep Analysis] Starting deep analysis for {index_name} (Target: {target_count}, Hold: {holding_period_days}d)...")
     
     # 1. Get Tickers
     norm_index = index_name.strip().upper()
-    tickers = indices.STATIC_INDICES.get(norm_index)
+    entry = _constituents.get(norm_index)
+    tickers = entry['tickers'] if entry else None
     
     if not tickers:
         print(f"      [Deep Analysis] Fetching constituents for {norm_index}...")
@@ -2011,40 +2339,58 @@ def deep_screen_and_analyze(index_name: str = "NIFTY 100", target_count: int = 5
     if "top_filtered_stocks" not in tech_results: return {"error": "Screening returned no stocks."}
     
     candidates = tech_results["top_filtered_stocks"]
-    final_candidates = []
     
-    print(f"[Deep Analysis] Deep diving into top {len(candidates)} candidates (Fundamentals + News)...")
+    print(f"[Deep Analysis] Deep diving into top {len(candidates)} candidates (Fundamentals + Technicals + News, in parallel)...")
     
+    # 3. Fan out: fundamentals, technical rating and news for every candidate at once.
+    # get_fundamental_data also asks for the technical rating; single-flight makes
+    # both requests share one history download.
+    parts = [{} for _ in candidates]
+    remaining = [3] * len(candidates)
+    tasks = {}
     for i, stock in enumerate(candidates):
         ticker = stock['Ticker']
         name = stock.get('Name', ticker)
-        print(f"   [{i+1}/{len(candidates)}] Analyzing {name} ({ticker})...")
-        
-        # 3. Fundamentals
-        funda = get_fundamental_data(ticker)
+        tasks[_deep_analysis_executor.submit(get_fundamental_data, ticker)] = (i, 'funda')
+        tasks[_deep_analysis_executor.submit(get_technical_rating, ticker)] = (i, 'tech')
+        tasks[_deep_analysis_executor.submit(get_stock_news, name)] = (i, 'news')
+
+    completed = 0
+    try:
+        for future in concurrent.futures.as_completed(tasks, timeout=config.DEEP_ANALYSIS_BUDGET_SECONDS):
+            i, kind = tasks[future]
+            try: parts[i][kind] = future.result()
+            except Exception as e: parts[i][kind] = {"error": str(e)}
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                completed += 1
+                stock = candidates[i]
+                print(f"   [{completed}/{len(candidates)}] Analyzed {stock.get('Name', stock['Ticker'])} ({stock['Ticker']})")
+    except concurrent.futures.TimeoutError:
+        print(f"[Deep Analysis] Time budget ({config.DEEP_ANALYSIS_BUDGET_SECONDS}s) exhausted with {len(candidates) - completed} candidates incomplete. Using partial data.")
+        for future in tasks:
+            future.cancel()
+
+    # 4. Merge
+    final_candidates = []
+    for stock, result in zip(candidates, parts):
+        funda = result.get('funda') or {"error": "Timed out"}
         f_health = "N/A"
         if "error" not in funda:
              pe = funda.get('peRatio', 'N/A')
              rec = funda.get('recommendation', 'N/A')
              f_health = f"PE: {pe} | Rec: {rec}"
-             print(f"      -> [Funda] {f_health}")
-        else:
-             print(f"      -> [Funda] Failed to fetch data.")
 
-        # 4. News
-        news = get_stock_news(name)
+        news = result.get('news') or {}
         n_summary = "No news found"
         if "articles" in news:
             count = len(news['articles'])
             src = news.get('source', 'Unknown')
             n_summary = f"Found {count} articles via {src}"
-            print(f"      -> [News]  {n_summary}")
-             # print(f"         Title: {news['articles'][0].get('title')[:60]}...")
-        else:
-            print(f"      -> [News]  No articles found.")
-        
-        # Merge
+
+        tech = result.get('tech')
         stock['Fundamentals'] = funda if "error" not in funda else "N/A"
+        stock['TechnicalRating'] = tech if isinstance(tech, str) else funda.get('technicalRating', 'N/A')
         stock['News'] = news.get("articles", [])[:3] if "articles" in news else [] 
         stock['AnalysisLog'] = f"Technicals: Score {stock.get('Score')} | Fundamentals: {f_health} | News: {n_summary}"
         